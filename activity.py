@@ -0,0 +1,281 @@
+"""
+activity.py - Interview activity index for MUGON HR Bot
+Handlers keep a sorted set of interviewing users scored by last_activity,
+the next reminder deadline of each session and a tiny per-user hash with
+reminder metadata. The scheduler sleeps until the earliest deadline and
+claims due sessions atomically instead of scanning every FSM session.
+
+Every session is indexed from /start on, so the archiver finds it whatever
+state it stops in.
+
+Keys:
+  hr:interview:pending   ZSET user_id -> /start time (no interview yet)
+  hr:interview:active    ZSET user_id -> last_activity (still gets reminders)
+  hr:interview:dormant   ZSET user_id -> last_activity (all reminders sent)
+  hr:interview:completed ZSET user_id -> completion time (awaiting archival)
+  hr:reminders:due       ZSET user_id -> next reminder deadline
+  hr:reminders:<user_id> HASH sent, last_sent
+  hr:reminders:wakeup    pub/sub channel, fired when a new earliest deadline appears
+"""
+import logging
+import time
+from typing import Optional
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+import redis.asyncio as aioredis
+
+from leader import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY     = "hr:interview:pending"
+ACTIVE_KEY      = "hr:interview:active"
+DORMANT_KEY     = "hr:interview:dormant"
+COMPLETED_KEY   = "hr:interview:completed"
+DUE_KEY         = "hr:reminders:due"
+WAKEUP_CHANNEL  = "hr:reminders:wakeup"
+REMINDER_PREFIX = "hr:reminders:"
+BACKFILL_MARKER = "hr:interview:backfilled:2"     # bumped when the scan indexes more
+BACKFILL_LOCK   = "hr:interview:backfilling"
+BACKFILL_LEASE  = 600       # a crashed backfill frees the lock after this
+REMINDER_TTL    = 90 * 24 * 3600
+CLAIM_LEASE     = 300       # a claimed deadline re-fires after this if not handled
+
+# KEYS = active, dormant, due; ARGV = user_id, last_activity, deadline, channel
+TOUCH_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+local first = redis.call('ZRANGE', KEYS[3], 0, 0)
+if first[1] == ARGV[1] then
+    redis.call('PUBLISH', ARGV[4], ARGV[3])
+end
+"""
+
+# KEYS = due, fence key; ARGV = now, limit, lease_until, fencing token ('' = none)
+# Pushes claimed deadlines to lease_until so no other replica takes them;
+# a caller holding an outdated fencing token gets nothing.
+CLAIM_LUA = """
+if ARGV[4] ~= '' and redis.call('GET', KEYS[2]) ~= ARGV[4] then
+    return {}
+end
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(items) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return items
+"""
+
+# KEYS = reminder hash, active, dormant, due
+# ARGV = user_id, expected sent, last_activity seen at claim, now,
+#        next deadline ('' = that was the final reminder), hash ttl
+# Returns 0 if another writer already advanced the counter, 1 if recorded,
+# 2 if recorded but the candidate has been active since (schedule untouched).
+ADVANCE_LUA = """
+local sent = tonumber(redis.call('HGET', KEYS[1], 'sent') or '0')
+if sent ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'sent', 1)
+redis.call('HSET', KEYS[1], 'last_sent', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+
+local score = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if not score or tonumber(score) ~= tonumber(ARGV[3]) then
+    return 2
+end
+if ARGV[5] == '' then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    redis.call('ZADD', KEYS[3], score, ARGV[1])
+else
+    redis.call('ZADD', KEYS[4], ARGV[5], ARGV[1])
+end
+return 1
+"""
+
+
+def reminder_key(user_id: int) -> str:
+    return f"{REMINDER_PREFIX}{user_id}"
+
+
+class ActivityIndex:
+    """Sorted-set index of interviewing users and their reminder deadlines.
+
+    ``first_reminder_after`` is the inactivity (seconds) before the first
+    reminder; later tiers are rescheduled by the scheduler itself.
+    """
+
+    def __init__(self, redis: aioredis.Redis, first_reminder_after: float = 24 * 3600):
+        self.redis = redis
+        self.first_reminder_after = first_reminder_after
+        self._touch = redis.register_script(TOUCH_LUA)
+        self._claim = redis.register_script(CLAIM_LUA)
+        self._advance = redis.register_script(ADVANCE_LUA)
+
+    async def open(self, user_id: int, ts: Optional[float] = None) -> None:
+        """/start: index the new session as pending until the interview begins.
+
+        An earlier interview still in progress stops getting reminders; a
+        completed one stays queued for archival until archived or overwritten.
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(ACTIVE_KEY, user_id)
+        pipe.zrem(DORMANT_KEY, user_id)
+        pipe.zrem(DUE_KEY, user_id)
+        pipe.delete(reminder_key(user_id))
+        pipe.zadd(PENDING_KEY, {user_id: ts or time.time()})
+        await pipe.execute()
+
+    async def start(self, user_id: int, ts: Optional[float] = None) -> None:
+        """A new interview begins: index the user and reset reminder metadata.
+
+        Also leaves the pending and archival queues: the session's keys now
+        belong to the new interview.
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(reminder_key(user_id))
+        pipe.zrem(PENDING_KEY, user_id)
+        pipe.zrem(COMPLETED_KEY, user_id)
+        await pipe.execute()
+        await self.touch(user_id, ts)
+
+    async def touch(self, user_id: int, ts: Optional[float] = None) -> None:
+        """Record candidate activity and push the next reminder deadline."""
+        ts = ts or time.time()
+        await self._touch(
+            keys=[ACTIVE_KEY, DORMANT_KEY, DUE_KEY],
+            args=[user_id, ts, ts + self.first_reminder_after, WAKEUP_CHANNEL],
+        )
+
+    async def remove(self, user_id: int) -> None:
+        """Interview no longer in progress (the completed set is left alone)."""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(PENDING_KEY, user_id)
+        pipe.zrem(ACTIVE_KEY, user_id)
+        pipe.zrem(DORMANT_KEY, user_id)
+        pipe.zrem(DUE_KEY, user_id)
+        pipe.delete(reminder_key(user_id))
+        await pipe.execute()
+
+    async def complete(self, user_id: int, ts: Optional[float] = None) -> None:
+        """Interview finalized: stop reminders, queue the session for archival."""
+        await self.remove(user_id)
+        await self.redis.zadd(COMPLETED_KEY, {user_id: ts or time.time()})
+
+    async def completed_at(self, user_id: int) -> Optional[float]:
+        """Completion time of a session still awaiting archival, else None."""
+        return await self.redis.zscore(COMPLETED_KEY, user_id)
+
+    async def older_than(self, key: str, before: float, limit: int = 200) -> list[tuple[int, float]]:
+        """Members of an index sorted set scored before ``before`` (oldest first)."""
+        rows = await self.redis.zrangebyscore(key, "-inf", before, start=0, num=limit,
+                                              withscores=True)
+        return [(int(member), score) for member, score in rows]
+
+    async def claim_due(self, now: float, limit: int = 100,
+                        lease: Optional[LeaderLease] = None) -> list[int]:
+        """Atomically take up to ``limit`` sessions whose deadline has passed."""
+        members = await self._claim(
+            keys=[DUE_KEY, lease.fence_key if lease else DUE_KEY],
+            args=[now, limit, now + CLAIM_LEASE, lease.fence if lease else ""],
+        )
+        return [int(m) for m in members]
+
+    async def reschedule(self, user_id: int, deadline: Optional[float]) -> None:
+        """Set the next deadline of a claimed session, or drop it (None)."""
+        if deadline is None:
+            await self.redis.zrem(DUE_KEY, user_id)
+        else:
+            await self.redis.zadd(DUE_KEY, {user_id: deadline})
+
+    async def next_deadline(self) -> Optional[float]:
+        first = await self.redis.zrange(DUE_KEY, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    async def session_info(self, user_ids: list[int]) -> list[tuple[Optional[float], int]]:
+        """(last_activity, reminders_sent) for each user; None if not active."""
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zscore(ACTIVE_KEY, user_id)
+            pipe.hget(reminder_key(user_id), "sent")
+        raw = await pipe.execute()
+        return [(raw[i], int(raw[i + 1] or 0)) for i in range(0, len(raw), 2)]
+
+    async def advance_reminder(self, user_id: int, expected_sent: int, last_activity: float,
+                               next_deadline: Optional[float]) -> int:
+        """Record one sent reminder with a single atomic compare-and-set.
+
+        The counter only moves from ``expected_sent``; the schedule is only
+        touched if last_activity is still the one seen at claim time, so a
+        reply from the candidate in the meantime is never overwritten.
+        After the final reminder (``next_deadline`` None) the user goes dormant.
+        """
+        return int(await self._advance(
+            keys=[reminder_key(user_id), ACTIVE_KEY, DORMANT_KEY, DUE_KEY],
+            args=[user_id, expected_sent, last_activity, time.time(),
+                  "" if next_deadline is None else next_deadline, REMINDER_TTL],
+        ))
+
+    async def count_stale(self, older_than: float) -> int:
+        return await self.redis.zcount(DORMANT_KEY, "-inf", older_than) + \
+            await self.redis.zcount(ACTIVE_KEY, "-inf", older_than)
+
+    async def backfill(self, storage: BaseStorage, bot_id: int) -> int:
+        """One-off migration: index sessions that predate the index.
+
+        Interviews go to the active set, sessions that never reached one
+        (waiting for the contact) to the pending set.
+
+        This is the only place that still scans the FSM keyspace; it runs
+        once per Redis database. BACKFILL_MARKER is only set after the scan
+        completes, so a failed scan is retried on the next start; meanwhile
+        BACKFILL_LOCK keeps other replicas from scanning at the same time.
+        """
+        if await self.redis.exists(BACKFILL_MARKER):
+            return 0
+        if not await self.redis.set(BACKFILL_LOCK, int(time.time()), nx=True, ex=BACKFILL_LEASE):
+            return 0
+        try:
+            indexed = await self._backfill_scan(storage, bot_id)
+            await self.redis.set(BACKFILL_MARKER, int(time.time()))
+        finally:
+            await self.redis.delete(BACKFILL_LOCK)
+        logger.info(f"Activity index backfilled with {indexed} interview sessions")
+        return indexed
+
+    async def _backfill_scan(self, storage: BaseStorage, bot_id: int) -> int:
+        indexed = 0
+        now = time.time()
+        async for key in self.redis.scan_iter(match="fsm:*:state", count=500):
+            state_val = await self.redis.get(key)
+            if not state_val or b"completed" in state_val:
+                continue
+            if b"interviewing" not in state_val:
+                try:
+                    user_id = int(key.decode().split(":")[-2])
+                except (ValueError, IndexError) as e:
+                    logger.warning(f"Could not parse session key {key}: {e}")
+                    continue
+                if await self.redis.zadd(PENDING_KEY, {user_id: now}, nx=True):
+                    indexed += 1
+                continue
+            try:
+                parts = key.decode().split(":")
+                chat_id, user_id = int(parts[-3]), int(parts[-2])
+                data = await storage.get_data(StorageKey(bot_id=bot_id, chat_id=chat_id,
+                                                         user_id=user_id))
+            except (ValueError, IndexError) as e:
+                logger.warning(f"Could not parse session key {key}: {e}")
+                continue
+            last_activity = data.get("last_activity") or 0
+            if not last_activity:
+                continue
+            # Already indexed (a rerun of the scan): keep its reminder schedule
+            if await self.redis.zscore(ACTIVE_KEY, user_id) is not None or \
+                    await self.redis.zscore(DORMANT_KEY, user_id) is not None:
+                continue
+            await self.touch(user_id, last_activity)
+            if data.get("reminders_sent"):
+                await self.redis.hset(reminder_key(user_id), "sent", data["reminders_sent"])
+            indexed += 1
+        return indexed
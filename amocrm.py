@@ -11,8 +11,12 @@ import os
 import time
 import logging
 import aiohttp
+from contextlib import asynccontextmanager
 from typing import Optional
 
+from metrics import AMO_TRACE
+from tracing import AMO_SPANS
+
 logger = logging.getLogger(__name__)
 
 # AmoCRM field IDs for RESUME MUGON group
@@ -107,6 +111,18 @@ class AmoCRM:
         self.access_token: Optional[str] = None
         self._token_obtained_at: float = 0  # FIX 1: track token fetch time
         self.base_url = f"https://{domain}/api/v4"
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @asynccontextmanager
+    async def _client(self):
+        """One pooled session for all calls (kept open, closed by close())."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trace_configs=[AMO_TRACE, AMO_SPANS])
+        yield self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
     async def _get_token(self) -> str:
         """Get or refresh access token. Auto-refreshes every 23 hours."""
@@ -114,7 +130,7 @@ class AmoCRM:
         if self.access_token and (time.time() - self._token_obtained_at) < TOKEN_TTL:
             return self.access_token
 
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             async with session.post(
                 f"https://{self.domain}/oauth2/access_token",
                 json={
@@ -144,7 +160,7 @@ class AmoCRM:
                                    pipeline_id: int, status_id: int) -> int:
         """Find existing lead by phone or create new one."""
         headers = await self._headers()
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             async with session.get(
                 f"{self.base_url}/contacts",
                 params={"query": phone},
@@ -264,7 +280,7 @@ class AmoCRM:
             if isinstance(stack, list):
                 add_multiselect("tech_stack", stack)
 
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             async with session.patch(
                 f"{self.base_url}/leads/{lead_id}",
                 headers=headers,
@@ -282,7 +298,7 @@ class AmoCRM:
         token = await self._get_token()
         auth_header = {"Authorization": f"Bearer {token}"}
 
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             # Step 1: upload to AmoCRM Drives
             form = aiohttp.FormData()
             form.add_field(
@@ -329,7 +345,7 @@ class AmoCRM:
     async def add_note(self, lead_id: int, text: str) -> None:
         """Add a plain text note to a lead."""
         headers = await self._headers()
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             await session.post(
                 f"{self.base_url}/leads/{lead_id}/notes",
                 headers=headers,
@@ -339,7 +355,7 @@ class AmoCRM:
     async def move_lead_to_stage(self, lead_id: int, status_id: int) -> None:
         """Move lead to a different pipeline stage."""
         headers = await self._headers()
-        async with aiohttp.ClientSession() as session:
+        async with self._client() as session:
             await session.patch(
                 f"{self.base_url}/leads/{lead_id}",
                 headers=headers,
@@ -0,0 +1,283 @@
+"""
+analytics.py - Local candidate analytics for MUGON HR Bot
+Every finished interview (the generate_ai_resume result plus tg_id, lead_id,
+timings and token usage) is written to a SQLite database, indexed by scores,
+verdict, tech stack and date, so ranked/filtered candidate lists never page
+through the rate-limited AmoCRM API.
+
+Writes happen in a worker thread (WAL mode, so the CLI can read while the bot
+writes). Several processes on one host share ANALYTICS_DB safely. It must be
+on a local disk: WAL locking does not work over network filesystems (NFS,
+SMB), so replicas on several hosts each keep their own database; a complete
+one is rebuilt on any host with ``backfill`` over the archives of all hosts.
+
+Usage:
+    python analytics.py top [--by architecture_score] [--stack fastapi ...]
+                            [--verdict "Trial Task"] [--since 2026-01-01] [--limit 20]
+    python analytics.py stats
+    python analytics.py backfill [archive_dir]   # from archive.py session files
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DB = os.environ.get("ANALYTICS_DB", "data/analytics.db")
+
+SCORES = ("total_score", "engineering_score", "ai_automation_score", "architecture_score",
+          "delivery_score", "communication_score")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS candidates (
+    interview_id      TEXT PRIMARY KEY,
+    tg_id             INTEGER,
+    lead_id           INTEGER,
+    username          TEXT,
+    full_name         TEXT,
+    started_at        REAL,
+    finished_at       REAL,
+    duration_s        REAL,
+    questions         INTEGER,
+    tokens            INTEGER,
+    status            TEXT,
+    verdict           TEXT,
+    next_step         TEXT,
+    employment_format TEXT,
+    {", ".join(f"{name} INTEGER" for name in SCORES)},
+    ai_summary        TEXT,
+    resume            TEXT
+);
+CREATE TABLE IF NOT EXISTS candidate_stack (
+    interview_id TEXT NOT NULL REFERENCES candidates(interview_id) ON DELETE CASCADE,
+    tech         TEXT NOT NULL,
+    PRIMARY KEY (tech, interview_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS candidates_verdict  ON candidates(verdict, total_score);
+CREATE INDEX IF NOT EXISTS candidates_finished ON candidates(finished_at);
+CREATE INDEX IF NOT EXISTS candidates_tg       ON candidates(tg_id);
+{"".join(f"CREATE INDEX IF NOT EXISTS candidates_{name} ON candidates({name});" for name in SCORES)}
+"""
+
+
+def normalize_stack(stack) -> list[str]:
+    """tech_stack as GPT returns it (list or comma/space separated) -> lowercase names."""
+    if isinstance(stack, str):
+        stack = stack.replace(",", " ").split()
+    if not isinstance(stack, list):
+        return []
+    return sorted({str(tech).strip().lower() for tech in stack if str(tech).strip()})
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def started_at(candidate_data: dict) -> Optional[float]:
+    if candidate_data.get("started_at"):
+        return candidate_data["started_at"]
+    # Sessions from before started_at was stored: interview_id is "<tg_id>-<unix ts>"
+    _, _, ts = str(candidate_data.get("interview_id", "")).rpartition("-")
+    return float(ts) if ts.isdigit() else None
+
+
+def candidate_row(candidate_data: dict, ai_resume: dict, tokens: Optional[int] = None,
+                  finished_at: Optional[float] = None) -> dict:
+    finished = finished_at or candidate_data.get("finished_at") or time.time()
+    started = started_at(candidate_data)
+    row = {
+        "interview_id":      candidate_data.get("interview_id")
+                             or f"{candidate_data.get('tg_id')}-{candidate_data.get('lead_id')}",
+        "tg_id":             candidate_data.get("tg_id"),
+        "lead_id":           candidate_data.get("lead_id"),
+        "username":          candidate_data.get("username"),
+        "full_name":         candidate_data.get("full_name"),
+        "started_at":        started,
+        "finished_at":       finished,
+        "duration_s":        finished - started if started else None,
+        "questions":         candidate_data.get("questions_asked"),
+        "tokens":            tokens,
+        "status":            ai_resume.get("status"),
+        "verdict":           ai_resume.get("verdict"),
+        "next_step":         ai_resume.get("next_step"),
+        "employment_format": ai_resume.get("employment_format"),
+        "ai_summary":        ai_resume.get("ai_summary"),
+        "resume":            json.dumps(ai_resume, ensure_ascii=False),
+    }
+    for name in SCORES:
+        row[name] = _int(ai_resume.get(name))
+    return row
+
+
+class AnalyticsStore:
+    """SQLite store; the connection is opened on first use."""
+
+    def __init__(self, path: str = ANALYTICS_DB):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # ------------------------------------------------------------ writes
+
+    def upsert(self, rows: Iterable[tuple[dict, list[str]]]) -> int:
+        """Insert or replace (row, stack) pairs in one transaction."""
+        count = 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for row, stack in rows:
+                    columns = ", ".join(row)
+                    marks = ", ".join(f":{name}" for name in row)
+                    conn.execute("DELETE FROM candidate_stack WHERE interview_id = ?",
+                                 (row["interview_id"],))
+                    conn.execute(f"INSERT OR REPLACE INTO candidates ({columns}) VALUES ({marks})",
+                                 row)
+                    conn.executemany("INSERT INTO candidate_stack (interview_id, tech) VALUES (?, ?)",
+                                     [(row["interview_id"], tech) for tech in stack])
+                    count += 1
+        return count
+
+    async def record(self, candidate_data: dict, ai_resume: dict,
+                     tokens: Optional[int] = None) -> None:
+        """Store one finished interview; never raises into the interview flow."""
+        row = candidate_row(candidate_data, ai_resume, tokens)
+        try:
+            await asyncio.to_thread(self.upsert, [(row, normalize_stack(ai_resume.get("tech_stack")))])
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Analytics write failed for {row['interview_id']}: {e}")
+
+    # ------------------------------------------------------------ queries
+
+    def top(self, by: str = "total_score", stack: Iterable[str] = (), verdict: Optional[str] = None,
+            since: Optional[float] = None, limit: int = 20) -> list[dict]:
+        """Candidates ranked by a score, filtered by stack (all of), verdict and date."""
+        if by not in SCORES:
+            raise ValueError(f"Unknown score {by!r}, expected one of {', '.join(SCORES)}")
+        sql = f"SELECT * FROM candidates c WHERE {by} IS NOT NULL"
+        params: list = []
+        for tech in normalize_stack(list(stack)):
+            sql += (" AND EXISTS (SELECT 1 FROM candidate_stack s"
+                    " WHERE s.tech = ? AND s.interview_id = c.interview_id)")
+            params.append(tech)
+        if verdict:
+            sql += " AND verdict = ?"
+            params.append(verdict)
+        if since:
+            sql += " AND finished_at >= ?"
+            params.append(since)
+        sql += f" ORDER BY {by} DESC, finished_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT verdict, COUNT(*) AS candidates, ROUND(AVG(total_score), 1) AS avg_score,"
+                " ROUND(AVG(duration_s) / 60, 1) AS avg_minutes, SUM(tokens) AS tokens"
+                " FROM candidates GROUP BY verdict ORDER BY candidates DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def format_top(rows: list[dict], by: str) -> str:
+    """Plain-text ranked list (Telegram /top and the CLI)."""
+    if not rows:
+        return "Кандидатов не найдено"
+    lines = []
+    for i, row in enumerate(rows, 1):
+        name = row["full_name"] or "—"
+        handle = f"@{row['username']}" if row["username"] else f"id {row['tg_id']}"
+        day = time.strftime("%Y-%m-%d", time.gmtime(row["finished_at"])) if row["finished_at"] else "—"
+        lines.append(f"{i}. {row[by]} | {name} ({handle}) | {row['verdict'] or '—'} | "
+                     f"lead {row['lead_id'] or '—'} | {day}")
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------- backfill
+
+def backfill(store: AnalyticsStore, archive_dir: str) -> tuple[int, int]:
+    """Index archived sessions that carry an ai_resume; returns (indexed, skipped)."""
+    from archive import iter_archive
+
+    rows, skipped = [], 0
+    for record in iter_archive(archive_dir):
+        data = record.get("data") or {}
+        ai_resume = data.get("ai_resume")
+        if not ai_resume:
+            # Archived before finalize kept the resume in the session
+            skipped += 1
+            continue
+        row = candidate_row(data, ai_resume, data.get("tokens"),
+                            data.get("finished_at") or record.get("archived_at"))
+        rows.append((row, normalize_stack(ai_resume.get("tech_stack"))))
+    return store.upsert(rows), skipped
+
+
+def _cli(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="analytics.py", description="Candidate analytics")
+    commands = parser.add_subparsers(dest="command", required=True)
+    top = commands.add_parser("top", help="ranked candidates")
+    top.add_argument("--by", default="total_score", choices=SCORES)
+    top.add_argument("--stack", nargs="*", default=[], help="must know all of these")
+    top.add_argument("--verdict")
+    top.add_argument("--since", help="YYYY-MM-DD")
+    top.add_argument("--limit", type=int, default=20)
+    top.add_argument("--json", action="store_true")
+    commands.add_parser("stats", help="counts and averages by verdict")
+    fill = commands.add_parser("backfill", help="index archived sessions")
+    fill.add_argument("archive_dir", nargs="?", default=os.environ.get("ARCHIVE_DIR", "archive"))
+    args = parser.parse_args(argv)
+
+    store = AnalyticsStore()
+    try:
+        if args.command == "top":
+            since = time.mktime(time.strptime(args.since, "%Y-%m-%d")) if args.since else None
+            rows = store.top(args.by, args.stack, args.verdict, since, args.limit)
+            if args.json:
+                for row in rows:
+                    row["resume"] = json.loads(row["resume"])
+                print(json.dumps(rows, ensure_ascii=False, indent=2))
+            else:
+                print(format_top(rows, args.by))
+        elif args.command == "stats":
+            for row in store.stats():
+                print(f"{row['verdict'] or '—':<20}{row['candidates']:>6}  avg {row['avg_score']}"
+                      f"  {row['avg_minutes']} min  {row['tokens'] or 0} tokens")
+        else:
+            indexed, skipped = backfill(store, args.archive_dir)
+            print(f"Indexed {indexed} archived interviews, skipped {skipped} without ai_resume")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_cli(sys.argv[1:]))
@@ -0,0 +1,245 @@
+"""
+archive.py - Session archival for MUGON HR Bot
+Streams stale (inactive > STALE_DAYS: interviews, and sessions that never got
+past /start) and completed interview sessions out of
+Redis into append-only gzip JSONL files partitioned by date, then deletes the
+FSM keys, so Redis memory is bounded by active candidates, not lifetime ones.
+
+The delete is a compare-and-delete: it only happens if the index score and
+the raw state/data bytes are still the ones that were archived. A candidate
+who writes in between (a late answer) keeps the session; the archived copy is
+then just a harmless duplicate. /start after a completed interview archives
+that session at once (archive_completed), before the new one replaces it.
+
+Usage:
+    python archive.py run                 # one archival pass
+    python archive.py restore <user_id>   # put the latest archived session back
+"""
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from activity import (ActivityIndex, ACTIVE_KEY, DORMANT_KEY, COMPLETED_KEY, DUE_KEY, PENDING_KEY,
+                      reminder_key)
+from scheduler import STALE_DAYS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR            = os.environ.get("ARCHIVE_DIR", "archive")
+COMPLETED_ARCHIVE_DAYS = float(os.environ.get("COMPLETED_ARCHIVE_DAYS", "3"))
+ARCHIVE_INTERVAL       = 3600
+BATCH_SIZE             = 200
+
+# KEYS = state, data, index, reminder hash, then every index set
+# ARGV = user_id, index score seen, state seen, data seen ('' = missing)
+# Deletes the session and its index entries only if nothing changed since
+# it was read; returns 1 if deleted, 0 if the session moved on.
+DELETE_IF_UNCHANGED_LUA = """
+local score = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if not score or tonumber(score) ~= tonumber(ARGV[2]) then
+    return 0
+end
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[3] or (redis.call('GET', KEYS[2]) or '') ~= ARGV[4] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[4])
+for i = 5, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+return 1
+"""
+
+
+def archive_path(ts: float) -> str:
+    day = time.strftime("%Y-%m-%d", time.gmtime(ts))
+    return os.path.join(ARCHIVE_DIR, day, f"sessions-{os.getpid()}.jsonl.gz")
+
+
+def _append(path: str, records: list[dict]) -> None:
+    """Append one gzip member per batch and fsync before keys are deleted."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    with open(path, "ab") as f:
+        f.write(gzip.compress(payload.encode("utf-8")))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_archive(archive_dir: str = ARCHIVE_DIR):
+    """Yield archived session records, oldest partition first."""
+    for path in sorted(glob.glob(os.path.join(archive_dir, "*", "sessions-*.jsonl.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+async def archive_batch(storage: BaseStorage, activity: ActivityIndex, bot_id: int,
+                        index_key: str, before: float, reason: str) -> int:
+    """Archive one batch of sessions from an index set; returns how many.
+
+    Counts the sessions kept because they changed meanwhile too: they left
+    ``index_key`` or are re-read with their new contents by the next batch.
+    """
+    members = await activity.older_than(index_key, before, limit=BATCH_SIZE)
+    if not members:
+        return 0
+    return await _archive_members(storage, activity, bot_id, index_key, members, reason)
+
+
+async def archive_completed(storage: BaseStorage, activity: ActivityIndex, bot_id: int,
+                            user_id: int) -> bool:
+    """Archive a completed session now (its keys are about to be reused)."""
+    score = await activity.completed_at(user_id)
+    if score is None:
+        return False
+    await _archive_members(storage, activity, bot_id, COMPLETED_KEY, [(user_id, score)], "completed")
+    return True
+
+
+async def _archive_members(storage: BaseStorage, activity: ActivityIndex, bot_id: int,
+                           index_key: str, members: list[tuple[int, float]], reason: str) -> int:
+    # Raw bytes straight from Redis (not the L1 cache): they are both the
+    # archived record and the version the delete is conditional on
+    backend = getattr(storage, "backend", storage)
+    keys = []
+    for user_id, _ in members:
+        key = StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id)
+        keys.append((backend.key_builder.build(key, "state"), backend.key_builder.build(key, "data")))
+    pipe = activity.redis.pipeline(transaction=False)
+    for state_key, data_key in keys:
+        pipe.get(state_key)
+        pipe.get(data_key)
+    raw = await pipe.execute()
+
+    now = time.time()
+    records = []
+    for i, (user_id, score) in enumerate(members):
+        state, data = raw[2 * i], raw[2 * i + 1]
+        records.append({
+            "archived_at": now,
+            "reason":      reason,
+            "bot_id":      bot_id,
+            "chat_id":     user_id,
+            "user_id":     user_id,
+            "score":       score,
+            "state":       state.decode() if state else None,
+            "data":        backend.codec.decode(data) if data else {},
+        })
+
+    # File first: a crash between the two steps duplicates, never loses
+    await asyncio.to_thread(_append, archive_path(now), records)
+
+    delete = activity.redis.register_script(DELETE_IF_UNCHANGED_LUA)
+    evict = getattr(storage, "evict", None)
+    kept = 0
+    for i, (user_id, score) in enumerate(members):
+        state_key, data_key = keys[i]
+        deleted = await delete(
+            keys=[state_key, data_key, index_key, reminder_key(user_id), PENDING_KEY, ACTIVE_KEY,
+                  DORMANT_KEY, COMPLETED_KEY, DUE_KEY],
+            args=[user_id, score, raw[2 * i] or b"", raw[2 * i + 1] or b""],
+        )
+        if not deleted:
+            kept += 1
+            continue
+        if evict:
+            await evict(state_key, data_key)
+    if kept:
+        logger.info(f"Kept {kept} {reason} sessions that changed while being archived")
+    logger.info(f"Archived {len(records) - kept} {reason} sessions")
+    return len(records)
+
+
+async def archive_sessions(storage: BaseStorage, activity: ActivityIndex, bot_id: int) -> int:
+    """Archive every stale and completed session that is due."""
+    now = time.time()
+    stale_before = now - STALE_DAYS * 24 * 3600
+    plan = [
+        (PENDING_KEY,   stale_before, "stale"),
+        (ACTIVE_KEY,    stale_before, "stale"),
+        (DORMANT_KEY,   stale_before, "stale"),
+        (COMPLETED_KEY, now - COMPLETED_ARCHIVE_DAYS * 24 * 3600, "completed"),
+    ]
+    total = 0
+    for index_key, before, reason in plan:
+        while count := await archive_batch(storage, activity, bot_id, index_key, before, reason):
+            total += count
+    return total
+
+
+async def run_archiver(storage: BaseStorage, activity: ActivityIndex, bot_id: int) -> None:
+    """Background task (leader only): archive sessions once per interval."""
+    logger.info("Archiver started")
+    while True:
+        try:
+            await archive_sessions(storage, activity, bot_id)
+        except Exception as e:
+            logger.error(f"Archiver error: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+async def restore_session(storage: BaseStorage, activity: ActivityIndex, user_id: int,
+                          archive_dir: str = ARCHIVE_DIR) -> Optional[dict]:
+    """Write the most recent archived session of ``user_id`` back into Redis."""
+    latest = None
+    for record in iter_archive(archive_dir):
+        if record["user_id"] == user_id:
+            latest = record
+    if latest is None:
+        return None
+
+    key = StorageKey(bot_id=latest["bot_id"], chat_id=latest["chat_id"], user_id=user_id)
+    await storage.set_state(key, latest["state"])
+    await storage.set_data(key, latest["data"])
+    if latest["state"] == "Interview:interviewing":
+        # Fresh activity window, otherwise the next pass archives it again
+        await activity.touch(user_id)
+    elif latest["reason"] == "completed":
+        # Back in the archival queue, with a fresh COMPLETED_ARCHIVE_DAYS window
+        await activity.complete(user_id)
+    else:
+        # Never got past /start: pending again, with a fresh STALE_DAYS window
+        await activity.open(user_id)
+    return latest
+
+
+async def _cli(argv: list[str]) -> int:
+    from aiogram import Bot
+    import redis.asyncio as aioredis
+    from dotenv import load_dotenv
+    from storage import CachedStorage, CompactRedisStorage
+
+    load_dotenv()
+    redis = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+    # Not listening, so never serves from cache; writes still invalidate the bot's caches
+    storage = CachedStorage(CompactRedisStorage(redis=redis))
+    activity = ActivityIndex(redis)
+    try:
+        if argv[:1] == ["run"]:
+            bot_id = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"]).id
+            print(f"Archived {await archive_sessions(storage, activity, bot_id)} sessions")
+        elif argv[:1] == ["restore"] and len(argv) == 2:
+            record = await restore_session(storage, activity, int(argv[1]))
+            if record is None:
+                print(f"No archived session for user {argv[1]}")
+                return 1
+            print(f"Restored user {argv[1]} ({record['reason']}, state {record['state']})")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        await storage.close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(asyncio.run(_cli(sys.argv[1:])))
@@ -0,0 +1,122 @@
+"""
+benchmarks/duplicates.py - Duplicate index: signature, load and query time
+
+Fills a temporary similarity index with N synthetic interviews (answers drawn
+from a shared Russian/English vocabulary, so unrelated candidates still share
+common n-grams, as real ones do), then times duplicate checks for fresh,
+lightly edited (near-duplicate) and unrelated candidates. Also reports the
+startup load of the index and the memory it holds (array bytes, process RSS).
+
+Usage:
+    python benchmarks/duplicates.py [--count 100000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import SimilarityIndex, phone_hash, signature     # noqa: E402
+
+WORDS = ("опыт", "проект", "команда", "разработка", "интеграция", "клиент", "задача",
+         "Python", "asyncio", "данные", "результат", "продажи", "CRM", "автоматизация",
+         "руководил", "внедрил", "сократил", "вырос", "процесс", "аналитика", "FastAPI",
+         "PostgreSQL", "Redis", "очередь", "сервис", "нагрузка", "пользователи", "бот",
+         "Telegram", "API", "тесты", "деплой", "Docker", "метрики", "архитектура", "лид",
+         "воронка", "конверсия", "бюджет", "срок", "релиз", "рефакторинг", "баг", "ревью")
+
+
+def answers(words: int = 250) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def edited(text: str, share: float = 0.1) -> str:
+    """Replace about ``share`` of the words: a pasted answer with small edits."""
+    words = text.split()
+    for i in random.sample(range(len(words)), int(len(words) * share)):
+        words[i] = random.choice(WORDS)
+    return " ".join(words)
+
+
+def rss_mib() -> float:
+    """Resident set size now (Linux), else the peak."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def millis(values: list[float]) -> str:
+    values = sorted(values)
+    return (f"p50 {values[len(values) // 2] * 1000:6.2f} ms  "
+            f"p99 {values[int(len(values) * 0.99)] * 1000:6.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(1)
+
+    texts = [answers() for _ in range(args.queries)]
+    t = time.perf_counter()
+    sigs = [signature(text) for text in texts]
+    per_sig = (time.perf_counter() - t) / len(texts)
+    print(f"signature        {per_sig * 1000:6.2f} ms per interview ({len(texts[0])} chars)")
+
+    path = os.path.join(tempfile.mkdtemp(), "analytics.db")
+    index = SimilarityIndex(path)
+    conn = index._connect()
+    t = time.perf_counter()
+    with conn:
+        rows = []
+        for i in range(args.count):
+            sig = sigs[i] if i < len(sigs) else signature(answers())
+            rows.append((f"{i}-0", i, phone_hash(f"+7900{i:07d}"), sig.tobytes(), 0.0))
+        conn.executemany("INSERT INTO signatures (interview_id, tg_id, phone_hash, signature,"
+                         " added_at) VALUES (?, ?, ?, ?, ?)", rows)
+    print(f"fill             {time.perf_counter() - t:6.1f} s for {args.count} interviews")
+
+    del rows
+    before = rss_mib()
+    t = time.perf_counter()
+    index.sync()
+    print(f"load             {time.perf_counter() - t:6.2f} s (at startup)")
+    print(f"memory           {index.memory() / 2**20:6.0f} MiB arrays, "
+          f"RSS +{rss_mib() - before:.0f} MiB (total {rss_mib():.0f} MiB)")
+
+    results = {}
+    for name, make in (("near-duplicate", lambda i: edited(texts[i])),
+                       ("unrelated", lambda i: answers())):
+        timings, flagged = [], 0
+        for i in range(args.queries):
+            text = make(i)
+            t = time.perf_counter()
+            matches = index.check_and_add(f"q-{name}-{i}", 10**9 + i, f"+7999{i:07d}", text)
+            timings.append(time.perf_counter() - t)
+            flagged += bool(matches)
+        results[name] = flagged
+        print(f"{name:<17}{millis(timings)}  flagged {flagged}/{args.queries}")
+
+    timings = []
+    for i in range(args.queries):
+        t = time.perf_counter()
+        index.check_contact(10**9 + i, f"+7900{i:07d}")
+        timings.append(time.perf_counter() - t)
+    print(f"{'contact':<17}{millis(timings)}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
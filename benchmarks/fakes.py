@@ -0,0 +1,158 @@
+"""
+benchmarks/fakes.py - Offline stand-ins for Telegram, OpenAI and AmoCRM
+Used by the benchmarks so they run without network access or secrets.
+"""
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, SendMessage
+from aiogram.types import Chat, File, Message, Update
+
+from analytics import AnalyticsStore
+from similarity import SimilarityIndex
+
+FAKE_TOKEN = "123456789:AAFakeTokenForBenchmarksOnly000000000"
+STACKS = (["Python", "FastAPI", "PostgreSQL"], ["Python", "aiogram", "Redis"],
+          ["TypeScript", "React"], "Go, Kafka, FastAPI")
+
+
+class FakeTelegramSession(BaseSession):
+    """Bot API session that answers locally after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            return Message(message_id=next(self._ids), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=method.text)
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id[-16:],
+                        file_size=20, file_path=f"documents/{method.file_id}.pdf")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b"%PDF-1.4 fake resume"
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeOpenAI:
+    """Mimics ``AsyncOpenAI().chat.completions.create`` with fixed latency."""
+
+    def __init__(self, latency: float = 0.8, finish_after: int = 30):
+        self.latency = latency
+        self.finish_after = finish_after
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model: str, messages: list, max_tokens: int, temperature: float):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if messages[0]["content"].lstrip().startswith("Ты профессиональный"):
+            # Candidate answers only: not the resume marker or mode instructions
+            answers = sum(1 for m in messages[1:] if m["role"] == "user" and not
+                          m["content"].startswith(("[", "Начни", "Кандидат прислал")))
+            content = ("Спасибо! INTERVIEW_COMPLETE" if answers >= self.finish_after
+                       else f"Вопрос {answers + 1}: расскажите подробнее о вашем опыте?")
+        else:
+            content = json.dumps({
+                "status": "Перспективный", "verdict": "Trial Task", "next_step": "Тестовое задание",
+                "total_score": 40 + self.calls * 7 % 60, "architecture_score": 30 + self.calls * 13 % 70,
+                "tech_stack": STACKS[self.calls % len(STACKS)], "ai_summary": "Benchmark", "risks": [],
+            }, ensure_ascii=False)
+        prompt = sum(len(m["content"]) for m in messages) // 3
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=60,
+                                  total_tokens=prompt + 60),
+        )
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeAmoCRM:
+    """AmoCRM client double: fixed latency, counts calls."""
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._ids = itertools.count(1000)
+
+    async def _call(self, name: str) -> None:
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency)
+
+    async def find_or_create_lead(self, **kwargs) -> int:
+        await self._call("find_or_create_lead")
+        return next(self._ids)
+
+    async def update_lead_fields(self, lead_id: int, ai_resume: dict) -> None:
+        await self._call("update_lead_fields")
+
+    async def upload_resume_file(self, lead_id: int, file_bytes, file_name: str) -> None:
+        await self._call("upload_resume_file")
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeContainer:
+    """Drop-in for container.Container holding the fakes above.
+
+    Analytics and the duplicate index are the real SQLite-backed ones, in a
+    temporary directory.
+    """
+
+    def __init__(self, openai: FakeOpenAI, amo: FakeAmoCRM):
+        self.openai = openai
+        self.amo = amo
+        path = os.path.join(tempfile.mkdtemp(), "analytics.db")
+        self.analytics = AnalyticsStore(path)
+        self.similarity = SimilarityIndex(path)
+
+    async def close(self) -> None:
+        self.analytics.close()
+        self.similarity.close()
+
+
+_update_ids = itertools.count(int(time.time() * 1000))
+
+
+def make_update(user_id: int, text: Optional[str] = None, phone: Optional[str] = None,
+                first_name: str = "Кандидат", document: Optional[str] = None) -> Update:
+    """A private-chat message update from ``user_id`` (text, shared contact or file)."""
+    payload = {
+        "message_id": next(_update_ids) % 1_000_000,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+    }
+    if phone:
+        payload["contact"] = {"phone_number": phone, "first_name": first_name, "user_id": user_id}
+    elif document:
+        payload["document"] = {"file_id": f"doc{user_id}{document}", "file_unique_id": f"u{user_id}",
+                               "file_name": document, "mime_type": "application/pdf"}
+    else:
+        payload["text"] = text or ""
+        if text and text.startswith("/"):
+            payload["entities"] = [{"type": "bot_command", "offset": 0,
+                                    "length": len(text.split()[0])}]
+    return Update.model_validate({"update_id": next(_update_ids), "message": payload})
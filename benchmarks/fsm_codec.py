@@ -0,0 +1,69 @@
+"""
+benchmarks/fsm_codec.py - FSM data encoding: size and (de)serialization time
+
+Compares RedisStorage's json.dumps text with storage.DataCodec on session data
+shaped like a real interview (Cyrillic history of N answers + questions).
+
+Usage:
+    python benchmarks/fsm_codec.py [--turns 30] [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import DataCodec      # noqa: E402
+
+WORDS = ("опыт", "проект", "команда", "разработка", "интеграция", "клиент", "задача",
+         "Python", "asyncio", "данные", "результат", "продажи", "CRM", "автоматизация",
+         "руководил", "внедрил", "сократил", "вырос", "процесс", "аналитика")
+
+
+def sentence(words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def session(turns: int) -> dict:
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": " ".join(sentence(12) for _ in range(3))})
+        history.append({"role": "assistant", "content": " ".join(sentence(10) for _ in range(2))
+                        + " Расскажите подробнее?"})
+    return {"phone": "+79001234567", "tg_id": 123456789, "username": "candidate",
+            "full_name": "Иван Петров", "last_activity": 1760000000.0,
+            "interview_id": "123456789-1760000000", "lead_id": 1001, "history": history,
+            "questions_asked": turns, "scores": {}, "finalized": False}
+
+
+def measure(name: str, encode, decode, data: dict, repeat: int) -> None:
+    blob = encode(data)
+    assert decode(blob) == data
+    enc = timeit.timeit(lambda: encode(data), number=repeat) / repeat * 1e6
+    dec = timeit.timeit(lambda: decode(blob), number=repeat) / repeat * 1e6
+    print(f"{name:<22}{len(blob):>10}{enc:>12.1f}{dec:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(1)
+
+    for turns in sorted({1, 10, args.turns}):
+        data = session(turns)
+        print(f"\n{turns} turns{'':<14}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}")
+        measure("legacy json.dumps", lambda d: json.dumps(d).encode(),
+                lambda b: json.loads(b.decode("utf-8")), data, args.repeat)
+        for compression in ("none", "zlib", "zstd"):
+            codec = DataCodec(compression)
+            measure(f"compact {compression}", codec.encode, codec.decode, data, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+benchmarks/loadtest.py - End-to-end load test with simulated candidates
+
+Every simulated candidate walks the whole funnel through the real Dispatcher
+(handlers.router and every middleware built by bot.build_dispatcher):
+
+    /start -> contact share -> interview turns -> resume upload -> finalization
+
+OpenAI, AmoCRM and the Telegram Bot API are replaced by fakes with tunable
+latency (benchmarks/fakes.py); Redis is real (REDIS_URL) or fakeredis.
+Throttling is disabled and the global daily token budget is raised: one day's
+budget is sized for real traffic, not thousands of simulated interviews
+(override through the usual THROTTLE_*/BUDGET_* env).
+
+Reported:
+  throughput        updates/s and finished interviews/min
+  latency           p50/p95/p99 of feed_update per step (turn = one answer)
+  redis ops         commands per update of each step, from a sequential
+                    calibration candidate (hr_redis_commands_total), and
+                    the average over the whole run
+  memory            peak RSS growth per concurrent session and FSM data
+                    size per candidate in Redis
+  fsm cache         share of FSM reads served by the L1 cache
+
+Usage:
+    python benchmarks/loadtest.py --fake-redis --candidates 200 --concurrency 50
+    python benchmarks/loadtest.py --gpt-latency 0 --amo-latency 0 --tg-latency 0
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before importing the bot: module-level settings are read at import time
+os.environ.setdefault("TRACE_FILE", "")
+os.environ.setdefault("THROTTLE_RATE", "0")
+os.environ.setdefault("THROTTLE_INTERVIEW_RATE", "0")
+os.environ.setdefault("BUDGET_GLOBAL_DAILY_TOKENS", "100000000000")
+
+from aiogram import Bot                                      # noqa: E402
+from aiogram.fsm.storage.base import StorageKey              # noqa: E402
+
+import bot as bot_module                                     # noqa: E402
+from benchmarks.fakes import (FAKE_TOKEN, FakeAmoCRM, FakeContainer, FakeOpenAI,  # noqa: E402
+                              FakeTelegramSession, make_update)
+from finalizer import stats as finalizer_stats                # noqa: E402
+from metrics import FSM_CACHE, REDIS_COMMANDS, instrument_redis  # noqa: E402
+from storage import CachedStorage, CompactRedisStorage       # noqa: E402
+
+STEPS = ("start", "contact", "turn", "resume", "finalize")
+USER_ID_BASE = 800_000_000
+
+
+def redis_ops() -> float:
+    return sum(child.value for child in REDIS_COMMANDS._children.values())
+
+
+def cache_hit_ratio() -> float:
+    hits = sum(c.value for (_, result), c in FSM_CACHE._children.items() if result == "hit")
+    total = sum(c.value for c in FSM_CACHE._children.values())
+    return hits / total if total else 0.0
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Candidate:
+    """One simulated candidate; ``run`` feeds its updates in order."""
+
+    def __init__(self, index: int, turns: int, resume_at: int, think: float):
+        self.user_id = USER_ID_BASE + index
+        self.turns = turns
+        self.resume_at = resume_at
+        self.think = think
+
+    def script(self):
+        yield "start", make_update(self.user_id, "/start")
+        yield "contact", make_update(self.user_id, phone=f"+7900{self.user_id % 10_000_000:07d}")
+        for turn in range(1, self.turns + 1):
+            if turn == self.resume_at:
+                yield "resume", make_update(self.user_id, document="resume.pdf")
+            # The fake OpenAI sends INTERVIEW_COMPLETE on the last question
+            kind = "finalize" if turn == self.turns else "turn"
+            yield kind, make_update(self.user_id, f"Ответ {turn}: у меня пять лет опыта в Python, "
+                                                  "asyncio и интеграциях с CRM.")
+
+    async def run(self, bot: Bot, dp, samples: dict, on_update=None) -> None:
+        for kind, update in self.script():
+            if self.think:
+                await asyncio.sleep(random.uniform(0, 2 * self.think))
+            before = redis_ops()
+            start = time.perf_counter()
+            await dp.feed_update(bot, update)
+            samples[kind].append(time.perf_counter() - start)
+            if on_update:
+                on_update(kind, redis_ops() - before)
+
+
+async def fsm_bytes(storage: CachedStorage, bot_id: int, user_ids: list[int]) -> float:
+    """Average size of the FSM data blob per candidate."""
+    sizes = []
+    for user_id in user_ids:
+        key = storage.key_builder.build(StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id),
+                                        "data")
+        sizes.append(await storage.redis.strlen(key))
+    return statistics.mean(sizes) if sizes else 0.0
+
+
+class Harness:
+    """Real Dispatcher + Redis, fake Telegram/OpenAI/AmoCRM (shared with replay.py)."""
+
+    def __init__(self, fake_redis: bool, redis_url: str, gpt_latency: float,
+                 amo_latency: float, tg_latency: float, turns: int = 30,
+                 fsm_cache: bool = True):
+        self.fake_redis = fake_redis
+        if fake_redis:
+            import fakeredis.aioredis
+            redis = fakeredis.aioredis.FakeRedis()
+        else:
+            import redis.asyncio as aioredis
+            redis = aioredis.from_url(redis_url)
+        self.redis = instrument_redis(redis)
+        self.session = FakeTelegramSession(latency=tg_latency)
+        self.bot = Bot(token=FAKE_TOKEN, session=self.session)
+        self.openai = FakeOpenAI(latency=gpt_latency, finish_after=turns)
+        self.amo = FakeAmoCRM(latency=amo_latency)
+        self.storage = CompactRedisStorage(redis=self.redis)
+        if fsm_cache:
+            self.storage = CachedStorage(self.storage)
+        self.dp = bot_module.build_dispatcher(self.bot, self.storage, self.redis,
+                                              deps=FakeContainer(self.openai, self.amo))
+        self._listener = None
+        self._finalizer = None
+
+    async def start(self) -> None:
+        if isinstance(self.storage, CachedStorage):
+            self._listener = asyncio.create_task(self.storage.listen())
+            while not self.storage.live:
+                await asyncio.sleep(0.01)
+        # Finished interviews are finalized in the background, as in production
+        self._finalizer = asyncio.create_task(self.dp["finalizer"].run(
+            block_ms=None if self.fake_redis else 1000))
+
+    async def drain(self, timeout: float = 120) -> None:
+        """Wait until the finalizer has worked off every queued interview."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = await finalizer_stats(self.redis)
+            if not stats["queued"] and not stats["pending"]:
+                return
+            await asyncio.sleep(0.05)
+
+    async def close(self) -> None:
+        await self.dp["finalizer"].stop()
+        await asyncio.gather(self._finalizer, return_exceptions=True)
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self.storage.close()
+
+    def fake_calls(self) -> str:
+        return (f"openai {self.openai.calls}, amocrm {sum(self.amo.calls.values())}, "
+                f"telegram {sum(self.session.calls.values())}")
+
+
+async def run(args) -> None:
+    harness = Harness(args.fake_redis, args.redis_url, args.gpt_latency, args.amo_latency,
+                      args.tg_latency, args.turns, not args.no_fsm_cache)
+    await harness.start()
+    bot, dp, storage = harness.bot, harness.dp, harness.storage
+    # Unique ids per run: a real Redis keeps dedup/FSM keys of previous runs
+    offset = int(time.time()) % 100_000 * 1000
+
+    # Calibration: one candidate alone, so per-step Redis counts are exact
+    calibration: dict[str, list[float]] = defaultdict(list)
+    await Candidate(offset + args.candidates, args.turns, args.resume_at, 0).run(
+        bot, dp, defaultdict(list), lambda kind, ops: calibration[kind].append(ops))
+
+    samples: dict[str, list[float]] = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    candidates = [Candidate(offset + i, args.turns, args.resume_at, args.think)
+                  for i in range(args.candidates)]
+
+    async def interview(candidate: Candidate, delay: float) -> None:
+        await asyncio.sleep(delay)
+        async with semaphore:
+            await candidate.run(bot, dp, samples)
+
+    rss_before = rss_mb()
+    ops_before = redis_ops()
+    start = time.perf_counter()
+    await asyncio.gather(*(interview(c, random.uniform(0, args.ramp)) for c in candidates))
+    elapsed = time.perf_counter() - start
+    ops = redis_ops() - ops_before
+    rss_growth = rss_mb() - rss_before
+    await harness.drain()
+    state_bytes = await fsm_bytes(storage, bot.id, [c.user_id for c in candidates[:50]])
+    await harness.close()
+
+    updates = sum(len(v) for v in samples.values())
+    finished = len(samples["finalize"])
+    sessions = min(args.concurrency, args.candidates)
+    print(f"candidates {args.candidates}, concurrency {args.concurrency}, turns {args.turns}, "
+          f"latency gpt {args.gpt_latency}s / amo {args.amo_latency}s / tg {args.tg_latency}s, "
+          f"redis {'fake' if args.fake_redis else args.redis_url}")
+    print(f"elapsed      {elapsed:8.2f} s")
+    print(f"throughput   {updates / elapsed:8.1f} updates/s, {finished / elapsed * 60:.1f} interviews/min")
+    print(f"\n{'step':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'redis ops':>11}")
+    for kind in STEPS:
+        values = samples.get(kind)
+        if not values:
+            continue
+        per_update = statistics.mean(calibration[kind]) if calibration[kind] else 0
+        print(f"{kind:<10}{len(values):>8}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{per_update:>11.1f}")
+    print(f"\nredis ops    {ops / updates:8.1f} per update (whole run, {int(ops)} total)")
+    print(f"memory       {rss_growth * 1024 / sessions:8.1f} KiB peak RSS growth per concurrent session")
+    print(f"fsm state    {state_bytes / 1024:8.1f} KiB per finished candidate")
+    print(f"fsm cache    {cache_hit_ratio() * 100:8.1f} % of state/data reads served in-process")
+    print(f"fake calls   {harness.fake_calls()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="interviews in progress at once")
+    parser.add_argument("--turns", type=int, default=30, help="interview answers per candidate")
+    parser.add_argument("--resume-at", type=int, default=5, help="upload a resume before this turn (0: never)")
+    parser.add_argument("--ramp", type=float, default=0.0, help="spread candidate arrivals over N seconds")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a candidate's messages")
+    parser.add_argument("--gpt-latency", type=float, default=0.8)
+    parser.add_argument("--amo-latency", type=float, default=0.3)
+    parser.add_argument("--tg-latency", type=float, default=0.05)
+    parser.add_argument("--fake-redis", action="store_true", help="use fakeredis instead of REDIS_URL")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--no-fsm-cache", action="store_true", help="FSM reads always go to Redis")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+benchmarks/prefilter.py - Low-effort answer filter: verdicts and cost per message
+
+Runs prefilter.classify over typical interview messages (real answers of
+several lengths, acknowledgements, emoji, garbage, a pasted question, a
+repeated answer) and prints the verdict and microseconds per call.
+
+Usage:
+    python benchmarks/prefilter.py [--repeat 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prefilter import classify      # noqa: E402
+
+QUESTION = ("Расскажите о самом сложном проекте на Python, который вы делали. "
+            "Какая была архитектура и за что отвечали лично вы?")
+ANSWER = ("Делал CRM-интеграцию для сети клиник: FastAPI, очереди на Redis, 2 млн событий "
+          "в день. Потом переписал воркеры на asyncio, задержка упала втрое.")
+HISTORY = [
+    {"role": "assistant", "content": "Сколько лет вы пишете на Python?"},
+    {"role": "user", "content": ANSWER},
+    {"role": "assistant", "content": QUESTION},
+]
+MESSAGES = (
+    ("answer, short", "5 лет, в основном бэкенд"),
+    ("answer, medium", "Самым сложным было согласовать формат событий с тремя командами."),
+    ("answer, long", ANSWER.replace("CRM", "ERP") * 8),
+    ("acknowledgement", "ок"),
+    ("yes", "Да"),
+    ("emoji", "👍👍"),
+    ("key mash", "ааааааааа"),
+    ("repetition", "asdasdasdasdasd"),
+    ("other script", "这是一个很好的问题我有很多经验"),
+    ("pasted question", QUESTION),
+    ("repeated answer", ANSWER),
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'message':<18}{'chars':>7}  {'verdict':<10}{'µs':>8}")
+    for name, text in MESSAGES:
+        verdict = classify(text, HISTORY) or "gpt"
+        us = timeit.timeit(lambda: classify(text, HISTORY), number=args.repeat) / args.repeat * 1e6
+        print(f"{name:<18}{len(text):>7}  {verdict:<10}{us:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
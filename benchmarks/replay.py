@@ -0,0 +1,189 @@
+"""
+benchmarks/replay.py - Replay recorded traffic at 1x-100x speed
+
+Plays recordings made by recorder.py (RECORD_DIR) back through the real
+Dispatcher with the loadtest harness (fake Telegram/OpenAI/AmoCRM, real or
+fake Redis). Arrival times are kept, divided by --speed; each user's updates
+stay in order, different users run concurrently, as in production.
+
+Reported: per update kind (command, contact, text, document, photo, callback)
+count and p50/p95/p99 handling latency, throughput, Redis commands per update
+and schedule lag (how late updates were fed, i.e. whether the bot kept up).
+Save a run with --out and diff a later bot version against it with --compare.
+
+Usage:
+    python benchmarks/replay.py recordings/ --speed 20 --fake-redis --out before.json
+    python benchmarks/replay.py recordings/ --speed 20 --fake-redis --compare before.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+
+from loadtest import Harness, percentile, redis_ops   # also sets up env and sys.path
+
+from aiogram.types import Update
+from recorder import iter_recording
+from webhook import update_user_id
+
+MESSAGE_KINDS = ("contact", "document", "photo")
+
+
+def update_kind(payload: dict) -> str:
+    message = payload.get("message")
+    if message:
+        for kind in MESSAGE_KINDS:
+            if kind in message:
+                return kind
+        return "command" if message.get("text", "").startswith("/") else "text"
+    if "callback_query" in payload:
+        return "callback"
+    return "other"
+
+
+def recording_files(paths: list[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "**", "*.jsonl.gz"), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def summarize(samples: dict) -> dict:
+    return {kind: {"count": len(values),
+                   "p50": percentile(values, 50) * 1000,
+                   "p95": percentile(values, 95) * 1000,
+                   "p99": percentile(values, 99) * 1000}
+            for kind, values in sorted(samples.items())}
+
+
+async def replay(args) -> dict:
+    entries = sorted(iter_recording(recording_files(args.paths)), key=lambda e: e["ts"])
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit("No recorded updates found")
+
+    harness = Harness(args.fake_redis, args.redis_url, args.gpt_latency, args.amo_latency,
+                      args.tg_latency, args.turns, not args.no_fsm_cache)
+    await harness.start()
+    bot, dp = harness.bot, harness.dp
+
+    # Fresh update ids: dedup keys of earlier replays may still be in Redis.
+    # One fresh id per recorded id, so Telegram's redeliveries stay duplicates
+    base_id = int(time.time() * 1000)
+    fresh_ids: dict[int, int] = {}
+    per_user: dict[int, list] = defaultdict(list)
+    t0 = entries[0]["ts"]
+    for entry in entries:
+        original = entry["update"].get("update_id")
+        fresh = fresh_ids.setdefault(original, base_id + len(fresh_ids))
+        payload = dict(entry["update"], update_id=fresh)
+        per_user[update_user_id(payload)].append(
+            ((entry["ts"] - t0) / args.speed, update_kind(payload),
+             Update.model_validate(payload, context={"bot": bot})))
+
+    samples: dict[str, list[float]] = defaultdict(list)
+    lags: list[float] = []
+    errors = 0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def play_user(updates: list) -> None:
+        nonlocal errors
+        for offset, kind, update in updates:
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(loop.time() - start - offset, 0))
+            t = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                errors += 1
+            samples[kind].append(time.perf_counter() - t)
+
+    ops_before = redis_ops()
+    await asyncio.gather(*(play_user(updates) for updates in per_user.values()))
+    elapsed = loop.time() - start
+    ops = redis_ops() - ops_before
+    await harness.drain()
+    await harness.close()
+
+    return {
+        "meta": {
+            "updates":      len(entries),
+            "users":        len(per_user),
+            "recorded_s":   entries[-1]["ts"] - t0,
+            "speed":        args.speed,
+            "elapsed_s":    elapsed,
+            "updates_per_s": len(entries) / elapsed if elapsed else 0.0,
+            "redis_ops_per_update": ops / len(entries),
+            "lag_p95_ms":   percentile(lags, 95) * 1000,
+            "lag_max_ms":   max(lags) * 1000,
+            "errors":       errors,
+            "fake_calls":   harness.fake_calls(),
+        },
+        "kinds": summarize(samples),
+    }
+
+
+def report(result: dict, baseline: dict = None) -> None:
+    meta = result["meta"]
+    print(f"{meta['updates']} updates from {meta['users']} users, "
+          f"{meta['recorded_s']:.0f}s recorded, replayed at {meta['speed']}x in {meta['elapsed_s']:.1f}s")
+    print(f"throughput   {meta['updates_per_s']:8.1f} updates/s")
+    print(f"redis ops    {meta['redis_ops_per_update']:8.1f} per update")
+    print(f"lag          p95 {meta['lag_p95_ms']:.1f} ms, max {meta['lag_max_ms']:.1f} ms")
+    print(f"errors       {meta['errors']}")
+    print(f"fake calls   {meta['fake_calls']}")
+    print(f"\n{'kind':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          + (f"{'Δp50':>9}{'Δp95':>9}{'Δp99':>9}" if baseline else ""))
+    for kind, row in result["kinds"].items():
+        line = (f"{kind:<10}{row['count']:>8}{row['p50']:>10.1f}{row['p95']:>10.1f}"
+                f"{row['p99']:>10.1f}")
+        before = (baseline or {}).get("kinds", {}).get(kind)
+        if before:
+            for q in ("p50", "p95", "p99"):
+                change = (row[q] - before[q]) / before[q] * 100 if before[q] else 0.0
+                line += f"{change:>+8.0f}%"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="recording files or RECORD_DIR directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 1-100")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N updates")
+    parser.add_argument("--turns", type=int, default=30, help="fake interviewer ends after N answers")
+    parser.add_argument("--gpt-latency", type=float, default=0.8)
+    parser.add_argument("--amo-latency", type=float, default=0.3)
+    parser.add_argument("--tg-latency", type=float, default=0.05)
+    parser.add_argument("--fake-redis", action="store_true", help="use fakeredis instead of REDIS_URL")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--no-fsm-cache", action="store_true", help="FSM reads always go to Redis")
+    parser.add_argument("--out", help="save results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to diff against")
+    args = parser.parse_args()
+    if not 1 <= args.speed <= 100:
+        parser.error("--speed must be between 1 and 100")
+
+    result = asyncio.run(replay(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+benchmarks/startup.py - Cold start to first processed update
+
+Runs the bot's startup path in fresh interpreters (no secrets besides a fake
+bot token, Telegram faked) and reports the median of:
+  import_ms        importing bot.py and everything it pulls in
+  build_ms         Bot + Redis storage + Dispatcher construction
+  first_update_ms  feeding a /start update through the full middleware chain
+  total_ms         process spawn to first update handled (wall clock)
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--fake-redis]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(fake_redis: bool) -> None:
+    import asyncio
+
+    t0 = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import bot as bot_module
+    from aiogram import Bot
+    from benchmarks.fakes import FAKE_TOKEN, FakeTelegramSession, make_update
+    from storage import CompactRedisStorage
+    t_import = time.perf_counter()
+
+    async def run() -> dict:
+        if fake_redis:
+            import fakeredis.aioredis
+            redis = fakeredis.aioredis.FakeRedis()
+        else:
+            import redis.asyncio as aioredis
+            redis = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+        t_build0 = time.perf_counter()
+        bot = Bot(token=FAKE_TOKEN, session=FakeTelegramSession())
+        storage = CompactRedisStorage(redis=redis)
+        dp = bot_module.build_dispatcher(bot, storage, redis)
+        t_build = time.perf_counter()
+        await dp.feed_update(bot, make_update(900_000_000 + os.getpid(), "/start"))
+        t_first = time.perf_counter()
+        await storage.close()
+        return {
+            "build_ms":        (t_build - t_build0) * 1000,
+            "first_update_ms": (t_first - t_build) * 1000,
+            "replied":         bot.session.calls["SendMessage"] > 0,
+        }
+
+    result = asyncio.run(run())
+    result["import_ms"] = (t_import - t0) * 1000
+    result["openai_imported"] = "openai" in sys.modules
+    print(json.dumps(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fake-redis", action="store_true", help="use fakeredis instead of REDIS_URL")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.fake_redis)
+        return
+
+    # Only a fake token: proves the startup path needs no other secrets
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(("AMO_", "OPENAI_", "TELEGRAM_"))}
+    env["METRICS_PORT"] = "0"
+    env["TRACE_FILE"] = ""
+
+    results = []
+    for _ in range(args.runs):
+        cmd = [sys.executable, os.path.abspath(__file__), "--child"]
+        if args.fake_redis:
+            cmd.append("--fake-redis")
+        start = time.perf_counter()
+        out = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        result["total_ms"] = (time.perf_counter() - start) * 1000
+        results.append(result)
+
+    print(f"runs: {len(results)}")
+    for key in ("import_ms", "build_ms", "first_update_ms", "total_ms"):
+        print(f"  {key:<16} {statistics.median(r[key] for r in results):8.1f}")
+    print(f"  replied          {all(r['replied'] for r in results)}")
+    print(f"  openai imported  {any(r['openai_imported'] for r in results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,224 @@
 """
 bot.py - MUGON HR Bot Entry Point
 Aiogram 3.x + Redis FSM storage + background scheduler
+
+Modes (BOT_MODE):
+  polling - single long-polling process (default)
+  webhook - aiohttp webhook server, run N replicas behind a load balancer
+  sharded - supervisor + K worker processes partitioned by user id
 """
 import asyncio
 import logging
 import os
+from typing import Optional
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.fsm.storage.base import BaseStorage
 from dotenv import load_dotenv
+import redis.asyncio as aioredis
 
-from handlers import router
-from middleware import ThrottlingMiddleware, VerificationMiddleware
-from scheduler import run_scheduler
+from activity import ActivityIndex
+from archive import run_archiver
+from budget import TokenBudget
+from container import Container
+from finalizer import InterviewFinalizer
+from handlers import PAUSE_WORDS, main_menu, router
+from idempotency import Idempotency
+from leader import run_as_leader
+from lifecycle import InFlightMiddleware, Lifecycle, cancel_and_wait
+from logconfig import LogContextMiddleware, setup_logging
+from metrics import MetricsMiddleware, instrument_redis, start_metrics_server
+from middleware import ThrottlingMiddleware, VerificationMiddleware, UpdateDedupMiddleware
+from notifier import CandidateNotifier, load_subscriptions
+from recorder import RecorderMiddleware, TrafficRecorder, build_recorder
+from scheduler import REMINDER_DELAYS_HOURS, run_scheduler
+from sender import FloodControlMiddleware, OutboundSender
+from storage import CachedStorage, CompactRedisStorage
+from supervisor import run_sharded
+from tracing import TracedStorage, TracingMiddleware, TracingRequestMiddleware
+from webhook import WebhookServer
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("logs/bot.log", encoding="utf-8"),
-    ]
-)
 logger = logging.getLogger(__name__)
 
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+def recorded_keep_texts() -> set[str]:
+    """Texts the router matches literally; the recorder must not scramble them."""
+    return {button.text for row in main_menu().keyboard for button in row} | PAUSE_WORDS
 
-async def main():
-    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"])
-    redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379")
-    storage = RedisStorage.from_url(redis_url)
-    dp = Dispatcher(storage=storage)
 
+def build_dispatcher(bot: Bot, storage: BaseStorage, redis: aioredis.Redis,
+                     lifecycle: Optional[Lifecycle] = None,
+                     deps: Optional[Container] = None,
+                     recorder: Optional[TrafficRecorder] = None) -> Dispatcher:
+    idem = Idempotency(redis)
+    budget = TokenBudget(redis)
+    deps = deps or Container()
+    sender = OutboundSender(bot, redis)
+    subscriptions = load_subscriptions(int(os.environ.get("CEO_TG_ID", "0")),
+                                       int(os.environ.get("PM_TG_ID", "0")))
+    notifier = CandidateNotifier(sender, redis, subscriptions)
+    dp = Dispatcher(storage=TracedStorage(storage), idem=idem, budget=budget,
+                    activity=ActivityIndex(redis, REMINDER_DELAYS_HOURS[0] * 3600),
+                    sender=sender, notifier=notifier,
+                    finalizer=InterviewFinalizer(redis, storage, sender, notifier, idem, budget, deps),
+                    deps=deps)
     dp.include_router(router)
-    dp.message.middleware(ThrottlingMiddleware(rate_limit=1.0, burst=5))
+    if lifecycle:
+        # Outermost: shutdown waits for every update that got this far
+        dp.update.outer_middleware(InFlightMiddleware(lifecycle))
+    if recorder:
+        # Before dedup: the recording keeps Telegram's redeliveries too
+        dp.update.outer_middleware(RecorderMiddleware(recorder))
+    # Tracing first, so the dedup check is part of the update's trace
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.update.outer_middleware(UpdateDedupMiddleware(idem))
+    bot.session.middleware(TracingRequestMiddleware())
+    # Inline replies draw from the outbound queue's global bucket
+    bot.session.middleware(FloodControlMiddleware(redis))
+    dp.message.middleware(ThrottlingMiddleware(
+        redis,
+        rate_limit=float(os.environ.get("THROTTLE_RATE", "12")),
+        burst=int(os.environ.get("THROTTLE_BURST", "5")),
+        state_limits={
+            # Every message here costs a GPT call
+            "Interview:interviewing": (
+                float(os.environ.get("THROTTLE_INTERVIEW_RATE", "20")),
+                int(os.environ.get("THROTTLE_INTERVIEW_BURST", "3")),
+            ),
+        },
+    ))
     dp.message.middleware(VerificationMiddleware())
+    # Registered last: times the handler itself, not the checks above
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+    return dp
 
-    # Remove existing webhook (we use polling)
-    await bot.delete_webhook(drop_pending_updates=True)
+
+async def run_polling(bot: Bot, dp: Dispatcher, lifecycle: Lifecycle) -> None:
+    # Remove existing webhook but keep pending updates for the new process
+    await bot.delete_webhook(drop_pending_updates=False)
+    lifecycle.on_stop(dp.stop_polling)
     logger.info("MUGON HR Bot starting in polling mode...")
+    await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES,
+                           handle_signals=False, close_bot_session=False)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, lifecycle: Lifecycle) -> None:
+    secret = os.environ["WEBHOOK_SECRET"]
+    server = WebhookServer(
+        bot, dp, secret,
+        path=os.environ.get("WEBHOOK_PATH", "/webhook"),
+        workers=int(os.environ.get("WEBHOOK_WORKERS", "32")),
+        queue_size=int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000")),
+    )
+    app = web.Application()
+    server.setup(app)
+
+    # Every replica registers the same URL; drop_pending_updates=False keeps
+    # updates Telegram buffered while we were redeploying
+    webhook_url = os.environ.get("WEBHOOK_URL")
+    if webhook_url:
+        await bot.set_webhook(
+            webhook_url + server.path,
+            secret_token=secret,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40")),
+            drop_pending_updates=False,
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.environ.get("WEBHOOK_PORT", "8080"))
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"MUGON HR Bot starting in webhook mode on {host}:{port}{server.path}")
+
+    # 503 for new updates, finish the acknowledged ones, then close the server
+    lifecycle.on_stop(lambda: server.stop_accepting(lifecycle.deadline))
+    lifecycle.on_drain(server.drain)
+    lifecycle.on_close(runner.cleanup)
+    await lifecycle.stopping.wait()
+
+
+async def main():
+    # Queue + writer thread: logging on the event loop is a queue put
+    setup_logging()
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
+
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"])
+    redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379")
+    redis = instrument_redis(aioredis.from_url(redis_url))
+    # L1 cache in front of Redis; coherent across replicas once listen() subscribes
+    storage = CachedStorage(CompactRedisStorage(redis=redis))
+    deps = Container()
+    recorder = build_recorder(recorded_keep_texts())
+    dp = build_dispatcher(bot, storage, redis, lifecycle, deps, recorder)
+    # Closed in reverse order, after in-flight updates are drained
+    lifecycle.on_close(bot.session.close)
+    lifecycle.on_close(storage.close)
+    lifecycle.on_close(deps.close)
+    if recorder:
+        lifecycle.on_close(recorder.aclose)
+    metrics_runner = await start_metrics_server(os.environ.get("METRICS_HOST", "0.0.0.0"),
+                                                int(os.environ.get("METRICS_PORT", "9100")))
+    if metrics_runner:
+        lifecycle.on_close(metrics_runner.cleanup)
+
+    # Other replicas' FSM writes evict our cached copies
+    lifecycle.spawn(storage.listen(), "fsm-cache")
+
+    # Outbound queue worker (every replica drains the shared queue);
+    # on shutdown it finishes its batch, the rest stays queued for others
+    lifecycle.spawn(dp["sender"].run(), "sender", stop=dp["sender"].stop)
+    lifecycle.spawn(dp["sender"].export_stats(), "sender-stats", stop=dp["sender"].stop)
+    # Resume, reports and CRM update of finished interviews, off the handlers' path
+    lifecycle.spawn(dp["finalizer"].run(), "finalizer", stop=dp["finalizer"].stop)
+    # Duplicate index read now, not inside the first contact share
+    lifecycle.spawn(deps.similarity.load(), "similarity-load")
+
+    # Start background scheduler (only the elected leader replica runs it);
+    # cancelling a leader job releases its lease, so another replica takes over at once
+    lifecycle.spawn(run_as_leader(
+        redis, "scheduler",
+        lambda lease: run_scheduler(bot, dp["sender"], dp["activity"], storage, lease),
+    ), "scheduler")
+    # Move stale/completed sessions out of Redis into archive files
+    lifecycle.spawn(run_as_leader(
+        redis, "archiver",
+        lambda lease: run_archiver(storage, dp["activity"], bot.id),
+    ), "archiver")
+    # Digest subscribers get buffered reports flushed on an interval
+    if any(sub.mode == "digest" for sub in dp["notifier"].subscriptions):
+        lifecycle.spawn(run_as_leader(
+            redis, "digest", lambda lease: dp["notifier"].run_digest(),
+        ), "digest")
 
-    # Start background scheduler
-    asyncio.create_task(run_scheduler(bot, redis_url))
+    mode = os.environ.get("BOT_MODE", "polling")
+    if mode == "webhook":
+        serving = asyncio.create_task(run_webhook(bot, dp, lifecycle))
+    elif mode == "sharded":
+        serving = asyncio.create_task(run_sharded(bot, redis_url, ALLOWED_UPDATES))
+        # Cancelling the supervisor SIGTERMs the workers, each drains on its own
+        lifecycle.on_stop(lambda: cancel_and_wait(serving))
+    else:
+        serving = asyncio.create_task(run_polling(bot, dp, lifecycle))
 
+    stop_requested = asyncio.create_task(lifecycle.stopping.wait())
     try:
-        await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
+        await asyncio.wait({serving, stop_requested}, return_when=asyncio.FIRST_COMPLETED)
     finally:
-        await bot.session.close()
+        stop_requested.cancel()
+        await lifecycle.shutdown()
+        await cancel_and_wait(serving)
         logger.info("MUGON HR Bot stopped")
+    if not serving.cancelled() and serving.exception():
+        raise serving.exception()
 
 
 if __name__ == "__main__":
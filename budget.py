@@ -0,0 +1,115 @@
+"""
+budget.py - GPT token budgets for MUGON HR Bot
+Per-candidate (daily + lifetime hard cap) and global daily token budgets in
+Redis. A call reserves a local estimate (prompt + max completion) atomically
+before hitting OpenAI and is settled with response.usage afterwards.
+"""
+import logging
+import os
+import time
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Every turn resends the whole history, so an interview costs quadratically:
+# 30 answers of 400-900 chars (+ questions, system prompt, the resume call)
+# come to ~140k-250k tokens. One long interview fits a day, two a lifetime.
+USER_DAILY_TOKENS   = int(os.environ.get("BUDGET_USER_DAILY_TOKENS", "300000"))
+USER_TOTAL_TOKENS   = int(os.environ.get("BUDGET_USER_TOTAL_TOKENS", "600000"))
+GLOBAL_DAILY_TOKENS = int(os.environ.get("BUDGET_GLOBAL_DAILY_TOKENS", "30000000"))
+MAX_INPUT_CHARS     = int(os.environ.get("BUDGET_MAX_INPUT_CHARS", "1500"))
+
+DAY_TTL   = 2 * 24 * 3600
+TOTAL_TTL = 180 * 24 * 3600
+
+# Reasons, in the order KEYS are checked by the script
+REASONS = ("user_daily", "user_total", "global_daily")
+
+# KEYS = user day, user total, global day; ARGV = amount, 3 limits, day ttl, total ttl
+# Returns 0 when reserved, else 1-based index of the exhausted budget
+RESERVE_LUA = """
+local amount = tonumber(ARGV[1])
+for i = 1, 3 do
+    local used = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if used + amount > tonumber(ARGV[i + 1]) then
+        return i
+    end
+end
+for i = 1, 3 do
+    redis.call('INCRBY', KEYS[i], amount)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+return 0
+"""
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of calling OpenAI when a token budget is exhausted."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """Cheap local upper-bound estimate (~3 chars/token for mixed RU/EN text)."""
+    return sum(len(m.get("content") or "") // 3 + 4 for m in messages) + 3
+
+
+def truncate_input(text: str, limit: int = MAX_INPUT_CHARS) -> str:
+    """Cut over-long candidate input before it reaches the GPT history."""
+    if len(text) <= limit:
+        return text
+    return text[:limit].rstrip() + " …[сокращено]"
+
+
+class TokenBudget:
+    """Reserve/settle token spend against per-user and global limits."""
+
+    def __init__(self, redis: aioredis.Redis, prefix: str = "hr:budget:"):
+        self.redis = redis
+        self.prefix = prefix
+        self._reserve = redis.register_script(RESERVE_LUA)
+
+    def _keys(self, user_id: int) -> list[str]:
+        day = time.strftime("%Y%m%d", time.gmtime())
+        return [
+            f"{self.prefix}user:{user_id}:{day}",
+            f"{self.prefix}user:{user_id}:total",
+            f"{self.prefix}global:{day}",
+        ]
+
+    async def reserve(self, user_id: int, amount: int) -> None:
+        """Reserve ``amount`` tokens or raise BudgetExceeded."""
+        exhausted = await self._reserve(
+            keys=self._keys(user_id),
+            args=[amount, USER_DAILY_TOKENS, USER_TOTAL_TOKENS, GLOBAL_DAILY_TOKENS,
+                  DAY_TTL, TOTAL_TTL],
+        )
+        if exhausted:
+            reason = REASONS[int(exhausted) - 1]
+            logger.warning(f"Token budget {reason} exhausted for user {user_id}")
+            raise BudgetExceeded(reason)
+
+    async def settle(self, user_id: int, reserved: int, used: int) -> None:
+        """Replace a reservation by the real usage (refund when ``used`` is 0).
+
+        Called from ``finally`` blocks: never raises, so a Redis error can't
+        replace the GPT reply or the exception being handled.
+        """
+        delta = used - reserved
+        if not delta:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self._keys(user_id):
+            pipe.incrby(key, delta)
+        try:
+            await pipe.execute()
+        except aioredis.RedisError as e:
+            logger.warning(f"Token budget settle failed for user {user_id} ({delta:+d}): {e}")
+
+    async def spent(self, user_id: int) -> int:
+        """Lifetime tokens spent on a candidate."""
+        return int(await self.redis.get(self._keys(user_id)[1]) or 0)
@@ -0,0 +1,85 @@
+"""
+container.py - Dependency container for MUGON HR Bot
+External clients (AmoCRM, OpenAI) and the local analytics and duplicate
+indexes are built lazily on first use instead of at import time, so importing
+the router needs no secrets, no openai SDK and no numpy.
+One Container is created in main() (or per shard worker) and handed to
+handlers as the ``deps`` workflow-data entry:
+
+    async def handler(message: Message, deps: Container): ...
+        await deps.amo.update_lead_fields(...)
+        await ask_hr_gpt(..., client=deps.openai)
+"""
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from amocrm import AmoCRM
+    from analytics import AnalyticsStore
+    from similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Container:
+    """Lazily constructed, process-wide clients; ``close()`` closes what was built."""
+
+    def __init__(self, env: Optional[dict] = None):
+        self.env = os.environ if env is None else env
+        self._amo: Optional["AmoCRM"] = None
+        self._openai: Optional["AsyncOpenAI"] = None
+        self._analytics: Optional["AnalyticsStore"] = None
+        self._similarity: Optional["SimilarityIndex"] = None
+
+    @property
+    def amo(self) -> "AmoCRM":
+        if self._amo is None:
+            from amocrm import AmoCRM
+
+            self._amo = AmoCRM(
+                domain=self.env["AMO_DOMAIN"],
+                client_id=self.env["AMO_CLIENT_ID"],
+                client_secret=self.env["AMO_CLIENT_SECRET"],
+                redirect_uri=self.env["AMO_REDIRECT_URI"],
+                refresh_token=self.env["AMO_REFRESH_TOKEN"],
+            )
+        return self._amo
+
+    @property
+    def openai(self) -> "AsyncOpenAI":
+        if self._openai is None:
+            # The SDK is the heaviest import of the bot: deferred to first GPT call
+            from openai import AsyncOpenAI
+
+            self._openai = AsyncOpenAI(api_key=self.env["OPENAI_API_KEY"])
+        return self._openai
+
+    @property
+    def analytics(self) -> "AnalyticsStore":
+        if self._analytics is None:
+            from analytics import ANALYTICS_DB, AnalyticsStore
+
+            self._analytics = AnalyticsStore(self.env.get("ANALYTICS_DB", ANALYTICS_DB))
+        return self._analytics
+
+    @property
+    def similarity(self) -> "SimilarityIndex":
+        if self._similarity is None:
+            # numpy is only imported here; bot/supervisor load the index at startup
+            from analytics import ANALYTICS_DB
+            from similarity import SimilarityIndex
+
+            self._similarity = SimilarityIndex(self.env.get("ANALYTICS_DB", ANALYTICS_DB))
+        return self._similarity
+
+    async def close(self) -> None:
+        if self._amo is not None:
+            await self._amo.close()
+        if self._openai is not None:
+            await self._openai.close()
+        if self._analytics is not None:
+            self._analytics.close()
+        if self._similarity is not None:
+            self._similarity.close()
@@ -0,0 +1,265 @@
+"""
+finalizer.py - Background interview finalization for MUGON HR Bot
+finalize_interview only marks the session completed and queues a job on a
+Redis stream, so the candidate's last answer is acknowledged at once. The
+slow part runs in finalizer workers (every replica):
+
+  1. AI resume (GPT), stored in the session while it is still this interview
+  2. analytics row and duplicate check
+  3. CEO/PM notification            (outbox, claimed once per interview)
+  4. the candidate's result message (outbox, high lane, claimed once)
+  5. AmoCRM lead update
+
+Delivery is at-least-once, like the sender's: a job is acked once done. A
+failed job, or one left by a worker that died, stays pending and is taken
+over after RECLAIM_IDLE_MS; after MAX_ATTEMPTS deliveries it is moved to
+hr:finalize:dead. A resume already stored in the session is reused on retry.
+
+Usage:
+    python finalizer.py stats
+    python finalizer.py requeue-dead [limit]   # after fixing the cause
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+from typing import Optional
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from budget import TokenBudget
+from container import Container
+from gpt import generate_ai_resume
+from idempotency import Idempotency
+from notifier import CandidateNotifier
+from sender import OutboundSender
+
+logger = logging.getLogger(__name__)
+
+STREAM          = "hr:finalize"
+DEAD_STREAM     = "hr:finalize:dead"
+GROUP           = "finalizers"
+STREAM_MAXLEN   = 100_000
+BATCH_SIZE      = 10                # jobs run concurrently, each a GPT call
+RECLAIM_IDLE_MS = 60_000            # also the retry delay of a failed job
+MAX_ATTEMPTS    = int(os.environ.get("FINALIZE_MAX_ATTEMPTS", "5"))
+
+RESULT_MESSAGE = (
+    "Ваше собеседование завершено.\n\n"
+    "Ваш итоговый балл: *{score}/100*\n\n"
+    "Наша команда рассмотрит вашу кандидатуру и свяжется с вами в течение 2-3 рабочих дней.\n\n"
+    "Хотите узнать больше о наших проектах?"
+)
+
+
+class InterviewFinalizer:
+    """Durable queue of finished interviews and the worker that finalizes them."""
+
+    def __init__(self, redis: aioredis.Redis, storage: BaseStorage, sender: OutboundSender,
+                 notifier: CandidateNotifier, idem: Idempotency, budget: TokenBudget,
+                 deps: Container):
+        self.redis = redis
+        self.storage = storage
+        self.sender = sender
+        self.notifier = notifier
+        self.idem = idem
+        self.budget = budget
+        self.deps = deps
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = asyncio.Event()
+
+    async def enqueue(self, key: StorageKey, data: dict, user_name: str,
+                      reply_markup: Optional[dict] = None) -> str:
+        """Queue a finished interview; ``data`` is the session snapshot to finalize."""
+        job = {"bot_id": key.bot_id, "chat_id": key.chat_id, "user_id": key.user_id,
+               "user_name": user_name, "data": data, "reply_markup": reply_markup}
+        return await self.redis.xadd(STREAM, {"job": json.dumps(job, ensure_ascii=False)},
+                                     maxlen=STREAM_MAXLEN, approximate=True)
+
+    async def _finalize(self, job: dict) -> None:
+        data      = job["data"]
+        user_id   = job["user_id"]
+        lead_id   = data.get("lead_id")
+        history   = data.get("history", [])
+        interview_id = data.get("interview_id") or f"{data.get('tg_id')}-{lead_id}"
+        state = FSMContext(self.storage, StorageKey(bot_id=job["bot_id"], chat_id=job["chat_id"],
+                                                    user_id=user_id))
+        # /start during finalization begins a new session: leave that one alone
+        session = await state.get_data()
+        same_session = session.get("interview_id") == interview_id
+
+        ai_resume = session.get("ai_resume") if same_session else None
+        if not ai_resume:
+            ai_resume = await generate_ai_resume(history, job["user_name"], budget=self.budget,
+                                                 user_id=user_id, client=self.deps.openai)
+        # This interview's tokens (resume included); None for sessions started without a baseline
+        tokens = None
+        if data.get("tokens_at_start") is not None:
+            tokens = max(await self.budget.spent(user_id) - data["tokens_at_start"], 0)
+        finished_at = data.get("finished_at")
+        if same_session:
+            # Kept in the session too, so archived sessions can be re-indexed (analytics backfill)
+            await state.update_data(ai_resume=ai_resume, finished_at=finished_at, tokens=tokens)
+        await self.deps.analytics.record(data, ai_resume, tokens)
+
+        # Contact-share matches are re-checked too: interviews finished in the meantime
+        duplicates = await self.deps.similarity.finished(interview_id, data.get("tg_id"),
+                                                         data.get("phone", ""), history)
+        if duplicates and same_session:
+            await state.update_data(duplicates=duplicates)
+
+        # A claim is released when its enqueue fails, so the retried job sends it
+        if await self.idem.claim(f"notify:{interview_id}"):
+            try:
+                await self.notifier.notify({**data, "duplicates": duplicates}, ai_resume)
+            except BaseException:
+                await self.idem.release(f"notify:{interview_id}")
+                raise
+        if await self.idem.claim(f"result:{interview_id}"):
+            kwargs = {"parse_mode": "Markdown"}
+            if job.get("reply_markup"):
+                kwargs["reply_markup"] = job["reply_markup"]
+            try:
+                await self.sender.send(job["chat_id"],
+                                       RESULT_MESSAGE.format(score=ai_resume.get("total_score", "-")),
+                                       lane="high", **kwargs)
+            except BaseException:
+                await self.idem.release(f"result:{interview_id}")
+                raise
+        if lead_id:
+            await self.deps.amo.update_lead_fields(lead_id, ai_resume)
+
+    async def _process(self, entry_id, fields: dict) -> None:
+        try:
+            job = json.loads(fields[b"job"])
+        except (KeyError, ValueError) as e:
+            logger.error(f"Malformed finalize job {entry_id}: {e}")
+            await self.redis.xack(STREAM, GROUP, entry_id)
+            return
+        try:
+            await self._finalize(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Stays pending: reclaimed and retried after RECLAIM_IDLE_MS
+            logger.error(f"Finalizing user {job.get('user_id')} failed, will retry: {e}")
+            return
+        await self.redis.xack(STREAM, GROUP, entry_id)
+
+    async def _dead_letter(self, entry_id, fields: dict, attempts: int) -> None:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(DEAD_STREAM, {**fields, b"attempts": attempts},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack(STREAM, GROUP, entry_id)
+        await pipe.execute()
+        logger.error(f"Finalize job {entry_id} dead-lettered after {attempts} attempts")
+
+    async def _ensure_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _reclaim(self) -> None:
+        """Retry failed jobs and take over those of a worker that died."""
+        _, entries, *_ = await self.redis.xautoclaim(STREAM, GROUP, self.consumer,
+                                                     min_idle_time=RECLAIM_IDLE_MS,
+                                                     count=BATCH_SIZE)
+        retry = []
+        for entry_id, fields in entries:
+            pending = await self.redis.xpending_range(STREAM, GROUP, min=entry_id, max=entry_id,
+                                                      count=1)
+            attempts = pending[0]["times_delivered"] if pending else 1
+            if attempts > MAX_ATTEMPTS:
+                await self._dead_letter(entry_id, fields, attempts - 1)
+            else:
+                retry.append((entry_id, fields))
+        if retry:
+            logger.info(f"Retrying {len(retry)} pending finalize jobs")
+            await asyncio.gather(*(self._process(entry_id, fields) for entry_id, fields in retry))
+
+    async def run(self, block_ms: Optional[int] = 1000) -> None:
+        """Finalizer worker loop; safe to run in every replica.
+
+        ``block_ms=None`` polls instead (fakeredis blocks the whole event loop).
+        """
+        await self._ensure_group()
+        logger.info(f"Interview finalizer {self.consumer} started")
+        loop = asyncio.get_running_loop()
+        next_reclaim = 0.0
+        while not self._stopping.is_set():
+            try:
+                if loop.time() >= next_reclaim:
+                    await self._reclaim()
+                    next_reclaim = loop.time() + RECLAIM_IDLE_MS / 1000 / 2
+                resp = await self.redis.xreadgroup(GROUP, self.consumer, {STREAM: ">"},
+                                                   count=BATCH_SIZE, block=block_ms)
+                if not resp and block_ms is None:
+                    await asyncio.sleep(0.05)
+                for _, entries in resp or []:
+                    await asyncio.gather(*(self._process(entry_id, fields)
+                                           for entry_id, fields in entries))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Interview finalizer loop error: {e}")
+                await asyncio.sleep(1)
+        logger.info(f"Interview finalizer {self.consumer} stopped")
+
+    async def stop(self) -> None:
+        """Finish the jobs in hand and leave run(); the rest stays queued."""
+        self._stopping.set()
+
+
+async def requeue_dead(redis: aioredis.Redis, limit: int = 100) -> int:
+    """Put dead-lettered jobs back on the stream (after fixing the cause)."""
+    entries = await redis.xrange(DEAD_STREAM, count=limit)
+    for entry_id, fields in entries:
+        pipe = redis.pipeline(transaction=True)
+        pipe.xadd(STREAM, {"job": fields[b"job"]}, maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xdel(DEAD_STREAM, entry_id)
+        await pipe.execute()
+    return len(entries)
+
+
+async def stats(redis: aioredis.Redis) -> dict:
+    """Jobs not yet read, jobs in progress or awaiting retry, dead letters."""
+    try:
+        groups = await redis.xinfo_groups(STREAM)
+    except ResponseError:
+        groups = []
+    info = next((g for g in groups if g.get("name") in (GROUP, GROUP.encode())), None) or {}
+    return {
+        "queued":  int(info.get("lag") or 0),
+        "pending": int(info.get("pending") or 0),
+        "dead":    await redis.xlen(DEAD_STREAM),
+    }
+
+
+async def _cli(argv: list[str]) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    redis = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+    try:
+        if argv[:1] == ["stats"]:
+            print(await stats(redis))
+        elif argv[:1] == ["requeue-dead"] and len(argv) <= 2:
+            limit = int(argv[1]) if len(argv) == 2 else 100
+            print(f"Requeued {await requeue_dead(redis, limit)} finalize jobs")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        await redis.aclose()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(asyncio.run(_cli(sys.argv[1:])))
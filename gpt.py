@@ -2,13 +2,18 @@
 gpt.py - MUGON HR Bot: OpenAI GPT-4 integration
 Professional HR agent with 30-question interview protocol
 """
-import os
 import json
 import logging
-from openai import AsyncOpenAI
+from typing import TYPE_CHECKING, Optional
+
+from budget import TokenBudget, estimate_tokens
+from metrics import GPT_SECONDS, GPT_TOKENS
+from tracing import span
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
-client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
 
 # System prompt for the HR agent
 SYSTEM_PROMPT = ("""
@@ -53,42 +58,73 @@ risks, next_step, project_fit, ai_summary
 """)
 
 
-async def ask_hr_gpt(history: list, mode: str, user_name: str = "") -> str:
+def record_usage(mode: str, usage, s=None) -> None:
+    if usage:
+        if s:
+            s.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        GPT_TOKENS.labels(mode=mode, kind="prompt").inc(usage.prompt_tokens)
+        GPT_TOKENS.labels(mode=mode, kind="completion").inc(usage.completion_tokens)
+
+
+async def ask_hr_gpt(history: list, mode: str, user_name: str = "",
+                     budget: Optional[TokenBudget] = None, user_id: int = 0,
+                     *, client: "AsyncOpenAI") -> str:
+    """One interviewer turn. Raises BudgetExceeded before any OpenAI call."""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if mode == "START_INTERVIEW":
+        messages.append({
+            "role": "user",
+            "content": "Начни собеседование с " + (user_name or "кандидатом") + ". Представься и задай первый вопрос."
+        })
+    elif mode == "RESUME_RECEIVED":
+        messages.extend(history)
+        messages.append({"role": "user", "content": "Кандидат прислал резюме. Задай только недостающие вопросы."})
+    else:
+        messages.extend(history)
+
+    max_tokens = 600
+    reserved = estimate_tokens(messages) + max_tokens
+    if budget:
+        await budget.reserve(user_id, reserved)
+
+    used = 0
     try:
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        if mode == "START_INTERVIEW":
-            messages.append({
-                "role": "user",
-                "content": "Начни собеседование с " + (user_name or "кандидатом") + ". Представься и задай первый вопрос."
-            })
-        elif mode == "RESUME_RECEIVED":
-            messages.extend(history)
-            messages.append({"role": "user", "content": "Кандидат прислал резюме. Задай только недостающие вопросы."})
-        else:
-            messages.extend(history)
-        response = await client.chat.completions.create(
-            model="gpt-4o", messages=messages, max_tokens=600, temperature=0.7
-        )
+        with GPT_SECONDS.labels(mode=mode).time(), span("openai.chat", mode=mode) as s:
+            response = await client.chat.completions.create(
+                model="gpt-4o", messages=messages, max_tokens=max_tokens, temperature=0.7
+            )
+        record_usage(mode, response.usage, s)
+        used = response.usage.total_tokens if response.usage else reserved
         return response.choices[0].message.content.strip()
     except Exception as e:
         logger.error(f"GPT error: {e}")
         return "Извините, техническая ошибка. Попробуйте снова."
+    finally:
+        if budget:
+            await budget.settle(user_id, reserved, used)
 
 
-async def generate_ai_resume(history: list, user_name: str = "") -> dict:
+async def generate_ai_resume(history: list, user_name: str = "",
+                             budget: Optional[TokenBudget] = None, user_id: int = 0,
+                             *, client: "AsyncOpenAI") -> dict:
+    """Structured resume. Never refused by budget, but its usage is recorded."""
     try:
         transcript = "\n".join([
             ("Кандидат" if m["role"] == "user" else "HR") + ": " + m["content"]
             for m in history
         ])
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": RESUME_PROMPT},
-                {"role": "user", "content": "Транскрипт собеседования с " + user_name + ":\n\n" + transcript}
-            ],
-            max_tokens=2000, temperature=0.3
-        )
+        with GPT_SECONDS.labels(mode="RESUME").time(), span("openai.chat", mode="RESUME") as s:
+            response = await client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": RESUME_PROMPT},
+                    {"role": "user", "content": "Транскрипт собеседования с " + user_name + ":\n\n" + transcript}
+                ],
+                max_tokens=2000, temperature=0.3
+            )
+        record_usage("RESUME", response.usage, s)
+        if budget and response.usage:
+            await budget.settle(user_id, 0, response.usage.total_tokens)
         raw = response.choices[0].message.content.strip()
         if "```" in raw:
             parts = raw.split("\n", 1)
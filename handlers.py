@@ -6,7 +6,10 @@ FIXES:
   - last_activity: recorded on every candidate message for scheduler
   - finalize_interview: idempotent guard (finalized flag) + removed duplicate trigger
   - import time added
+  - idempotency keys on lead creation, resume upload and CEO/PM notification
+  - activity index (sorted set) maintained here so the scheduler never scans
 """
+import asyncio
 import os
 import time
 import logging
@@ -15,31 +18,46 @@ from aiogram.types import (
     Message, CallbackQuery,
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardRemove, KeyboardButtonRequestContact
+    ReplyKeyboardRemove,
 )
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from gpt import ask_hr_gpt, generate_ai_resume
-from amocrm import AmoCRM
-from notifier import notify_ceo_pm
+from gpt import ask_hr_gpt
+from activity import ActivityIndex
+from archive import archive_completed
+from analytics import SCORES, format_top
+from budget import BudgetExceeded, TokenBudget, truncate_input
+from container import Container
+from finalizer import InterviewFinalizer
+from idempotency import Idempotency
+from logconfig import bind
+from metrics import PREFILTERED
+from notifier import CandidateNotifier
+from prefilter import MAX_SKIPS, MERGE_REASONS, classify, nudge
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-amo = AmoCRM(
-    domain=os.environ["AMO_DOMAIN"],
-    client_id=os.environ["AMO_CLIENT_ID"],
-    client_secret=os.environ["AMO_CLIENT_SECRET"],
-    redirect_uri=os.environ["AMO_REDIRECT_URI"],
-    refresh_token=os.environ["AMO_REFRESH_TOKEN"],
-)
-
-CEO_TG_ID   = int(os.environ.get("CEO_TG_ID", "0"))
-PM_TG_ID    = int(os.environ.get("PM_TG_ID", "0"))
 PIPELINE_ID = int(os.environ.get("AMO_PIPELINE_ID", "10599910"))
 STATUS_NEW  = int(os.environ.get("AMO_STATUS_NEW", "83583878"))
 
+# Replies used instead of a GPT call when a token budget is exhausted
+BUDGET_REPLIES = {
+    "user_daily": (
+        "Спасибо за подробные ответы! На сегодня мы обсудили достаточно — "
+        "давайте продолжим завтра. Ваш прогресс сохранён."
+    ),
+    "global_daily": (
+        "Сейчас у нас очень много кандидатов. Ваш ответ сохранён — "
+        "продолжим чуть позже, я напомню о себе."
+    ),
+    "user_total": (
+        "Вы уже проходили собеседование с нами, повторно пройти его нельзя. "
+        "Команда рассмотрит вашу кандидатуру и свяжется с вами."
+    ),
+}
+
 
 # FSM States
 class Interview(StatesGroup):
@@ -50,6 +68,9 @@ class Interview(StatesGroup):
     completed          = State()
 
 
+PAUSE_WORDS = {"стоп", "пауза", "позже", "потом"}
+
+
 # Keyboards
 def main_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
@@ -83,8 +104,11 @@ def projects_inline() -> InlineKeyboardMarkup:
 
 # /start
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, activity: ActivityIndex):
+    # A finished interview not archived yet is archived before its keys are reused
+    await archive_completed(state.storage, activity, state.key.bot_id, message.from_user.id)
     await state.clear()
+    await activity.open(message.from_user.id)
     name = message.from_user.first_name or "кандидат"
     await message.answer(
         f"Привет, {name}!\n\n"
@@ -96,30 +120,54 @@ async def cmd_start(message: Message, state: FSMContext):
     await state.set_state(Interview.waiting_contact)
 
 
+# /top - ranked candidates from the local analytics store (report recipients only)
+@router.message(Command("top"))
+async def cmd_top(message: Message, command: CommandObject, notifier: CandidateNotifier,
+                  deps: Container):
+    if message.from_user.id not in {sub.recipient_id for sub in notifier.subscriptions}:
+        return
+    args = (command.args or "").split()
+    by = args.pop(0) if args and args[0] in SCORES else "total_score"
+    rows = await asyncio.to_thread(deps.analytics.top, by, args, None, None, 20)
+    stack = f", стек: {' '.join(args)}" if args else ""
+    await message.answer(f"Топ-{len(rows)} по {by}{stack}\n\n" + format_top(rows, by))
+
+
 # Contact / Phone Verification
 @router.message(Interview.waiting_contact, F.contact)
-async def got_contact(message: Message, state: FSMContext, bot: Bot):
+async def got_contact(message: Message, state: FSMContext, bot: Bot, idem: Idempotency,
+                      budget: TokenBudget, activity: ActivityIndex, deps: Container):
     contact = message.contact
     phone   = contact.phone_number
     user    = message.from_user
+    now     = time.time()
 
     await state.update_data(
         phone=phone,
         tg_id=user.id,
         username=user.username or "",
         full_name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
-        last_activity=time.time(),   # FIX 2b: record activity time
+        last_activity=now,   # FIX 2b: record activity time
+        started_at=now,
+        interview_id=f"{user.id}-{int(now)}",
     )
     await state.set_state(Interview.phone_verified)
 
-    lead_id = await amo.find_or_create_lead(
+    # Retried contact share must not create a second lead
+    lead_id = await idem.once(f"lead:{user.id}:{phone}", lambda: deps.amo.find_or_create_lead(
         name=f"{user.first_name or 'Кандидат'} @{user.username or user.id}",
         phone=phone,
         tg_id=str(user.id),
         pipeline_id=PIPELINE_ID,
         status_id=STATUS_NEW,
-    )
+    ))
     await state.update_data(lead_id=lead_id)
+    bind(lead_id=lead_id)
+
+    duplicates = await deps.similarity.contact(user.id, phone)
+    if duplicates:
+        logger.warning(f"Candidate {user.id} matches earlier interviews: {duplicates}")
+        await state.update_data(duplicates=duplicates)
 
     await message.answer(
         f"Номер {phone} подтверждён!\n\n"
@@ -129,9 +177,20 @@ async def got_contact(message: Message, state: FSMContext, bot: Bot):
         reply_markup=ReplyKeyboardRemove(),
     )
     await state.set_state(Interview.interviewing)
-    await state.update_data(history=[], questions_asked=0, scores={}, finalized=False)
-
-    first_q = await ask_hr_gpt([], "START_INTERVIEW", user_name=user.first_name)
+    # Budget counters are lifetime: the interview's own usage is the difference at the end
+    await state.update_data(history=[], questions_asked=0, scores={}, finalized=False,
+                            tokens_at_start=await budget.spent(user.id))
+    await activity.start(user.id, now)
+
+    try:
+        first_q = await ask_hr_gpt([], "START_INTERVIEW", user_name=user.first_name,
+                                   budget=budget, user_id=user.id, client=deps.openai)
+    except BudgetExceeded as e:
+        if e.reason == "user_total":
+            # Lifetime cap spent by earlier interviews: nothing to resume later
+            await state.set_state(Interview.completed)
+            await activity.complete(user.id)
+        first_q = BUDGET_REPLIES[e.reason]
     await message.answer(first_q)
 
 
@@ -146,56 +205,95 @@ async def request_contact_again(message: Message):
 
 # Main Interview Flow
 @router.message(Interview.interviewing, F.text)
-async def interview_message(message: Message, state: FSMContext, bot: Bot):
+async def interview_message(message: Message, state: FSMContext, budget: TokenBudget,
+                            activity: ActivityIndex, finalizer: InterviewFinalizer,
+                            deps: Container):
     data            = await state.get_data()
     history         = data.get("history", [])
     questions_asked = data.get("questions_asked", 0)
     lead_id         = data.get("lead_id")
     user_name       = message.from_user.first_name
+    bind(lead_id=lead_id)
 
     # FIX 2b: update last_activity so scheduler knows candidate is active
-    await state.update_data(last_activity=time.time())
+    now = time.time()
+    await activity.touch(message.from_user.id, now)
+
+    # Low-effort messages get a canned nudge: no GPT call, no question used up
+    skips   = data.get("prefilter_skips", 0)
+    pending = data.get("pending_answer", [])
+    reason  = classify(message.text, history) if skips < MAX_SKIPS else None
+    if reason:
+        PREFILTERED.labels(reason=reason).inc()
+        if reason in MERGE_REASONS:
+            pending = pending + [message.text]
+        await state.update_data(last_activity=now, prefilter_skips=skips + 1,
+                                pending_answer=pending)
+        await message.answer(nudge(reason, skips))
+        return
+    await state.update_data(last_activity=now, prefilter_skips=0, pending_answer=[])
 
-    history.append({"role": "user", "content": message.text})
+    history.append({"role": "user", "content": truncate_input("\n".join([*pending, message.text]))})
 
     # Hard limit: 30 questions
     if questions_asked >= 30:
-        await finalize_interview(message, state, bot, history, lead_id, user_name)
+        await finalize_interview(message, state, activity, finalizer, history, user_name)
         return
 
-    gpt_reply = await ask_hr_gpt(history, "CONTINUE", user_name=user_name)
+    try:
+        gpt_reply = await ask_hr_gpt(history, "CONTINUE", user_name=user_name,
+                                     budget=budget, user_id=message.from_user.id,
+                                     client=deps.openai)
+    except BudgetExceeded as e:
+        if e.reason == "user_total":
+            # Per-candidate hard cap: evaluate with what we already have
+            await finalize_interview(message, state, activity, finalizer, history, user_name)
+            return
+        await state.update_data(history=history)
+        await message.answer(BUDGET_REPLIES[e.reason])
+        return
     history.append({"role": "assistant", "content": gpt_reply})
     await state.update_data(history=history, questions_asked=questions_asked + 1)
     await message.answer(gpt_reply)
 
     # FIX 2c: only trigger finalize on GPT signal, not on >=28 (caused double call)
     if "INTERVIEW_COMPLETE" in gpt_reply:
-        await finalize_interview(message, state, bot, history, lead_id, user_name)
+        await finalize_interview(message, state, activity, finalizer, history, user_name)
 
 
 @router.message(Interview.interviewing, F.document | F.photo)
-async def interview_resume_file(message: Message, state: FSMContext, bot: Bot):
+async def interview_resume_file(message: Message, state: FSMContext, bot: Bot,
+                                idem: Idempotency, budget: TokenBudget, activity: ActivityIndex,
+                                deps: Container):
     """Handle resume file upload during interview."""
     data    = await state.get_data()
     lead_id = data.get("lead_id")
+    bind(lead_id=lead_id)
 
     # FIX 2b: update activity time
-    await state.update_data(last_activity=time.time())
+    now = time.time()
+    await state.update_data(last_activity=now)
+    await activity.touch(message.from_user.id, now)
 
     if message.document:
         file_id   = message.document.file_id
+        file_uid  = message.document.file_unique_id
         file_name = message.document.file_name or "resume.pdf"
     elif message.photo:
         file_id   = message.photo[-1].file_id
+        file_uid  = message.photo[-1].file_unique_id
         file_name = "resume_photo.jpg"
     else:
         return
 
-    file       = await bot.get_file(file_id)
-    file_bytes = await bot.download_file(file.file_path)
-
-    if lead_id:
-        await amo.upload_resume_file(lead_id, file_bytes, file_name)
+    if lead_id and await idem.claim(f"upload:{lead_id}:{file_uid}"):
+        try:
+            file       = await bot.get_file(file_id)
+            file_bytes = await bot.download_file(file.file_path)
+            await deps.amo.upload_resume_file(lead_id, file_bytes, file_name)
+        except Exception:
+            await idem.release(f"upload:{lead_id}:{file_uid}")
+            raise
 
     await message.answer(
         "Резюме получено и сохранено в вашей карточке!\n"
@@ -204,45 +302,48 @@ async def interview_resume_file(message: Message, state: FSMContext, bot: Bot):
 
     history = data.get("history", [])
     history.append({"role": "user", "content": f"[Кандидат прислал резюме: {file_name}]"})
-    gpt_reply = await ask_hr_gpt(history, "RESUME_RECEIVED", user_name=message.from_user.first_name)
+    try:
+        gpt_reply = await ask_hr_gpt(history, "RESUME_RECEIVED", user_name=message.from_user.first_name,
+                                     budget=budget, user_id=message.from_user.id,
+                                     client=deps.openai)
+    except BudgetExceeded as e:
+        await state.update_data(history=history)
+        # user_total: the resume is saved; the next answer finalizes the interview
+        if e.reason != "user_total":
+            await message.answer(BUDGET_REPLIES[e.reason])
+        return
     history.append({"role": "assistant", "content": gpt_reply})
     await state.update_data(history=history)
     await message.answer(gpt_reply)
 
 
 async def finalize_interview(
-    message: Message, state: FSMContext, bot: Bot,
-    history: list, lead_id: int, user_name: str
+    message: Message, state: FSMContext, activity: ActivityIndex, finalizer: InterviewFinalizer,
+    history: list, user_name: str
 ):
-    """Finalize interview: generate AI resume, update AmoCRM, notify CEO/PM."""
+    """Finalize interview: queue the AI resume, AmoCRM update and CEO/PM report."""
     data = await state.get_data()
 
     # FIX 2d: idempotent guard - prevent double execution
     if data.get("finalized"):
-        logger.warning(f"finalize_interview called twice for lead {lead_id} - skipping")
+        logger.warning(f"finalize_interview called twice for lead {data.get('lead_id')} - skipping")
         return
-    await state.update_data(finalized=True)
-
-    await message.answer(
-        "Мы завершили основную часть собеседования!\n"
-        "Сейчас я формирую итоговое резюме и отправляю команде. Это займёт пару секунд..."
-    )
-
-    ai_resume = await generate_ai_resume(history, user_name)
-
-    if lead_id:
-        await amo.update_lead_fields(lead_id, ai_resume)
-
-    await notify_ceo_pm(bot, CEO_TG_ID, PM_TG_ID, data, ai_resume)
+    finished_at = time.time()
+
+    # Only enqueued here: the finalizer worker generates the resume, reports
+    # to CEO/PM, sends the candidate's result and updates AmoCRM. Marked
+    # finalized only once queued, so a redelivery after a failed XADD retries it
+    # (a second job is harmless: the reports are claimed once per interview)
+    await finalizer.enqueue(state.key, {**data, "history": history, "finished_at": finished_at},
+                            user_name, projects_inline().model_dump(exclude_none=True))
+    await state.update_data(finalized=True, history=history, finished_at=finished_at)
     await state.set_state(Interview.completed)
+    await activity.complete(message.from_user.id)
 
     await message.answer(
-        "Ваше собеседование завершено.\n\n"
-        f"Ваш итоговый балл: *{ai_resume.get('total_score', '-')}/100*\n\n"
-        "Наша команда рассмотрит вашу кандидатуру и свяжется с вами в течение 2-3 рабочих дней.\n\n"
-        "Хотите узнать больше о наших проектах?",
-        reply_markup=projects_inline(),
-        parse_mode="Markdown",
+        "Мы завершили основную часть собеседования!\n"
+        "Сейчас я формирую итоговое резюме и отправляю команде. "
+        "Ваш результат придёт следующим сообщением через минуту..."
     )
 
 
@@ -283,8 +384,8 @@ async def project_info(callback: CallbackQuery):
 
 # Menu Buttons
 @router.message(F.text == "Пройти собеседование")
-async def start_interview_btn(message: Message, state: FSMContext):
-    await cmd_start(message, state)
+async def start_interview_btn(message: Message, state: FSMContext, activity: ActivityIndex):
+    await cmd_start(message, state, activity)
 
 
 @router.message(F.text == "Наши проекты")
@@ -349,7 +450,7 @@ async def new_member(message: Message):
 
 
 # Pause handler
-@router.message(Interview.interviewing, F.text.in_({"стоп", "пауза", "позже", "потом"}))
+@router.message(Interview.interviewing, F.text.in_(PAUSE_WORDS))
 async def pause_interview(message: Message, state: FSMContext):
     await message.answer(
         "Хорошо, сохраняю ваш прогресс. Напишите мне когда будете готовы продолжить.\n"
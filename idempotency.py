@@ -0,0 +1,63 @@
+"""
+idempotency.py - Idempotency keys for MUGON HR Bot
+Redis SET NX guards so a redelivered update or a retried side effect
+(lead creation, resume upload, CEO/PM notification) runs at most once.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX      = "hr:idem:"
+PENDING         = b"__pending__"
+DEFAULT_TTL     = 7 * 24 * 3600     # how long a finished side effect is remembered
+PENDING_TTL     = 120               # how long an in-flight claim blocks duplicates
+
+
+class Idempotency:
+    """Claim/remember helpers on top of a shared Redis client."""
+
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+
+    async def claim(self, key: str, ttl: int = DEFAULT_TTL) -> bool:
+        """Return True only for the first caller of ``key`` within ``ttl``."""
+        return bool(await self.redis.set(KEY_PREFIX + key, 1, nx=True, ex=ttl))
+
+    async def release(self, key: str) -> None:
+        """Forget ``key`` so a failed side effect can be retried."""
+        await self.redis.delete(KEY_PREFIX + key)
+
+    async def complete(self, key: str, ttl: int = DEFAULT_TTL) -> None:
+        """Turn a short in-flight claim into a long-lived "done" marker."""
+        await self.redis.set(KEY_PREFIX + key, 1, ex=ttl)
+
+    async def once(self, key: str, factory: Callable[[], Awaitable[Any]],
+                   ttl: int = DEFAULT_TTL) -> Any:
+        """Run ``factory`` once per key and return its (JSON-able) result to everyone.
+
+        Concurrent callers wait for the first one; if it fails the claim is
+        dropped and the error propagates, so the next caller retries.
+        """
+        redis_key = KEY_PREFIX + key
+        deadline = asyncio.get_running_loop().time() + PENDING_TTL
+        while True:
+            if await self.redis.set(redis_key, PENDING, nx=True, ex=PENDING_TTL):
+                try:
+                    result = await factory()
+                except BaseException:
+                    await self.redis.delete(redis_key)
+                    raise
+                await self.redis.set(redis_key, json.dumps(result), ex=ttl)
+                return result
+
+            cached = await self.redis.get(redis_key)
+            if cached is not None and cached != PENDING:
+                logger.info(f"Idempotent hit for {key}, reusing stored result")
+                return json.loads(cached)
+            if asyncio.get_running_loop().time() > deadline:
+                raise TimeoutError(f"Idempotent operation {key} still pending")
+            await asyncio.sleep(0.2)
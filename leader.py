@@ -0,0 +1,111 @@
+"""
+leader.py - Redis lease-based leader election for MUGON HR Bot
+Exactly one replica runs a singleton job (scheduler, maintenance). The lease
+is renewed in the background; if the leader dies another replica takes over
+once the lease expires (a few seconds). Each acquisition bumps a fencing
+token, so writes guarded by it are rejected from a stale leader.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL   = float(os.environ.get("LEADER_LEASE_TTL", "6"))
+RENEW_EVERY = LEASE_TTL / 3
+
+# KEYS[1] = lease key; ARGV[1] = token, ARGV[2] = ttl ms
+RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLease:
+    """A named lease held by at most one process at a time."""
+
+    def __init__(self, redis: aioredis.Redis, name: str, ttl: float = LEASE_TTL):
+        self.redis = redis
+        self.name = name
+        self.key = f"hr:lease:{name}"
+        self.fence_key = f"{self.key}:fence"
+        self.ttl = ttl
+        self.token = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.fence = 0
+        self.renewed_at = 0.0
+        self._renew = redis.register_script(RENEW_LUA)
+        self._release = redis.register_script(RELEASE_LUA)
+
+    async def acquire(self) -> bool:
+        if not await self.redis.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)):
+            return False
+        self.fence = await self.redis.incr(self.fence_key)
+        self.renewed_at = time.monotonic()
+        return True
+
+    async def renew(self) -> bool:
+        """Extend the lease. False means it is definitely lost."""
+        try:
+            ok = await self._renew(keys=[self.key], args=[self.token, int(self.ttl * 1000)])
+        except Exception as e:
+            # Transient Redis error: still ours until the TTL could have run out
+            logger.warning(f"Lease {self.name} renewal error: {e}")
+            return time.monotonic() - self.renewed_at < self.ttl
+        if ok:
+            self.renewed_at = time.monotonic()
+        return bool(ok)
+
+    async def release(self) -> None:
+        try:
+            await self._release(keys=[self.key], args=[self.token])
+        except Exception as e:
+            logger.warning(f"Lease {self.name} release error: {e}")
+
+
+async def run_as_leader(redis: aioredis.Redis, name: str,
+                        job: Callable[[LeaderLease], Awaitable[None]]) -> None:
+    """Run ``job(lease)`` on whichever replica holds the ``name`` lease.
+
+    Every replica calls this; followers retry acquisition every RENEW_EVERY
+    seconds. The job is cancelled as soon as the lease is lost.
+    """
+    lease = LeaderLease(redis, name)
+    while True:
+        try:
+            acquired = await lease.acquire()
+        except Exception as e:
+            logger.warning(f"Lease {name} acquire error: {e}")
+            acquired = False
+        if not acquired:
+            await asyncio.sleep(RENEW_EVERY)
+            continue
+
+        logger.info(f"Became leader for {name} (fence {lease.fence})")
+        task = asyncio.create_task(job(lease))
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=RENEW_EVERY)
+                if not task.done() and not await lease.renew():
+                    logger.warning(f"Lost leadership for {name}, stopping job")
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await lease.release()
+        if task.done() and not task.cancelled() and task.exception():
+            logger.error(f"Leader job {name} crashed: {task.exception()}")
+            await asyncio.sleep(RENEW_EVERY)
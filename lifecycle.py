@@ -0,0 +1,158 @@
+"""
+lifecycle.py - Graceful shutdown for MUGON HR Bot
+On SIGTERM/SIGINT the process stops taking new updates, lets in-flight
+handlers (a GPT turn, a finished interview handed to the finalizer) finish
+within SHUTDOWN_TIMEOUT, stops background tasks and closes AmoCRM, OpenAI,
+Bot and Redis connections.
+
+Order of shutdown():
+  1. on_stop callbacks    - stop intake (polling, webhook, stream reads)
+  2. drain                - wait for in-flight updates (and on_drain work),
+                            up to the deadline
+  3. background tasks     - graceful stop hooks, then cancel and await
+  4. on_close callbacks   - close clients, in reverse registration order
+
+Shard stream, outbox and finalizer entries still unfinished at the deadline
+were never acknowledged, so another worker redoes them. Webhook updates are
+different: Telegram got its 200 when they were queued, so whatever is still
+in the webhook queues at the deadline is lost (logged with its update ids).
+Size SHUTDOWN_TIMEOUT and WEBHOOK_QUEUE_SIZE so a full queue drains in time.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+
+Callback = Callable[[], Any]      # sync or async
+
+
+class Lifecycle:
+    """Tracks in-flight updates and background tasks of one process."""
+
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.stopping = asyncio.Event()
+        self.deadline: Optional[float] = None     # time.monotonic() once shutdown started
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: dict[asyncio.Task, Optional[Callback]] = {}
+        self._on_stop: list[Callback] = []
+        self._on_close: list[Callback] = []
+        self._drains: list[Callback] = []
+
+    # ------------------------------------------------------------ registration
+
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request_stop, sig)
+
+    def request_stop(self, sig: Optional[signal.Signals] = None) -> None:
+        if not self.stopping.is_set():
+            logger.info(f"Shutdown requested ({sig.name if sig else 'manual'})")
+            self.stopping.set()
+
+    def spawn(self, coro: Awaitable, name: str, stop: Optional[Callback] = None) -> asyncio.Task:
+        """Run a background task owned by the lifecycle.
+
+        ``stop`` asks the task to finish on its own before it gets cancelled.
+        """
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[task] = stop
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception() and not self.stopping.is_set():
+            logger.error(f"Background task {task.get_name()} crashed: {task.exception()}")
+
+    def on_stop(self, callback: Callback) -> None:
+        self._on_stop.append(callback)
+
+    def on_close(self, callback: Callback) -> None:
+        self._on_close.append(callback)
+
+    def on_drain(self, callback: Callback) -> None:
+        """Extra work to wait for during the drain step (e.g. acked webhook queues)."""
+        self._drains.append(callback)
+
+    # ------------------------------------------------------------ in-flight tracking
+
+    def enter(self) -> None:
+        self.in_flight += 1
+        self._idle.clear()
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+        if self.in_flight <= 0:
+            self.in_flight = 0
+            self._idle.set()
+
+    # ------------------------------------------------------------ shutdown
+
+    async def _run_callbacks(self, callbacks: list[Callback], what: str) -> None:
+        for callback in callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Shutdown {what} step {getattr(callback, '__name__', callback)} failed: {e}")
+
+    async def shutdown(self) -> None:
+        self.stopping.set()
+        deadline = self.deadline = time.monotonic() + self.timeout
+
+        await self._run_callbacks(self._on_stop, "stop")
+
+        logger.info(f"Draining {self.in_flight} in-flight updates")
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(drain() for drain in self._drains), self._idle.wait()),
+                max(deadline - time.monotonic(), 0),
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown deadline hit with {self.in_flight} updates in flight")
+
+        tasks = dict(self._tasks)
+        await self._run_callbacks([stop for stop in tasks.values() if stop], "task stop")
+        graceful = [t for t, stop in tasks.items() if stop]
+        if graceful:
+            await asyncio.wait(graceful, timeout=max(deadline - time.monotonic(), 0.1))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await self._run_callbacks(list(reversed(self._on_close)), "close")
+        logger.info("Shutdown complete")
+
+
+async def cancel_and_wait(task: asyncio.Task) -> None:
+    if not task.done():
+        task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Outer update middleware: counts updates being handled."""
+
+    def __init__(self, lifecycle: Lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        self.lifecycle.enter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.lifecycle.leave()
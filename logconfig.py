@@ -0,0 +1,174 @@
+"""
+logconfig.py - Logging pipeline for MUGON HR Bot
+The event loop only ever puts records on an in-memory queue (QueueHandler);
+a QueueListener thread does the formatting and disk/console I/O, so a slow
+disk never stalls the bot.
+
+  logs/bot.log   JSON lines with trace/update/user/lead ids, rotated at
+                 LOG_MAX_MB or every LOG_ROTATE_HOURS (whichever first),
+                 rotated files gzipped, LOG_BACKUPS kept
+  stderr         human-readable lines
+
+Every process writes its own files: rotation renames the file under any
+other writer, so shard worker i logs to logs/bot-shard<i>.log (and traces
+to logs/traces-shard<i>.jsonl). Nothing is configured on import; entry
+points call setup_logging().
+
+DEBUG records are sampled (LOG_DEBUG_SAMPLE) so verbose modules can stay
+instrumented without flooding the queue.
+"""
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import time
+from typing import Any, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from tracing import TRACE_FILE, TraceIdFilter, set_trace_file
+
+LOG_FILE         = os.environ.get("LOG_FILE", "logs/bot.log")
+LOG_LEVEL        = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_MB       = float(os.environ.get("LOG_MAX_MB", "50"))
+LOG_ROTATE_HOURS = float(os.environ.get("LOG_ROTATE_HOURS", "24"))
+LOG_BACKUPS      = int(os.environ.get("LOG_BACKUPS", "14"))
+DEBUG_SAMPLE     = float(os.environ.get("LOG_DEBUG_SAMPLE", "0.01"))
+
+CONTEXT_FIELDS = ("update_id", "user_id", "lead_id")
+
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
+
+def bind(**fields) -> None:
+    """Attach ids to every log line of the current update (task-local)."""
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Runs on the emitting thread: copies task-local ids onto the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        for name in CONTEXT_FIELDS:
+            setattr(record, name, context.get(name))
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keep a DEBUG_SAMPLE fraction of DEBUG records, everything else as is."""
+
+    def __init__(self, rate: float = DEBUG_SAMPLE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts":     time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                      + f".{int(record.msecs):03d}Z",
+            "level":  record.levelname,
+            "logger": record.name,
+            "msg":    record.getMessage(),     # QueueHandler already appended any traceback
+        }
+        trace_id = getattr(record, "trace_id", "-")
+        if trace_id != "-":
+            entry["trace_id"] = trace_id
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SizeTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotate on size or age, gzip the rotated file."""
+
+    def __init__(self, filename: str, max_bytes: int, interval: float, backups: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self.interval = interval
+        self.opened_at = time.time()
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._gzip_rotate
+
+    @staticmethod
+    def _gzip_rotate(source: str, dest: str) -> None:
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() - self.opened_at >= self.interval:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.opened_at = time.time()
+
+
+def process_file(path: str, process: str) -> str:
+    """logs/bot.log -> logs/bot-<process>.log; unchanged for the main process."""
+    if not path or not process:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}-{process}{ext}"
+
+
+def setup_logging(process: str = "") -> logging.handlers.QueueListener:
+    """Install the queue pipeline on the root logger; returns the started listener.
+
+    ``process`` names a secondary process (e.g. "shard0"): its log and trace
+    files get that suffix, so no file has two writers.
+    """
+    log_file = process_file(LOG_FILE, process)
+    set_trace_file(process_file(TRACE_FILE, process))
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(
+        "%(asctime)s | %(levelname)s | %(name)s | %(trace_id)s | %(message)s"))
+    file_handler = SizeTimeRotatingFileHandler(
+        log_file, int(LOG_MAX_MB * 1024 * 1024), LOG_ROTATE_HOURS * 3600, LOG_BACKUPS)
+    file_handler.setFormatter(JsonFormatter())
+
+    # Filters run in the caller (event-loop thread): contextvars are only visible there
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(DebugSampler())
+    queue_handler.addFilter(TraceIdFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, console, file_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer update middleware: bind update/user ids for the whole update."""
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        token = _context.set({"update_id": event.update_id, "user_id": user.id if user else None})
+        try:
+            return await handler(event, data)
+        finally:
+            _context.reset(token)
@@ -0,0 +1,289 @@
+"""
+metrics.py - Prometheus metrics for MUGON HR Bot
+Small in-process registry rendered in the Prometheus text format on /metrics
+(no client library needed). Every replica / shard worker exposes its own
+endpoint; Prometheus aggregates across them.
+
+Instrumented:
+  hr_handler_seconds          handler latency by router handler and FSM state
+  hr_gpt_seconds / tokens     OpenAI latency and token usage by mode
+  hr_amocrm_seconds           AmoCRM latency by endpoint and HTTP status
+  hr_redis_commands_total     Redis commands issued, by command
+  hr_fsm_cache_total          FSM L1 cache lookups by part (state/data), hit/miss
+  hr_prefilter_total          candidate messages answered locally (GPT calls avoided)
+  hr_sender_*                 outbound queue depth per lane, retries, dead letters
+                              (gauges) and messages by lane and outcome
+  hr_scheduler_cycle_seconds  one reminder drain cycle
+  hr_loop_lag_seconds         event-loop lag (how late a timer fires)
+"""
+import asyncio
+import logging
+import re
+import time
+from contextlib import contextmanager, suppress
+from typing import Any, Callable, Optional
+import aiohttp
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_INTERVAL = 0.5
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, Any] = {}
+        _registry.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def _render_child(self, key, child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, key, child) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{inf} {child.count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+HANDLER_SECONDS = Histogram("hr_handler_seconds", "Update handler latency",
+                            ("handler", "state"))
+GPT_SECONDS     = Histogram("hr_gpt_seconds", "OpenAI chat completion latency", ("mode",))
+GPT_TOKENS      = Counter("hr_gpt_tokens_total", "OpenAI tokens used", ("mode", "kind"))
+AMO_SECONDS     = Histogram("hr_amocrm_seconds", "AmoCRM API latency", ("endpoint", "status"))
+REDIS_COMMANDS  = Counter("hr_redis_commands_total", "Redis commands issued", ("command",))
+FSM_CACHE       = Counter("hr_fsm_cache_total", "FSM L1 cache lookups", ("part", "result"))
+PREFILTERED     = Counter("hr_prefilter_total", "Low-effort messages answered without GPT",
+                          ("reason",))
+SENDER_QUEUE    = Gauge("hr_sender_queue_depth", "Outbound messages queued or in flight",
+                        ("lane",))
+SENDER_RETRYING = Gauge("hr_sender_retrying", "Outbound messages waiting for a retry")
+SENDER_DEAD     = Gauge("hr_sender_dead_letters", "Outbound messages in the dead-letter stream")
+SENDER_MESSAGES = Counter("hr_sender_messages_total", "Outbound messages by lane and outcome",
+                          ("lane", "outcome"))
+SCHEDULER_CYCLE = Histogram("hr_scheduler_cycle_seconds", "Reminder scheduler drain cycle")
+LOOP_LAG        = Histogram("hr_loop_lag_seconds", "Event-loop lag",
+                            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+# ---------------------------------------------------------------- instrumentation
+
+class MetricsMiddleware(BaseMiddleware):
+    """Inner middleware: time the matched handler, labelled by FSM state."""
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        state = data.get("raw_state") or "none"
+        with HANDLER_SECONDS.labels(handler=name, state=state).time():
+            return await handler(event, data)
+
+
+_ID_SEGMENT = re.compile(r"/\d+")
+
+
+def http_trace(histogram: Histogram) -> aiohttp.TraceConfig:
+    """aiohttp trace config observing request latency by endpoint and status."""
+    trace = aiohttp.TraceConfig()
+
+    async def on_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    def observe(ctx, url, status) -> None:
+        endpoint = _ID_SEGMENT.sub("/:id", url.path)
+        histogram.labels(endpoint=endpoint, status=status).observe(time.perf_counter() - ctx.start)
+
+    async def on_end(session, ctx, params):
+        observe(ctx, params.url, params.response.status)
+
+    async def on_exception(session, ctx, params):
+        observe(ctx, params.url, "error")
+
+    trace.on_request_start.append(on_start)
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_exception)
+    return trace
+
+
+AMO_TRACE = http_trace(AMO_SECONDS)
+
+
+def instrument_redis(redis: aioredis.Redis) -> aioredis.Redis:
+    """Count every command sent through this client, pipelines included."""
+    execute_command = redis.execute_command
+    pipeline = redis.pipeline
+
+    async def counted_execute_command(*args, **options):
+        REDIS_COMMANDS.labels(command=str(args[0]).upper()).inc()
+        return await execute_command(*args, **options)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(raise_on_error: bool = True):
+            for command_args, _ in pipe.command_stack:
+                REDIS_COMMANDS.labels(command=str(command_args[0]).upper()).inc()
+            return await execute(raise_on_error)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    redis.execute_command = counted_execute_command
+    redis.pipeline = counted_pipeline
+    return redis
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Background task: how much later than requested a sleep wakes up."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
+
+
+async def _loop_lag_ctx(app: web.Application):
+    """Runs the loop-lag monitor for the life of the metrics app (runner.cleanup stops it)."""
+    task = asyncio.create_task(monitor_loop_lag(), name="loop-lag")
+    yield
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """Serve /metrics on its own port (0 disables); starts the loop-lag monitor."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    app.cleanup_ctx.append(_loop_lag_ctx)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -2,25 +2,35 @@
 middleware.py - MUGON HR Bot middlewares
 Throttling: prevent token waste from empty dialogs
 Verification: require phone number before proceeding
+Deduplication: process each Telegram update_id at most once
 """
 import logging
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message
+from aiogram.types import TelegramObject, Message, Update
 from aiogram.fsm.context import FSMContext
-from collections import defaultdict
-import time
+import redis.asyncio as aioredis
+
+from idempotency import Idempotency, PENDING_TTL
+from ratelimit import RateLimiter
 
 logger = logging.getLogger(__name__)
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    """Rate limiting to prevent token waste from spam."""
+    """Rate limiting to prevent token waste from spam.
+
+    Limits live in Redis (see ratelimit.py), so they are shared by every
+    replica and survive restarts. ``state_limits`` overrides
+    (rate_limit, burst) per FSM state, e.g. stricter for GPT-backed states.
+    """
 
-    def __init__(self, rate_limit: float = 1.0, burst: int = 5):
+    def __init__(self, redis: aioredis.Redis, rate_limit: float = 12.0, burst: int = 5,
+                 state_limits: Optional[dict[str, tuple[float, int]]] = None):
         self.rate_limit = rate_limit  # seconds between messages
         self.burst = burst             # allowed burst
-        self.user_timestamps = defaultdict(list)
+        self.state_limits = state_limits or {}
+        self.limiter = RateLimiter(redis, prefix="hr:throttle:")
 
     async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
         if not isinstance(event, Message):
@@ -30,18 +40,23 @@ class ThrottlingMiddleware(BaseMiddleware):
         if not user_id:
             return await handler(event, data)
 
-        now = time.time()
-        timestamps = self.user_timestamps[user_id]
-        # Remove old timestamps
-        self.user_timestamps[user_id] = [t for t in timestamps if now - t < 60]
+        state = data.get("raw_state")
+        rate_limit, burst = self.state_limits.get(state, (self.rate_limit, self.burst))
+        bucket = state if state in self.state_limits else "default"
+
+        try:
+            retry_after = await self.limiter.hit(f"{user_id}:{bucket}", rate_limit, burst)
+        except Exception as e:
+            # Fail open: Redis trouble must not silence the bot
+            logger.warning(f"Throttle check failed for {user_id}: {e}")
+            return await handler(event, data)
 
-        if len(self.user_timestamps[user_id]) >= self.burst:
+        if retry_after:
             await event.answer(
                 "⏳ Пожалуйста, не торопитесь. Отвечайте вдумчиво."
             )
             return
 
-        self.user_timestamps[user_id].append(now)
         return await handler(event, data)
 
 
@@ -79,3 +94,38 @@ class VerificationMiddleware(BaseMiddleware):
                     return
 
         return await handler(event, data)
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Skip updates already seen (webhook redelivery, poller or worker restart).
+
+    The update is claimed for PENDING_TTL while it is processed and marked done
+    afterwards; a failed or crashed attempt becomes retryable again.
+    """
+
+    def __init__(self, idem: Idempotency, ttl: int = 24 * 3600):
+        self.idem = idem
+        self.ttl = ttl
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        key = f"update:{event.update_id}"
+        try:
+            first = await self.idem.claim(key, ttl=PENDING_TTL)
+        except Exception as e:
+            logger.warning(f"Dedup check failed for update {event.update_id}: {e}")
+            return await handler(event, data)
+
+        if not first:
+            logger.info(f"Duplicate update {event.update_id} skipped")
+            return None
+
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await self.idem.release(key)
+            raise
+        await self.idem.complete(key, ttl=self.ttl)
+        return result
@@ -1,21 +1,91 @@
 """
 notifier.py - Notification system for MUGON HR Bot
 Sends formatted candidate reports to CEO and Project Manager via Telegram
+(queued through the rate-limited outbound sender)
+
+Each recipient has a subscription rule:
+  mode      - "instant" (one report per candidate) or "digest" (buffered in
+              Redis, sent as one ranked message every DIGEST_INTERVAL seconds
+              or as soon as DIGEST_BATCH reports are waiting)
+  min_score - skip candidates below this total_score
+  verdicts  - only these verdicts (empty = all)
+
+Rules come from NOTIFY_RULES (JSON keyed by Telegram id), e.g.
+  {"123": {"mode": "digest", "min_score": 50}, "456": {"verdicts": ["Trial Task"]}}
+CEO_TG_ID / PM_TG_ID without a rule get every report instantly.
 """
+import asyncio
+import json
 import logging
-from aiogram import Bot
+import os
+from typing import Optional
+import redis.asyncio as aioredis
+
+from sender import OutboundSender
 
 logger = logging.getLogger(__name__)
 
+DIGEST_INTERVAL = float(os.environ.get("DIGEST_INTERVAL", "3600"))
+DIGEST_BATCH    = int(os.environ.get("DIGEST_BATCH", "10"))
+DIGEST_PREFIX   = "hr:digest:"
+MESSAGE_LIMIT   = 4000      # Telegram caps a message at 4096 chars
+
+
+class Subscription:
+    """Which candidates one recipient gets, and how."""
+
+    def __init__(self, recipient_id: int, mode: str = "instant", min_score: int = 0,
+                 verdicts: Optional[list] = None):
+        self.recipient_id = recipient_id
+        self.mode = mode
+        self.min_score = min_score
+        self.verdicts = verdicts or []
+
+    def wants(self, ai_resume: dict) -> bool:
+        if (ai_resume.get("total_score") or 0) < self.min_score:
+            return False
+        return not self.verdicts or ai_resume.get("verdict") in self.verdicts
+
+
+def load_subscriptions(ceo_id: int, pm_id: int, raw: str = "") -> list[Subscription]:
+    """Subscriptions from NOTIFY_RULES; CEO/PM fall back to instant, unfiltered."""
+    rules = json.loads(raw or os.environ.get("NOTIFY_RULES") or "{}")
+    subs = {
+        int(recipient_id): Subscription(int(recipient_id), **rule)
+        for recipient_id, rule in rules.items()
+    }
+    for recipient_id in (ceo_id, pm_id):
+        if recipient_id and recipient_id > 0:
+            subs.setdefault(recipient_id, Subscription(recipient_id))
+    for sub in subs.values():
+        if sub.mode not in ("instant", "digest"):
+            raise ValueError(f"Unknown notify mode {sub.mode!r} for {sub.recipient_id}")
+    return list(subs.values())
+
+
+def score_emoji(score: int) -> str:
+    return "🟢" if score >= 75 else "🟡" if score >= 50 else "🔴"
+
+
+DUPLICATE_REASONS = {
+    "phone":   "тот же телефон, другой Telegram",
+    "tg_id":   "тот же Telegram, другой телефон",
+    "answers": "похожие ответы",
+}
+
+
+def format_duplicates(duplicates: list[dict]) -> str:
+    """Lines about earlier interviews this candidate matches (similarity.py)."""
+    return "\n".join(
+        f"  • id:{d['tg_id']} ({d['interview_id']}) — "
+        f"{DUPLICATE_REASONS.get(d['reason'], d['reason'])}"
+        + (f", {d['similarity']:.0%}" if d["reason"] == "answers" else "")
+        for d in duplicates
+    )
+
 
-async def notify_ceo_pm(
-    bot: Bot,
-    ceo_id: int,
-    pm_id: int,
-    candidate_data: dict,
-    ai_resume: dict,
-) -> None:
-    """Send candidate interview summary to CEO and PM."""
+def format_report(candidate_data: dict, ai_resume: dict) -> str:
+    """Full Markdown report about one candidate."""
     name = candidate_data.get("full_name", "Неизвестно")
     phone = candidate_data.get("phone", "—")
     username = candidate_data.get("username", "")
@@ -34,15 +104,13 @@ async def notify_ceo_pm(
     deliv = ai_resume.get("delivery_score", "—")
     comm = ai_resume.get("communication_score", "—")
 
-    score_emoji = "🟢" if score >= 75 else "🟡" if score >= 50 else "🔴"
-
     report = (
         f"🆕 *НОВЫЙ КАНДИДАТ — MUGON.CLUB*\n\n"
         f"👤 *Имя:* {name}\n"
         f"📱 *Телефон:* {phone}\n"
         f"💬 *TG:* @{username} (id:{tg_id})\n"
         f"🔗 *AmoCRM:* https://eriarwork2201.amocrm.ru/leads/detail/{lead_id}\n\n"
-        f"{score_emoji} *Итоговый балл: {score}/100*\n"
+        f"{score_emoji(score)} *Итоговый балл: {score}/100*\n"
         f"📋 *Вердикт:* {verdict}\n"
         f"📌 *Следующий шаг:* {next_step}\n"
         f"🚀 *Проект:* {project_fit}\n\n"
@@ -57,17 +125,139 @@ async def notify_ceo_pm(
     if risks:
         report += f"⚠️ *Риски:*\n" + "\n".join(f"  • {r}" for r in risks) + "\n\n"
 
+    duplicates = candidate_data.get("duplicates")
+    if duplicates:
+        report += f"🔁 *Возможный дубликат:*\n{format_duplicates(duplicates)}\n\n"
+
     report += f"🤖 *AI Резюме:*\n{summary}"
+    return report
 
-    for recipient_id in [ceo_id, pm_id]:
-        if recipient_id and recipient_id > 0:
+
+def digest_entry(candidate_data: dict, ai_resume: dict) -> dict:
+    """The few fields a digest line needs (buffered in Redis)."""
+    return {
+        "name":      candidate_data.get("full_name", "Неизвестно"),
+        "username":  candidate_data.get("username", ""),
+        "lead_id":   candidate_data.get("lead_id", ""),
+        "score":     ai_resume.get("total_score", 0) or 0,
+        "verdict":   ai_resume.get("verdict", "—"),
+        "next_step": ai_resume.get("next_step", "—"),
+        "duplicate": bool(candidate_data.get("duplicates")),
+    }
+
+
+def format_digest(entries: list[dict]) -> list[str]:
+    """Ranked digest (best score first), split to fit Telegram's message limit."""
+    entries = sorted(entries, key=lambda e: e["score"], reverse=True)
+    counts = {"🟢": 0, "🟡": 0, "🔴": 0}
+    for e in entries:
+        counts[score_emoji(e["score"])] += 1
+
+    header = (
+        f"📬 *ДАЙДЖЕСТ КАНДИДАТОВ — MUGON.CLUB*\n"
+        f"Всего: {len(entries)}  "
+        + "  ".join(f"{emoji} {n}" for emoji, n in counts.items()) + "\n\n"
+    )
+    lines = [
+        f"{i}. {score_emoji(e['score'])} *{e['score']}/100* — {e['name']}"
+        f"{' 🔁' if e.get('duplicate') else ''}"
+        f"{' @' + e['username'] if e['username'] else ''}\n"
+        f"    {e['verdict']} · {e['next_step']} · "
+        f"[AmoCRM](https://eriarwork2201.amocrm.ru/leads/detail/{e['lead_id']})"
+        for i, e in enumerate(entries, 1)
+    ]
+
+    messages, current = [], header
+    for line in lines:
+        if len(current) + len(line) + 1 > MESSAGE_LIMIT:
+            messages.append(current)
+            current = ""
+        current += line + "\n"
+    messages.append(current)
+    return messages
+
+
+class CandidateNotifier:
+    """Routes finished-interview reports to subscribers, instantly or as digests."""
+
+    def __init__(self, sender: OutboundSender, redis: aioredis.Redis,
+                 subscriptions: list[Subscription]):
+        self.sender = sender
+        self.redis = redis
+        self.subscriptions = subscriptions
+
+    async def _send_report(self, recipient_id: int, report: str, name: str) -> None:
+        await self.sender.send(
+            recipient_id,
+            report,
+            lane="normal",
+            parse_mode="Markdown",
+            disable_web_page_preview=True
+        )
+        logger.info(f"Queued notification to {recipient_id} about candidate {name}")
+
+    async def _buffer(self, sub: Subscription, entry: dict) -> None:
+        waiting = await self.redis.rpush(f"{DIGEST_PREFIX}{sub.recipient_id}",
+                                         json.dumps(entry, ensure_ascii=False))
+        if waiting >= DIGEST_BATCH:
+            # The entry is buffered: a failed flush is retried by run_digest
             try:
-                await bot.send_message(
-                    recipient_id,
-                    report,
-                    parse_mode="Markdown",
-                    disable_web_page_preview=True
-                )
-                logger.info(f"Notified {recipient_id} about candidate {name}")
+                await self.flush(sub.recipient_id)
             except Exception as e:
-                logger.error(f"Failed to notify {recipient_id}: {e}")
+                logger.error(f"Digest flush for {sub.recipient_id} failed: {e}")
+
+    async def notify(self, candidate_data: dict, ai_resume: dict) -> None:
+        """Deliver one candidate to every matching subscriber concurrently.
+
+        Every subscriber is tried; then the first failure is raised, so the
+        caller can retry (subscribers already reached may get it twice).
+        """
+        name = candidate_data.get("full_name", "Неизвестно")
+        report, entry = None, None
+        jobs = []
+        for sub in self.subscriptions:
+            if not sub.wants(ai_resume):
+                continue
+            if sub.mode == "digest":
+                entry = entry or digest_entry(candidate_data, ai_resume)
+                jobs.append(self._buffer(sub, entry))
+            else:
+                report = report or format_report(candidate_data, ai_resume)
+                jobs.append(self._send_report(sub.recipient_id, report, name))
+        errors = [e for e in await asyncio.gather(*jobs, return_exceptions=True)
+                  if isinstance(e, BaseException)]
+        for e in errors:
+            logger.error(f"Failed to notify about candidate {name}: {e}")
+        if errors:
+            raise errors[0]
+
+    async def flush(self, recipient_id: int) -> int:
+        """Send everything buffered for one recipient; returns how many candidates."""
+        key = f"{DIGEST_PREFIX}{recipient_id}"
+        # LRANGE + DEL in one transaction: concurrent flushers never double-send
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        raw, _ = await pipe.execute()
+        if not raw:
+            return 0
+        entries = [json.loads(item) for item in raw]
+        for text in format_digest(entries):
+            await self.sender.send(recipient_id, text, lane="normal",
+                                   parse_mode="Markdown", disable_web_page_preview=True)
+        logger.info(f"Queued digest of {len(entries)} candidates to {recipient_id}")
+        return len(entries)
+
+    async def run_digest(self) -> None:
+        """Background task (leader only): flush digests every DIGEST_INTERVAL."""
+        recipients = [s.recipient_id for s in self.subscriptions if s.mode == "digest"]
+        if not recipients:
+            return
+        logger.info(f"Digest flusher started for {len(recipients)} recipients")
+        while True:
+            await asyncio.sleep(DIGEST_INTERVAL)
+            for recipient_id in recipients:
+                try:
+                    await self.flush(recipient_id)
+                except Exception as e:
+                    logger.error(f"Digest flush for {recipient_id} failed: {e}")
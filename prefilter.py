@@ -0,0 +1,125 @@
+"""
+prefilter.py - Local low-effort answer filter for MUGON HR Bot
+Runs on every interview message before ask_hr_gpt. Messages that carry no
+answer are replied to with a canned nudge instead of a GPT turn, and do not
+count toward the 30-question limit:
+
+  short     "ок", "да", "+", two-letter replies   -> nudge, text kept and merged
+                                                      into the next real answer
+                                                      ("Go", "C#", "1С" and other
+                                                      TERMS pass)
+  empty     emoji / punctuation only              -> nudge
+  garbage   "ааааааа", "asdasdasd", one word pasted -> nudge
+                                                      over and over
+  language  mostly letters of other scripts       -> nudge
+  repeat    same text as a recent answer          -> nudge
+  echo      the bot's question pasted back        -> nudge (most of the question,
+                                                      little else)
+
+Only a few regex scans and small sets over the first CHECK_CHARS characters,
+tens of microseconds per message (see benchmarks/prefilter.py). After PREFILTER_MAX_SKIPS nudges in a row the
+message goes to GPT anyway (with the merged fragments), so a candidate who
+really means "да" is never stuck; 0 disables the filter.
+"""
+import os
+import re
+from typing import Optional
+
+MAX_SKIPS = int(os.environ.get("PREFILTER_MAX_SKIPS", "2"))
+
+ACKS = {
+    "ок", "окей", "ok", "okay", "да", "нет", "ага", "угу", "ну", "хорошо", "ладно",
+    "понял", "поняла", "понятно", "ясно", "yes", "no", "yep", "nope", "sure", "хз",
+    "+", "-", "ясн", "пон", "да да", "ну да", "ок ок",
+}
+# Whole answers of fewer than 3 letters that still name a skill or a role
+TERMS = {
+    "go", "c", "c#", "c++", "f#", "r", "js", "ts", "1с", "1c", "ai", "ml", "dl", "cv",
+    "qa", "ui", "ux", "bi", "pm", "po", "hr", "ba", "sa", "db", "os", "ci", "cd",
+}
+MERGE_REASONS = {"short"}
+RECENT_ANSWERS = 3
+CHECK_CHARS = 200         # statistics look at this prefix only
+GRAM_CHARS = 100
+ACK_CHARS = 16
+ECHO_SHARE = 0.8          # of the question's words and of the message's, for "echo"
+
+NUDGES = {
+    "short": (
+        "Можете раскрыть ответ подробнее? Пара предложений с примером из опыта "
+        "поможет оценить вас точнее.",
+        "Расскажите, пожалуйста, чуть больше — как это было на практике?",
+    ),
+    "empty": ("Похоже, в сообщении нет текста. Ответьте, пожалуйста, на вопрос парой предложений.",),
+    "garbage": ("Не получилось разобрать ответ. Напишите его, пожалуйста, обычным текстом.",),
+    "language": ("Пожалуйста, отвечайте на русском или английском — так я смогу оценить ответ.",),
+    "repeat": ("Этот ответ уже был. Добавьте, пожалуйста, что-нибудь новое по текущему вопросу.",),
+    "echo": ("Это текст моего вопроса 🙂 Напишите, пожалуйста, свой ответ.",),
+}
+
+_SPACES = re.compile(r"\s+")
+_NON_WORD = re.compile(r"[\W_]+")
+_FOREIGN = re.compile(r"[^а-яёa-z0-9 ]")     # matches are rare: cheaper than counting letters
+_DIGIT = re.compile(r"\d")
+_RUN = re.compile(r"([^\W\d_])\1{5,}")     # letters only: "1000000" is an answer
+
+
+def _norm(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def classify(text: str, history: list) -> Optional[str]:
+    """Low-effort reason for a candidate message, or None if it deserves a GPT turn."""
+    if len(text) <= ACK_CHARS:
+        reply = _SPACES.sub(" ", text.strip().lower())
+        if reply in ACKS:
+            return "short"
+        if reply.rstrip(".!") in TERMS:
+            return None
+    # Statistics over a prefix: a long answer costs the same as a short one
+    sample = _NON_WORD.sub(" ", text[:CHECK_CHARS].lower()).strip()
+    compact = sample.replace(" ", "")
+    digits = len(_DIGIT.findall(compact))
+    letters = len(compact) - digits
+    if letters < 3:
+        # Digits alone can answer "how many years"; emoji and punctuation can't
+        if digits:
+            return None
+        return "short" if letters else "empty"
+    if len(_FOREIGN.findall(sample)) * 2 > letters:
+        return "language"
+    if _RUN.search(sample):
+        return "garbage"
+    grams = compact[:GRAM_CHARS]
+    if len(grams) >= 12 and len({grams[i:i + 3] for i in range(len(grams) - 2)}) \
+            < 0.35 * (len(grams) - 2):
+        return "garbage"
+
+    if len(sample) < 20:
+        return None
+    recent = 0
+    for item in reversed(history):
+        content = item["content"]
+        if item["role"] == "assistant":
+            if not recent:
+                # The question being answered, pasted back whole or nearly so: a
+                # short answer reusing the question's words covers little of it
+                words = set(sample.split())
+                asked = set(_norm(content[:CHECK_CHARS]).split())
+                shared = len(words & asked)
+                if len(words) >= 4 and shared >= ECHO_SHARE * max(len(words), len(asked)):
+                    return "echo"
+        elif not content.startswith("["):
+            # Same opening: history keeps over-long answers truncated
+            if content[:CHECK_CHARS] == text[:CHECK_CHARS]:
+                return "repeat"
+            recent += 1
+            if recent == RECENT_ANSWERS:
+                break
+    return None
+
+
+def nudge(reason: str, skips: int = 0) -> str:
+    """Canned reply for a filtered message; varies with consecutive skips."""
+    replies = NUDGES[reason]
+    return replies[skips % len(replies)]
@@ -0,0 +1,47 @@
+"""
+ratelimit.py - Redis-backed rate limiting for MUGON HR Bot
+GCRA (generic cell rate algorithm) in a single atomic Lua script: one key per
+limited subject holding its theoretical arrival time, expiring on its own.
+Shared by every process, survives restarts, O(1) memory per active subject.
+"""
+import logging
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = bucket key
+# ARGV[1] = emission interval in ms (1 / rate), ARGV[2] = burst, ARGV[3] = cost
+# Returns {allowed (1/0), retry_after_ms}
+GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - interval * burst
+if allow_at > now then
+    return {0, allow_at - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.max(new_tat - now, 1))
+return {1, 0}
+"""
+
+
+class RateLimiter:
+    """GCRA limiter: ``interval`` seconds per token, ``burst`` tokens of headroom."""
+
+    def __init__(self, redis: aioredis.Redis, prefix: str = "hr:rl:"):
+        self.prefix = prefix
+        self._script = redis.register_script(GCRA_LUA)
+
+    async def hit(self, key: str, interval: float, burst: int, cost: int = 1) -> float:
+        """Consume ``cost`` tokens. Returns 0 if allowed, else seconds to wait."""
+        allowed, retry_ms = await self._script(
+            keys=[self.prefix + key],
+            args=[int(interval * 1000), burst, cost],
+        )
+        return 0.0 if allowed else int(retry_ms) / 1000
@@ -0,0 +1,222 @@
+"""
+recorder.py - Anonymized traffic recorder for MUGON HR Bot
+Opt-in (RECORD_DIR): an outer update middleware appends every incoming update
+with its arrival time to gzip JSONL files, so real load patterns (bursts,
+pauses, resume uploads mid-interview, restarts) can be replayed later with
+benchmarks/replay.py.
+
+Nothing identifying is stored:
+  user/chat ids      -> stable pseudonyms (HMAC with RECORD_SALT)
+  phone numbers      -> fake numbers derived from the same HMAC
+  contact vCards     -> dropped (they repeat the phone and full name)
+  names, usernames   -> scrambled
+  text, captions     -> every word replaced by a pseudo-word of the same
+                        length, script and case (same word -> same pseudo-word),
+                        commands and keyboard button texts kept as is
+  files              -> ids hashed, file names reduced to the extension
+
+Set the same RECORD_SALT on every replica to keep pseudonyms consistent across
+processes and restarts. Records are batched by a writer thread and appended as
+one gzip member per batch (RECORD_FLUSH seconds), partitioned by day.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+RECORD_DIR   = os.environ.get("RECORD_DIR", "")           # "" disables recording
+RECORD_SALT  = os.environ.get("RECORD_SALT", "")
+RECORD_FLUSH = float(os.environ.get("RECORD_FLUSH", "5"))
+
+PSEUDONYM_BASE = 7_000_000_000
+ID_KEYS        = {"id", "user_id"}            # inside user/chat/contact objects
+NAME_KEYS      = {"first_name", "last_name", "username", "title"}
+TEXT_KEYS      = {"text", "caption"}
+FILE_KEYS      = {"file_id", "file_unique_id"}
+ID_PARENTS     = {"from", "chat", "contact", "user", "sender_chat", "new_chat_members"}
+DROP_KEYS      = {"entities", "caption_entities", "reply_markup", "thumbnail", "thumb", "vcard"}
+
+_WORD = re.compile(r"\w+")
+_ALPHABETS = (
+    (re.compile(r"[а-яё]"), "абвгдежзиклмнопрстуфхцчшщыэюя"),
+    (re.compile(r"[a-z]"),  "abcdefghijklmnopqrstuvwxyz"),
+    (re.compile(r"[0-9]"),  "0123456789"),
+)
+
+
+class Anonymizer:
+    """Deterministic (per salt) scrambling of one raw update dict."""
+
+    def __init__(self, salt: str = RECORD_SALT, keep_texts: Iterable[str] = ()):
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self.keep_texts = set(keep_texts)
+
+    def _digest(self, value: Any) -> bytes:
+        return hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+
+    def pseudonym(self, value: int) -> int:
+        if value < 0:      # group and channel chats
+            return -self.pseudonym(-value)
+        return PSEUDONYM_BASE + int.from_bytes(self._digest(value)[:8], "big") % 1_000_000_000
+
+    def phone(self, value: str) -> str:
+        return "+7" + str(int.from_bytes(self._digest(value)[:8], "big"))[-10:].zfill(10)
+
+    def token(self, value: str) -> str:
+        return self._digest(value).hex()[:len(value) or 16]
+
+    def _word(self, word: str) -> str:
+        digest = self._digest(word.lower())
+        out = []
+        for i, ch in enumerate(word):
+            low = ch.lower()
+            for pattern, alphabet in _ALPHABETS:
+                if pattern.match(low):
+                    new = alphabet[digest[i % len(digest)] % len(alphabet)]
+                    out.append(new.upper() if ch.isupper() else new)
+                    break
+            else:
+                out.append(ch)
+        return "".join(out)
+
+    def text(self, value: str) -> str:
+        if value in self.keep_texts or value.startswith("/"):
+            return value
+        return _WORD.sub(lambda m: self._word(m.group()), value)
+
+    def update(self, payload: Any, parent: str = "") -> Any:
+        if isinstance(payload, list):
+            return [self.update(item, parent) for item in payload]
+        if not isinstance(payload, dict):
+            return payload
+        result = {}
+        for key, value in payload.items():
+            if key in DROP_KEYS:
+                continue
+            if key in ID_KEYS and parent in ID_PARENTS and isinstance(value, int):
+                result[key] = self.pseudonym(value)
+            elif key == "phone_number":
+                result[key] = self.phone(value)
+            elif key in NAME_KEYS and isinstance(value, str):
+                result[key] = self.text(value)
+            elif key in TEXT_KEYS and isinstance(value, str):
+                result[key] = self.text(value)
+            elif key in FILE_KEYS:
+                result[key] = self.token(value)
+            elif key == "file_name":
+                result[key] = "file" + os.path.splitext(value)[1].lower()
+            else:
+                result[key] = self.update(value, key)
+        return result
+
+
+def record_path(record_dir: str, ts: float) -> str:
+    day = time.strftime("%Y-%m-%d", time.gmtime(ts))
+    return os.path.join(record_dir, day, f"traffic-{os.getpid()}.jsonl.gz")
+
+
+class TrafficRecorder:
+    """Queue + writer thread; the event loop only anonymizes and enqueues."""
+
+    def __init__(self, record_dir: str, anonymizer: Anonymizer, flush: float = RECORD_FLUSH):
+        self.record_dir = record_dir
+        self.anonymizer = anonymizer
+        self.flush = flush
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name="traffic-recorder",
+                                        daemon=True)
+        self._thread.start()
+
+    def record(self, update: Update) -> None:
+        payload = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        self._queue.put({"ts": round(time.time(), 3), "pid": os.getpid(),
+                         "update": self.anonymizer.update(payload)})
+
+    def _append(self, records: list[dict]) -> None:
+        path = record_path(self.record_dir, records[0]["ts"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+                          for r in records)
+        with open(path, "ab") as f:
+            f.write(gzip.compress(payload.encode("utf-8")))
+
+    def _write_loop(self) -> None:
+        while True:
+            batch: list = []
+            deadline = time.monotonic() + self.flush
+            stop = False
+            while time.monotonic() < deadline:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._append(batch)
+                except OSError as e:
+                    logger.warning(f"Traffic recording failed, {len(batch)} updates lost: {e}")
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Flush what is queued and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join(self.flush + 5)
+
+    async def aclose(self) -> None:
+        """close() off the event loop: the join may take up to flush + 5 seconds."""
+        await asyncio.to_thread(self.close)
+
+
+def iter_recording(paths: Iterable[str]):
+    """Yield recorded entries from gzip JSONL files (a cut-off tail is skipped)."""
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"Truncated recording {path}: {e}")
+
+
+class RecorderMiddleware(BaseMiddleware):
+    """Outer update middleware: record every update as delivered, then handle it."""
+
+    def __init__(self, recorder: TrafficRecorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        if isinstance(event, Update):
+            try:
+                self.recorder.record(event)
+            except Exception as e:
+                logger.warning(f"Could not record update {event.update_id}: {e}")
+        return await handler(event, data)
+
+
+def build_recorder(keep_texts: Iterable[str] = ()) -> Optional[TrafficRecorder]:
+    """The configured recorder, or None when RECORD_DIR is not set."""
+    if not RECORD_DIR:
+        return None
+    if not RECORD_SALT:
+        logger.warning("RECORD_SALT not set: pseudonyms change on every restart")
+    logger.info(f"Recording anonymized traffic to {RECORD_DIR}")
+    return TrafficRecorder(RECORD_DIR, Anonymizer(RECORD_SALT, keep_texts))
@@ -1,22 +1,35 @@
 """
 scheduler.py - Re-engagement scheduler for MUGON HR Bot
-Scans Redis for inactive interview sessions and sends tiered reminders.
+Sleeps until the earliest reminder deadline (woken early over pub/sub when a
+sooner one is added), claims due sessions atomically and sends tiered reminders.
+Runs on the elected leader only (see leader.py); claims are fenced, so a
+replica that lost the lease cannot take sessions any more.
 
 FIXES:
   - reminders_sent: actually updated in Redis after each send (was commented out)
   - last_activity=0 guard: skip sessions with no recorded activity
-  - Redis connection properly closed after each cycle
+  - no keyspace SCAN: due users come from the hr:reminders:due sorted set,
+    reminder progress lives in a small hash instead of the FSM data blob
+  - reminder counters: HINCRBY + compare-and-set in one Lua script, O(1) and
+    never racing with interview_message writing the history
+  - no hourly polling: reminders fire at their deadline, not up to 1h late
 """
 import asyncio
-import json
 import logging
 import time
+from typing import Optional
 from aiogram import Bot
-import redis.asyncio as aioredis
+from aiogram.fsm.storage.base import BaseStorage
+
+from activity import ActivityIndex, WAKEUP_CHANNEL
+from leader import LeaderLease
+from metrics import SCHEDULER_CYCLE
+from sender import OutboundSender
 
 logger = logging.getLogger(__name__)
 
 REMINDER_DELAYS_HOURS = [24, 48, 72]   # When to send reminders (hours of inactivity)
+REMINDER_GAP_HOURS    = 24             # Minimum spacing between two reminders
 
 REMINDER_MESSAGES = [
     (
@@ -36,68 +49,42 @@ REMINDER_MESSAGES = [
 ]
 
 STALE_DAYS = 7  # Delete sessions older than 7 days
+MAX_SLEEP  = 3600  # upper bound on one wait, guards against a missed wakeup
 
 
-async def get_all_interview_sessions(redis_url: str) -> list[dict]:
-    """Scan Redis for all Interview:interviewing FSM states."""
-    sessions = []
-    try:
-        r = await aioredis.from_url(redis_url)
-        cursor = 0
-        while True:
-            cursor, keys = await r.scan(cursor, match="fsm:*:state", count=100)
-            for key in keys:
-                state_val = await r.get(key)
-                if state_val and b"interviewing" in state_val:
-                    data_key = key.replace(b":state", b":data")
-                    data_val = await r.get(data_key)
-                    if data_val:
-                        try:
-                            data = json.loads(data_val)
-                            parts = key.decode().split(":")
-                            if len(parts) >= 4:
-                                user_id = int(parts[3])
-                                sessions.append({
-                                    "user_id":        user_id,
-                                    "data":           data,
-                                    "key":            key.decode(),
-                                    "data_key":       data_key.decode(),
-                                    "last_activity":  data.get("last_activity", 0),
-                                    "reminders_sent": data.get("reminders_sent", 0),
-                                })
-                        except (json.JSONDecodeError, ValueError, IndexError) as e:
-                            logger.warning(f"Could not parse session key {key}: {e}")
-            if cursor == 0:
-                break
-        await r.aclose()
-    except Exception as e:
-        logger.error(f"Redis scan error: {e}")
-    return sessions
+def next_deadline(last_activity: float, reminders_sent: int,
+                  last_sent: Optional[float] = None) -> Optional[float]:
+    """When the next reminder tier becomes due (None if all were sent).
 
+    Never sooner than REMINDER_GAP_HOURS after ``last_sent``: a session that is
+    already past several tiers (after downtime, or indexed by the backfill)
+    gets its reminders a day apart instead of all within seconds.
+    """
+    if reminders_sent >= len(REMINDER_DELAYS_HOURS):
+        return None
+    deadline = last_activity + REMINDER_DELAYS_HOURS[reminders_sent] * 3600
+    if last_sent is not None:
+        deadline = max(deadline, last_sent + REMINDER_GAP_HOURS * 3600)
+    return deadline
 
-async def check_inactive_candidates(bot: Bot, redis_url: str) -> None:
-    """Check for inactive candidates and send tiered reminders."""
-    now      = time.time()
-    sessions = await get_all_interview_sessions(redis_url)
 
-    if not sessions:
-        return
+async def check_inactive_candidates(sender: OutboundSender, activity: ActivityIndex,
+                                    lease: Optional[LeaderLease] = None) -> int:
+    """Claim sessions whose reminder deadline passed and send tiered reminders.
 
-    try:
-        r = await aioredis.from_url(redis_url)
-    except Exception as e:
-        logger.error(f"Redis connect error in check_inactive_candidates: {e}")
-        return
-
-    for session in sessions:
-        user_id         = session["user_id"]
-        last_activity   = session["last_activity"]
-        reminders_sent  = session["reminders_sent"]
-        data_key        = session["data_key"]
+    Returns the number of claimed sessions (0 means nothing is due yet).
+    """
+    now      = time.time()
+    user_ids = await activity.claim_due(now, lease=lease)
+    if not user_ids:
+        return 0
 
+    for user_id, (last_activity, reminders_sent) in zip(user_ids,
+                                                        await activity.session_info(user_ids)):
         # FIX 3a: skip sessions where last_activity was never recorded
-        if not last_activity or last_activity == 0:
+        if not last_activity:
             logger.debug(f"Skipping user {user_id}: no last_activity recorded yet")
+            await activity.reschedule(user_id, None)
             continue
 
         hours_inactive = (now - last_activity) / 3600
@@ -109,42 +96,75 @@ async def check_inactive_candidates(bot: Bot, redis_url: str) -> None:
                 reminder_idx = i
                 break
 
-        if reminder_idx is not None:
-            try:
-                await bot.send_message(user_id, REMINDER_MESSAGES[reminder_idx])
-                logger.info(f"Sent reminder #{reminder_idx + 1} to user {user_id} "
-                            f"({hours_inactive:.1f}h inactive)")
-
-                # FIX 3b: update reminders_sent in Redis (was a comment before)
-                raw = await r.get(data_key)
-                if raw:
-                    try:
-                        data = json.loads(raw)
-                        data["reminders_sent"] = reminder_idx + 1
-                        await r.set(data_key, json.dumps(data))
-                        logger.info(f"Updated reminders_sent={reminder_idx + 1} for user {user_id}")
-                    except Exception as update_err:
-                        logger.error(f"Failed to update reminders_sent for {user_id}: {update_err}")
-
-            except Exception as send_err:
-                logger.warning(f"Could not send reminder to {user_id}: {send_err}")
-
-        # Log stale sessions (older than STALE_DAYS)
-        if hours_inactive >= STALE_DAYS * 24:
-            logger.info(
-                f"Stale interview session: user {user_id}, "
-                f"{hours_inactive:.0f}h inactive, {reminders_sent} reminders sent"
+        if reminder_idx is None:
+            # Candidate became active again or the next tier isn't due yet
+            await activity.reschedule(user_id, next_deadline(last_activity, reminders_sent))
+            continue
+
+        try:
+            # Low lane: a large batch drains at the flood-control rate, no drops
+            await sender.send(user_id, REMINDER_MESSAGES[reminder_idx], lane="low")
+            logger.info(f"Queued reminder #{reminder_idx + 1} to user {user_id} "
+                        f"({hours_inactive:.1f}h inactive)")
+        except Exception as send_err:
+            # Claim lease expires and the reminder is retried later
+            logger.warning(f"Could not queue reminder to {user_id}: {send_err}")
+            continue
+
+        # FIX 3b: record reminder progress atomically in its own hash;
+        # the FSM data blob (interview history) is never read or written here
+        try:
+            recorded = await activity.advance_reminder(
+                user_id, reminders_sent, last_activity,
+                next_deadline(last_activity, reminder_idx + 1, now),
             )
+            if not recorded:
+                logger.warning(f"reminders_sent for {user_id} changed concurrently, not overwritten")
+        except Exception as update_err:
+            logger.error(f"Failed to update reminders_sent for {user_id}: {update_err}")
 
-    await r.aclose()
+    return len(user_ids)
 
 
-async def run_scheduler(bot: Bot, redis_url: str) -> None:
-    """Background task: run periodic re-engagement checks every hour."""
-    logger.info("Scheduler started — checking inactive candidates every hour")
-    while True:
-        try:
-            await check_inactive_candidates(bot, redis_url)
-        except Exception as e:
-            logger.error(f"Scheduler loop error: {e}")
-        await asyncio.sleep(3600)
+async def wait_for_next_deadline(activity: ActivityIndex, pubsub) -> None:
+    """Sleep until the earliest deadline, or earlier if a sooner one is published."""
+    deadline = await activity.next_deadline()
+    timeout = MAX_SLEEP if deadline is None else min(max(deadline - time.time(), 0), MAX_SLEEP)
+    if timeout <= 0:
+        return
+    await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+
+
+async def run_scheduler(bot: Bot, sender: OutboundSender, activity: ActivityIndex,
+                        storage: BaseStorage, lease: Optional[LeaderLease] = None) -> None:
+    """Background task: send reminders exactly when they become due."""
+    logger.info("Scheduler started — waiting for the next reminder deadline")
+    try:
+        await activity.backfill(storage, bot.id)
+    except Exception as e:
+        logger.error(f"Activity index backfill failed: {e}")
+
+    pubsub = activity.redis.pubsub()
+    await pubsub.subscribe(WAKEUP_CHANNEL)
+    last_stale_log = 0.0
+    try:
+        while True:
+            try:
+                # Drain everything that is due, batch by batch
+                with SCHEDULER_CYCLE.time():
+                    while await check_inactive_candidates(sender, activity, lease):
+                        pass
+
+                # Log stale sessions (older than STALE_DAYS) once an hour
+                if time.time() - last_stale_log >= 3600:
+                    last_stale_log = time.time()
+                    stale = await activity.count_stale(last_stale_log - STALE_DAYS * 24 * 3600)
+                    if stale:
+                        logger.info(f"Stale interview sessions (>{STALE_DAYS}d inactive): {stale}")
+
+                await wait_for_next_deadline(activity, pubsub)
+            except Exception as e:
+                logger.error(f"Scheduler loop error: {e}")
+                await asyncio.sleep(5)
+    finally:
+        await pubsub.aclose()
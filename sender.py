@@ -0,0 +1,383 @@
+"""
+sender.py - Outbound message dispatcher for MUGON HR Bot
+Every bulk/background message (reminders, CEO/PM reports) is queued durably
+in Redis streams and delivered by sender workers that respect Telegram flood
+limits: a global token bucket (~30 msg/s per bot) and a per-chat one (1 msg/s),
+both shared across replicas through ratelimit.py. TelegramRetryAfter is
+obeyed and the message retried, never dropped.
+
+Candidate replies are sent inline by the handlers (the answer has to follow
+the question), but FloodControlMiddleware on the bot session makes them take
+from the same global bucket and sit out TelegramRetryAfter, so replies and
+queued traffic together stay under the bot-wide limit.
+
+Delivery is at-least-once: an entry is acked only once it was sent, moved
+to the retry set or dead-lettered.
+  - Markdown rejected by Telegram ("can't parse entities") -> resent as plain text
+  - transient errors (network, 5xx) -> hr:out:retry ZSET with exponential
+    backoff, moved back to its lane stream when due
+  - permanent errors or MAX_ATTEMPTS exhausted -> hr:out:dead stream (DLQ)
+
+Lanes, drained in priority order:
+  high   - candidate-facing messages not tied to the update in hand
+  normal - CEO/PM notifications
+  low    - re-engagement reminders
+
+Usage:
+    python sender.py stats
+    python sender.py requeue-dead [limit]   # after fixing the cause
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter,
+)
+from aiogram.methods import (
+    CopyMessage, ForwardMessage, SendDocument, SendMediaGroup, SendMessage, SendPhoto,
+)
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from metrics import SENDER_DEAD, SENDER_MESSAGES, SENDER_QUEUE, SENDER_RETRYING
+from ratelimit import RateLimiter
+from tracing import current_trace_id, span
+
+logger = logging.getLogger(__name__)
+
+LANES         = ("high", "normal", "low")
+STREAM_PREFIX = "hr:out:"
+GROUP         = "senders"
+STREAM_MAXLEN = 100_000
+BATCH_SIZE    = 50
+RECLAIM_IDLE_MS = 60_000            # pending entries of a dead sender are taken over after this
+RETRY_KEY     = "hr:out:retry"
+DEAD_STREAM   = "hr:out:dead"
+MAX_ATTEMPTS  = int(os.environ.get("SENDER_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE  = 2.0                 # seconds, doubled per attempt
+BACKOFF_MAX   = 600.0
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+GLOBAL_RATE   = float(os.environ.get("SENDER_GLOBAL_RATE", "30"))   # messages per second
+GLOBAL_BURST  = int(os.environ.get("SENDER_GLOBAL_BURST", "30"))
+CHAT_INTERVAL = float(os.environ.get("SENDER_CHAT_INTERVAL", "1"))  # seconds between messages to one chat
+RATE_PREFIX   = "hr:out:rl:"
+STATS_INTERVAL = 15                 # seconds between gauge exports
+INLINE_RETRIES = 3                  # TelegramRetryAfter retries of an inline reply
+# Requests that count toward Telegram's per-bot message limit
+MESSAGE_METHODS = (SendMessage, SendDocument, SendPhoto, SendMediaGroup, CopyMessage, ForwardMessage)
+
+# Set while the sender delivers: its requests already took a token
+_delivering: contextvars.ContextVar[bool] = contextvars.ContextVar("sender_delivering", default=False)
+
+
+# KEYS[1] = retry zset; ARGV = now, limit, stream prefix, maxlen
+# Moves due retries back to their lane stream; ZREM + XADD in one script,
+# so a retry is never lost or duplicated between replicas.
+RELEASE_RETRIES_LUA = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+    local msg = cjson.decode(item)
+    redis.call('XADD', ARGV[3] .. msg['lane'], 'MAXLEN', '~', ARGV[4], '*',
+               'chat_id', msg['chat_id'], 'text', msg['text'],
+               'kwargs', msg['kwargs'], 'attempts', msg['attempts'])
+end
+return #items
+"""
+
+
+def lane_stream(lane: str) -> str:
+    return f"{STREAM_PREFIX}{lane}"
+
+
+def backoff(attempts: int) -> float:
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def is_markdown_error(e: Exception) -> bool:
+    return isinstance(e, TelegramBadRequest) and "parse entities" in str(e)
+
+
+async def wait_global(limiter: RateLimiter) -> None:
+    """Take a token from the bot-wide bucket, sleeping until one is free."""
+    while wait := await limiter.hit("global", 1 / GLOBAL_RATE, GLOBAL_BURST):
+        await asyncio.sleep(wait)
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: inline replies share the sender's global bucket
+    and are retried after TelegramRetryAfter instead of failing the handler."""
+
+    def __init__(self, redis: aioredis.Redis):
+        self.limiter = RateLimiter(redis, prefix=RATE_PREFIX)
+
+    async def __call__(self, make_request: Callable[..., Awaitable], bot, method):
+        if _delivering.get() or not isinstance(method, MESSAGE_METHODS):
+            return await make_request(bot, method)
+        for attempt in range(INLINE_RETRIES + 1):
+            await wait_global(self.limiter)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                SENDER_MESSAGES.labels(lane="inline", outcome="retry_after").inc()
+                if attempt == INLINE_RETRIES:
+                    raise
+                logger.warning(f"Flood control for chat {getattr(method, 'chat_id', None)}, "
+                               f"retrying reply in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+                continue
+            SENDER_MESSAGES.labels(lane="inline", outcome="sent").inc()
+            return result
+
+
+class OutboundSender:
+    """Durable, rate-limited, prioritized send_message queue."""
+
+    def __init__(self, bot: Bot, redis: aioredis.Redis):
+        self.bot = bot
+        self.redis = redis
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.limiter = RateLimiter(redis, prefix=RATE_PREFIX)
+        self.counters: Counter = Counter()
+        self._release_retries = redis.register_script(RELEASE_RETRIES_LUA)
+        self._stopping = asyncio.Event()
+
+    def _count(self, outcome: str, lane: str) -> None:
+        self.counters[f"{outcome}_{lane}"] += 1
+        SENDER_MESSAGES.labels(lane=lane, outcome=outcome).inc()
+
+    async def send(self, chat_id: int, text: str, lane: str = "normal", **kwargs) -> str:
+        """Queue a message; returns the stream entry id."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}")
+        entry_id = await self.redis.xadd(
+            lane_stream(lane),
+            {"chat_id": chat_id, "text": text, "kwargs": json.dumps(kwargs),
+             "trace": current_trace_id()},
+            maxlen=STREAM_MAXLEN, approximate=True,
+        )
+        self._count("queued", lane)
+        return entry_id
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        while wait := await self.limiter.hit(f"chat:{chat_id}", CHAT_INTERVAL, 1):
+            await asyncio.sleep(wait)
+        await wait_global(self.limiter)
+
+    async def _retry_later(self, lane: str, entry_id, chat_id: int, text: str,
+                           kwargs: dict, attempts: int, error: Exception) -> None:
+        if attempts >= MAX_ATTEMPTS or isinstance(error, PERMANENT_ERRORS):
+            await self._dead_letter(lane, entry_id, chat_id, text, kwargs, attempts, error)
+            return
+        delay = backoff(attempts)
+        item = json.dumps({"lane": lane, "chat_id": chat_id, "text": text,
+                           "kwargs": json.dumps(kwargs), "attempts": attempts})
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zadd(RETRY_KEY, {item: time.time() + delay})
+        pipe.xack(lane_stream(lane), GROUP, entry_id)
+        await pipe.execute()
+        self._count("retried", lane)
+        logger.warning(f"Send to {chat_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+
+    async def _dead_letter(self, lane: str, entry_id, chat_id: int, text: str,
+                           kwargs: dict, attempts: int, error: Exception) -> None:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(DEAD_STREAM, {"lane": lane, "chat_id": chat_id, "text": text,
+                                "kwargs": json.dumps(kwargs), "attempts": attempts,
+                                "error": f"{type(error).__name__}: {error}"},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack(lane_stream(lane), GROUP, entry_id)
+        await pipe.execute()
+        self._count("dead", lane)
+        logger.error(f"Message to {chat_id} dead-lettered after {attempts} attempts: {error}")
+
+    async def _deliver(self, lane: str, entry_id, fields: dict) -> None:
+        # Own trace per delivery, linked to the update that queued it
+        with span("outbound.deliver", lane=lane,
+                  origin_trace_id=(fields.get(b"trace") or b"").decode() or None):
+            await self._deliver_traced(lane, entry_id, fields)
+
+    async def _deliver_traced(self, lane: str, entry_id, fields: dict) -> None:
+        chat_id  = int(fields[b"chat_id"])
+        text     = fields[b"text"].decode()
+        kwargs   = json.loads(fields.get(b"kwargs") or b"{}")
+        attempts = int(fields.get(b"attempts") or 0)
+        while True:
+            await self._wait_turn(chat_id)
+            token = _delivering.set(True)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                self._count("sent", lane)
+                break
+            except TelegramRetryAfter as e:
+                self.counters["retry_after"] += 1
+                SENDER_MESSAGES.labels(lane=lane, outcome="retry_after").inc()
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                if kwargs.get("parse_mode") and is_markdown_error(e):
+                    # Unescaped candidate text broke the markup: plain text still informs
+                    logger.warning(f"Markup rejected for {chat_id}, resending as plain text: {e}")
+                    self.counters["plain_fallback"] += 1
+                    SENDER_MESSAGES.labels(lane=lane, outcome="plain_fallback").inc()
+                    kwargs.pop("parse_mode")
+                    continue
+                await self._retry_later(lane, entry_id, chat_id, text, kwargs, attempts + 1, e)
+                return
+            finally:
+                _delivering.reset(token)
+        await self.redis.xack(lane_stream(lane), GROUP, entry_id)
+
+    async def _deliver_batch(self, lane: str, entries: list) -> None:
+        # One task per chat: chats proceed in parallel, each chat stays ordered
+        by_chat: dict[bytes, list] = {}
+        for entry_id, fields in entries:
+            by_chat.setdefault(fields[b"chat_id"], []).append((entry_id, fields))
+
+        async def drain(items: list) -> None:
+            for entry_id, fields in items:
+                await self._deliver(lane, entry_id, fields)
+
+        await asyncio.gather(*(drain(items) for items in by_chat.values()))
+
+    async def _ensure_groups(self) -> None:
+        for lane in LANES:
+            try:
+                await self.redis.xgroup_create(lane_stream(lane), GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _reclaim(self) -> None:
+        """Take over entries left pending by a sender that died mid-delivery."""
+        for lane in LANES:
+            _, entries, *_ = await self.redis.xautoclaim(
+                lane_stream(lane), GROUP, self.consumer,
+                min_idle_time=RECLAIM_IDLE_MS, count=BATCH_SIZE,
+            )
+            if entries:
+                logger.info(f"Reclaimed {len(entries)} pending {lane} messages")
+                await self._deliver_batch(lane, entries)
+
+    async def release_retries(self) -> int:
+        """Move retries whose backoff elapsed back to their lane streams."""
+        return int(await self._release_retries(
+            keys=[RETRY_KEY], args=[time.time(), BATCH_SIZE, STREAM_PREFIX, STREAM_MAXLEN],
+        ))
+
+    async def requeue_dead(self, limit: int = 100) -> int:
+        """Put dead-lettered messages back on their lanes (after fixing the cause)."""
+        entries = await self.redis.xrange(DEAD_STREAM, count=limit)
+        for entry_id, fields in entries:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.xadd(lane_stream(fields[b"lane"].decode()),
+                      {"chat_id": fields[b"chat_id"], "text": fields[b"text"],
+                       "kwargs": fields[b"kwargs"]},
+                      maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.xdel(DEAD_STREAM, entry_id)
+            await pipe.execute()
+        return len(entries)
+
+    async def run(self) -> None:
+        """Sender worker loop; safe to run in every replica."""
+        await self._ensure_groups()
+        logger.info(f"Outbound sender {self.consumer} started")
+        loop = asyncio.get_running_loop()
+        next_reclaim = 0.0
+        while not self._stopping.is_set():
+            try:
+                if loop.time() >= next_reclaim:
+                    await self._reclaim()
+                    next_reclaim = loop.time() + RECLAIM_IDLE_MS / 1000
+                await self.release_retries()
+                resp = await self.redis.xreadgroup(
+                    GROUP, self.consumer, {lane_stream(lane): ">" for lane in LANES},
+                    count=BATCH_SIZE, block=1000,
+                )
+                batches = {stream.decode(): entries for stream, entries in resp or []}
+                for lane in LANES:
+                    entries = batches.get(lane_stream(lane))
+                    if entries:
+                        await self._deliver_batch(lane, entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbound sender loop error: {e}")
+                await asyncio.sleep(1)
+        logger.info(f"Outbound sender {self.consumer} stopped")
+
+    async def stop(self) -> None:
+        """Finish the batch in hand and leave run(); the rest stays queued."""
+        self._stopping.set()
+
+    async def stats(self) -> dict:
+        """Counters of this process, queue depth (backlog + in flight) per lane,
+        scheduled retries and dead letters."""
+        depth: dict[str, int] = {}
+        for lane in LANES:
+            try:
+                groups = await self.redis.xinfo_groups(lane_stream(lane))
+            except ResponseError:
+                groups = []
+            info = next((g for g in groups if g.get("name") in (GROUP, GROUP.encode())), None)
+            depth[lane] = int((info or {}).get("lag") or 0) + int((info or {}).get("pending") or 0)
+        return {
+            "counters": dict(self.counters),
+            "depth":    depth,
+            "retrying": await self.redis.zcard(RETRY_KEY),
+            "dead":     await self.redis.xlen(DEAD_STREAM),
+        }
+
+    async def export_stats(self, interval: float = STATS_INTERVAL) -> None:
+        """Publish queue depth, retries and dead letters as gauges until stopped."""
+        while not self._stopping.is_set():
+            try:
+                stats = await self.stats()
+                for lane, depth in stats["depth"].items():
+                    SENDER_QUEUE.labels(lane=lane).set(depth)
+                SENDER_RETRYING.set(stats["retrying"])
+                SENDER_DEAD.set(stats["dead"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Sender stats export failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _cli(argv: list[str]) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    redis = aioredis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+    # Queue operations only: nothing is sent from here, so no Bot is needed
+    sender = OutboundSender(None, redis)
+    try:
+        if argv[:1] == ["stats"]:
+            print(await sender.stats())
+        elif argv[:1] == ["requeue-dead"] and len(argv) <= 2:
+            limit = int(argv[1]) if len(argv) == 2 else 100
+            print(f"Requeued {await sender.requeue_dead(limit)} dead-lettered messages")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        await redis.aclose()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(asyncio.run(_cli(sys.argv[1:])))
@@ -0,0 +1,373 @@
+"""
+similarity.py - Duplicate / near-duplicate candidate detection for MUGON HR Bot
+The same person sometimes interviews again from another Telegram account or
+phone, and some candidates paste the same stock answers. Every finished
+interview is indexed here; matches are flagged in the CEO/PM report.
+
+  contact share   same phone under another tg_id, same tg_id with another
+                  phone (exact, dict lookups)
+  finalization    the candidate's answers compared with every earlier
+                  interview: character 5-gram shingles -> 128-value MinHash
+                  signature -> LSH (32 bands x 4 rows) for candidates, the
+                  estimated Jaccard similarity of those checked in one NumPy
+                  comparison; SIMILARITY_THRESHOLD and above is flagged
+
+Everything signature-sized is a flat NumPy array, no per-row Python objects:
+signatures in one uint16 matrix (the low half of each MinHash value: a chance
+match is 1 in 65536, far below the estimate's own error), and per band the 4
+values folded into one uint64 key, kept sorted with the owning rows alongside,
+so a band lookup is two np.searchsorted calls. Rows added since the last sort
+(up to TAIL_MAX) are compared directly; then the band arrays are re-sorted.
+Load time, memory and query time: benchmarks/duplicates.py.
+
+Signatures are persisted to the ANALYTICS_DB SQLite file; the index is
+loaded when the process starts (load()), and before each query picks up
+the rows other processes added since its last sync (id order), so replicas
+on one host agree. Phones are stored only as hashes salted with SIMILARITY_SALT.
+
+Usage:
+    python similarity.py rebuild [archive_dir]   # index archived sessions
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+import numpy as np
+
+from analytics import ANALYTICS_DB
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD  = float(os.environ.get("SIMILARITY_THRESHOLD", "0.6"))
+PHONE_SALT = os.environ.get("SIMILARITY_SALT", "mugon-hr")
+SHINGLE    = 5            # characters
+NUM_PERM   = 128
+BANDS      = 32           # BANDS * ROWS == NUM_PERM; LSH threshold ~ (1/32) ** (1/4) = 0.42
+ROWS       = NUM_PERM // BANDS
+MIN_CHARS  = 200          # shorter answer texts are too generic to compare
+MAX_MATCHES = 5
+TAIL_MAX   = 2048         # unsorted recent rows before the band arrays are re-sorted
+SYNC_BATCH = 10_000       # SQLite rows per fetch: bounds the transient blob copies
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    id           INTEGER PRIMARY KEY,
+    interview_id TEXT UNIQUE,
+    tg_id        INTEGER,
+    phone_hash   TEXT,
+    signature    BLOB,
+    added_at     REAL
+);
+"""
+
+_NON_WORD = re.compile(r"[\W_]+")
+_rng = np.random.default_rng(20240917)            # fixed: signatures are persisted
+_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_BASE = np.uint64(1_000_003)
+_FOLD = np.uint64(0x9E3779B97F4A7C15)                 # odd: multiplying is a bijection
+_CHUNK = 2048             # shingles hashed per step, bounds the temporary matrix
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def shingles(text: str) -> np.ndarray:
+    """Distinct 64-bit hashes of the character 5-grams of normalized text."""
+    codes = np.frombuffer(normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    n = len(codes) - SHINGLE + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    hashes = np.zeros(n, dtype=np.uint64)
+    for i in range(SHINGLE):                      # polynomial hash, wraps mod 2**64
+        hashes = hashes * _BASE + codes[i:i + n]
+    hashes ^= hashes >> np.uint64(31)             # spread the low bits before multiply-shift
+    return np.unique(hashes)
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature (uint32[NUM_PERM]), or None for texts too short to compare."""
+    if len(text) < MIN_CHARS:
+        return None
+    values = shingles(text)
+    if not len(values):
+        return None
+    sig = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+    buf = np.empty((NUM_PERM, min(len(values), _CHUNK)), dtype=np.uint64)
+    for start in range(0, len(values), _CHUNK):
+        chunk = values[start:start + _CHUNK]
+        hashed = buf[:, :len(chunk)]
+        # multiply-shift: top 32 bits of (a*x + b) mod 2**64, one row per permutation;
+        # in place, temporaries of this size cost more than the arithmetic
+        np.multiply(_A[:, None], chunk[None, :], out=hashed)
+        hashed += _B[:, None]
+        hashed >>= np.uint64(32)
+        np.minimum(sig, hashed.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+
+def band_keys(sigs: np.ndarray) -> np.ndarray:
+    """uint64[n, BANDS]: the ROWS values of every LSH band folded into one key."""
+    values = sigs.reshape(len(sigs), BANDS, ROWS)
+    keys = values[:, :, 0].astype(np.uint64)
+    for r in range(1, ROWS):
+        keys *= _FOLD
+        keys ^= values[:, :, r]
+    return keys
+
+
+def phone_hash(phone: str) -> str:
+    digits = re.sub(r"\D", "", phone or "")[-10:]
+    return hashlib.sha256(f"{PHONE_SALT}:{digits}".encode()).hexdigest()[:20] if digits else ""
+
+
+def answers_text(history: list) -> str:
+    """The candidate's own answers (bot markers like "[Кандидат прислал ...]" skipped)."""
+    return "\n".join(m["content"] for m in history
+                     if m.get("role") == "user" and not m.get("content", "").startswith("["))
+
+
+class SimilarityIndex:
+    """In-memory MinHash/LSH index mirrored in SQLite; thread-safe, blocking calls."""
+
+    def __init__(self, path: str = ANALYTICS_DB, threshold: float = THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._synced = 0                                   # last SQLite id loaded
+        self._sigs = np.empty((1024, NUM_PERM), dtype=np.uint16)
+        self._count = 0
+        self._row_owner: list[int] = []                    # signature row -> interview index
+        self._interviews: list[str] = []
+        self._tg_ids: list[int] = []
+        # Per band: keys of rows [0, _sorted) in ascending order, and their rows
+        self._band_keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._band_rows = np.empty((BANDS, 0), dtype=np.int32)
+        self._sorted = 0
+        self._by_phone: dict[str, list[int]] = {}
+        self._by_tg: dict[int, list[int]] = {}
+        self._phones: list[str] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # ------------------------------------------------------------ in-memory index
+
+    def _append(self, rows: list[tuple]) -> None:
+        """Add (interview_id, tg_id, phone_hash, signature bytes or None) rows."""
+        blobs = []
+        for interview_id, tg_id, phone, sig in rows:
+            i = len(self._interviews)
+            self._interviews.append(interview_id)
+            self._tg_ids.append(tg_id)
+            self._phones.append(phone)
+            if phone:
+                self._by_phone.setdefault(phone, []).append(i)
+            self._by_tg.setdefault(tg_id, []).append(i)
+            if sig is not None:
+                blobs.append(sig)
+                self._row_owner.append(i)
+        if not blobs:
+            return
+        block = np.frombuffer(b"".join(blobs), dtype=np.uint32).reshape(len(blobs), NUM_PERM)
+        block = block.astype(np.uint16)
+        needed = self._count + len(block)
+        if needed > len(self._sigs):
+            grown = np.empty((max(needed, 2 * len(self._sigs)), NUM_PERM), dtype=np.uint16)
+            grown[:self._count] = self._sigs[:self._count]
+            self._sigs = grown
+        self._sigs[self._count:needed] = block
+        self._count = needed
+        if self._count - self._sorted > TAIL_MAX:
+            self._sort_bands()
+
+    def _sort_bands(self) -> None:
+        keys = np.ascontiguousarray(band_keys(self._sigs[:self._count]).T)
+        rows = np.argsort(keys, axis=1).astype(np.int32)
+        self._band_keys = np.take_along_axis(keys, rows, axis=1)
+        self._band_rows = rows
+        self._sorted = self._count
+
+    def _sync(self) -> None:
+        cursor = self._connect().execute(
+            "SELECT id, interview_id, tg_id, phone_hash, signature FROM signatures"
+            " WHERE id > ? ORDER BY id", (self._synced,))
+        while rows := cursor.fetchmany(SYNC_BATCH):
+            self._append([row[1:] for row in rows])
+            self._synced = rows[-1][0]
+
+    def _match(self, i: int, reason: str, similarity: float = 1.0) -> dict:
+        return {"interview_id": self._interviews[i], "tg_id": self._tg_ids[i],
+                "reason": reason, "similarity": round(similarity, 2)}
+
+    def _contact_matches(self, tg_id: int, phone: str) -> list[dict]:
+        matches = [self._match(i, "phone") for i in self._by_phone.get(phone, ())
+                   if self._tg_ids[i] != tg_id]
+        matches += [self._match(i, "tg_id") for i in self._by_tg.get(tg_id, ())
+                    if phone and self._phones[i] and self._phones[i] != phone]
+        return matches[-MAX_MATCHES:]
+
+    def _candidates(self, sig: np.ndarray) -> np.ndarray:
+        """Rows sharing at least one LSH band with ``sig`` (uint16, as stored)."""
+        query = band_keys(sig[None, :])[0]
+        hit = np.zeros(self._count, dtype=bool)
+        if self._sorted:
+            lo = [np.searchsorted(self._band_keys[b], query[b], "left") for b in range(BANDS)]
+            hi = [np.searchsorted(self._band_keys[b], query[b], "right") for b in range(BANDS)]
+            for b in range(BANDS):
+                hit[self._band_rows[b, lo[b]:hi[b]]] = True
+        if self._count > self._sorted:
+            tail = band_keys(self._sigs[self._sorted:self._count])
+            hit[self._sorted:] = (tail == query).any(axis=1)
+        return np.flatnonzero(hit)
+
+    def _text_matches(self, sig: np.ndarray, tg_id: int) -> list[dict]:
+        sig = sig.astype(np.uint16)
+        rows = self._candidates(sig)
+        if not len(rows):
+            return []
+        # share of equal MinHash values estimates the Jaccard similarity of the shingle sets
+        scores = np.count_nonzero(self._sigs.take(rows, axis=0) == sig, axis=1) / NUM_PERM
+        keep = scores >= self.threshold
+        rows, scores = rows[keep], scores[keep]
+        matches = []
+        for k in np.argsort(-scores):
+            owner = self._row_owner[rows[k]]
+            if self._tg_ids[owner] != tg_id:
+                matches.append(self._match(owner, "answers", float(scores[k])))
+        return matches[:MAX_MATCHES]
+
+    # ------------------------------------------------------------ API
+
+    def sync(self) -> int:
+        """Load the rows added since the last sync; returns the interviews indexed."""
+        with self._lock:
+            self._sync()
+            return len(self._interviews)
+
+    def memory(self) -> int:
+        """Bytes held in the signature and band arrays."""
+        return self._sigs.nbytes + self._band_keys.nbytes + self._band_rows.nbytes
+
+    def check_contact(self, tg_id: int, phone: str) -> list[dict]:
+        """Earlier interviews with this phone from another account, or vice versa."""
+        with self._lock:
+            self._sync()
+            return self._contact_matches(tg_id, phone_hash(phone))
+
+    def check_and_add(self, interview_id: str, tg_id: int, phone: str, text: str) -> list[dict]:
+        """Flag matches of a finished interview, then index it."""
+        sig = signature(text)
+        hashed = phone_hash(phone)
+        with self._lock:
+            self._sync()
+            matches = self._contact_matches(tg_id, hashed)
+            if sig is not None:
+                matches += self._text_matches(sig, tg_id)
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO signatures (interview_id, tg_id, phone_hash, signature,"
+                    " added_at) VALUES (?, ?, ?, ?, ?)",
+                    (interview_id, tg_id, hashed, None if sig is None else sig.tobytes(), time.time()))
+            self._sync()
+        return matches
+
+    async def load(self) -> None:
+        """Read every stored signature now (at startup), not in the first contact share."""
+        t = time.perf_counter()
+        try:
+            count = await asyncio.to_thread(self.sync)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Duplicate index load failed: {e}")
+            return
+        logger.info(f"Duplicate index loaded: {count} interviews in {time.perf_counter() - t:.1f}s, "
+                    f"{self.memory() / 2**20:.0f} MiB")
+
+    async def contact(self, tg_id: int, phone: str) -> list[dict]:
+        """check_contact in a worker thread; never raises into the interview flow."""
+        try:
+            return await asyncio.to_thread(self.check_contact, tg_id, phone)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Duplicate check failed for {tg_id}: {e}")
+            return []
+
+    async def finished(self, interview_id: str, tg_id: int, phone: str, history: list) -> list[dict]:
+        """check_and_add over the candidate's answers; never raises into the interview flow."""
+        try:
+            return merge_matches(await asyncio.to_thread(
+                self.check_and_add, interview_id, tg_id, phone, answers_text(history)))
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Duplicate check failed for {interview_id}: {e}")
+            return []
+
+    def __len__(self) -> int:
+        return len(self._interviews)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def merge_matches(*groups: Iterable[dict]) -> list[dict]:
+    """One entry per earlier interview, the strongest reason kept."""
+    merged: dict[str, dict] = {}
+    for group in groups:
+        for match in group:
+            current = merged.get(match["interview_id"])
+            if current is None or match["similarity"] > current["similarity"]:
+                merged[match["interview_id"]] = match
+    return sorted(merged.values(), key=lambda m: -m["similarity"])[:MAX_MATCHES]
+
+
+# ---------------------------------------------------------------- rebuild
+
+def rebuild(index: SimilarityIndex, archive_dir: str) -> int:
+    """Index archived sessions (already indexed interview ids are skipped)."""
+    from archive import iter_archive
+
+    count = 0
+    for record in iter_archive(archive_dir):
+        data = record.get("data") or {}
+        if not data.get("interview_id") or not data.get("history"):
+            continue
+        index.check_and_add(data["interview_id"], data.get("tg_id"), data.get("phone", ""),
+                            answers_text(data["history"]))
+        count += 1
+    return count
+
+
+def _cli(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="similarity.py", description="Duplicate candidate index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("rebuild", help="index archived sessions")
+    fill.add_argument("archive_dir", nargs="?", default=os.environ.get("ARCHIVE_DIR", "archive"))
+    args = parser.parse_args(argv)
+
+    index = SimilarityIndex()
+    try:
+        print(f"Indexed {rebuild(index, args.archive_dir)} archived interviews, {len(index)} total")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_cli(sys.argv[1:]))
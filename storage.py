@@ -0,0 +1,251 @@
+"""
+storage.py - Compact FSM storage for MUGON HR Bot
+RedisStorage keeps each session's data dict (with the growing interview
+history) as ``json.dumps`` text: Cyrillic escaped as \\uXXXX, three times the
+UTF-8 size, and parsed by the slow stdlib decoder on every read.
+
+CompactRedisStorage encodes data with orjson (raw UTF-8) and compresses blobs
+above FSM_COMPRESS_MIN bytes. Every value starts with a format byte, so the
+encoding can change later without a migration:
+
+  0x01  orjson UTF-8 JSON
+  0x02  zlib-compressed orjson
+  0x03  zstd-compressed orjson
+  '{'   legacy RedisStorage JSON text, read transparently and rewritten in the
+        new format by the next set_data
+
+State keys are unchanged (short plain strings).
+
+CachedStorage puts a bounded in-process LRU/TTL cache in front of it: the
+several state/data reads of every update (dispatcher, middlewares, handler)
+are served from memory. Writes go through to Redis and are announced on a
+pub/sub channel; every replica drops its copy of the announced keys. Until
+its subscription is up (or after it drops) a replica reads Redis directly,
+so a missed invalidation can't serve stale state; FSM_CACHE_TTL bounds the
+staleness window of any message still in flight.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Optional
+import orjson
+import zstandard
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.fsm.state import State
+
+from metrics import FSM_CACHE
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION  = os.environ.get("FSM_COMPRESSION", "zstd")        # zstd | zlib | none
+COMPRESS_MIN = int(os.environ.get("FSM_COMPRESS_MIN", "1024"))   # bytes of JSON
+ZSTD_LEVEL   = 3
+ZLIB_LEVEL   = 6
+
+FORMAT_JSON   = 0x01
+FORMAT_ZLIB   = 0x02
+FORMAT_ZSTD   = 0x03
+LEGACY_PREFIX = ord("{")
+
+CACHE_SIZE    = int(os.environ.get("FSM_CACHE_SIZE", "5000"))     # entries (state + data)
+CACHE_TTL     = float(os.environ.get("FSM_CACHE_TTL", "300"))     # seconds, 0 disables
+CACHE_CHANNEL = "hr:fsm:invalidate"
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+class DataCodec:
+    """Bytes <-> FSM data dict, see the format bytes above."""
+
+    def __init__(self, compression: str = COMPRESSION, compress_min: int = COMPRESS_MIN):
+        if compression not in ("zstd", "zlib", "none"):
+            raise ValueError(f"Unknown FSM_COMPRESSION {compression!r}")
+        self.compression = compression
+        self.compress_min = compress_min
+        self._zstd_c = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        self._zstd_d = zstandard.ZstdDecompressor()
+
+    def encode(self, data: dict[str, Any]) -> bytes:
+        raw = orjson.dumps(data, option=_ORJSON_OPTIONS)
+        if self.compression == "none" or len(raw) < self.compress_min:
+            return bytes((FORMAT_JSON,)) + raw
+        if self.compression == "zstd":
+            return bytes((FORMAT_ZSTD,)) + self._zstd_c.compress(raw)
+        return bytes((FORMAT_ZLIB,)) + zlib.compress(raw, ZLIB_LEVEL)
+
+    def decode(self, value: bytes) -> dict[str, Any]:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        fmt, body = value[0], value[1:]
+        if fmt == FORMAT_JSON:
+            return orjson.loads(body)
+        if fmt == FORMAT_ZSTD:
+            return orjson.loads(self._zstd_d.decompress(body))
+        if fmt == FORMAT_ZLIB:
+            return orjson.loads(zlib.decompress(body))
+        if fmt == LEGACY_PREFIX:
+            # orjson parses the \uXXXX escapes of the old json.dumps text too
+            return orjson.loads(value)
+        raise ValueError(f"Unknown FSM data format byte 0x{fmt:02x}")
+
+
+class CompactRedisStorage(RedisStorage):
+    """RedisStorage with the compact data encoding; states stored as before."""
+
+    def __init__(self, redis, codec: Optional[DataCodec] = None, **kwargs):
+        super().__init__(redis, **kwargs)
+        self.codec = codec or DataCodec()
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        redis_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.redis.delete(redis_key)
+            return
+        await self.redis.set(redis_key, self.codec.encode(data), ex=self.data_ttl)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        redis_key = self.key_builder.build(key, "data")
+        value = await self.redis.get(redis_key)
+        if not value:
+            return {}
+        return self.codec.decode(value)
+
+
+class CachedStorage(BaseStorage):
+    """Write-through L1 cache over CompactRedisStorage, coherent via pub/sub.
+
+    Data is cached as orjson bytes, not dicts: handlers mutate what they get
+    (``history.append``), so every hit decodes a private copy.
+    """
+
+    def __init__(self, backend: CompactRedisStorage, size: int = CACHE_SIZE,
+                 ttl: float = CACHE_TTL):
+        self.backend = backend
+        self.redis = backend.redis
+        self.key_builder = backend.key_builder
+        self.size = size
+        self.ttl = ttl
+        self.origin = secrets.token_hex(8)
+        self.live = False            # subscribed: cached entries can be trusted
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # Redis round trip in progress per key; invalidation revokes the token,
+        # so a read that started before a write can't cache the old value
+        self._pending: dict[str, object] = {}
+
+    # ------------------------------------------------------------ L1
+
+    def _get(self, redis_key: str, part: str):
+        if not self.live:
+            return None
+        entry = self._entries.get(redis_key)
+        if entry is None or entry[0] < time.monotonic():
+            FSM_CACHE.labels(part=part, result="miss").inc()
+            return None
+        self._entries.move_to_end(redis_key)
+        FSM_CACHE.labels(part=part, result="hit").inc()
+        return entry
+
+    def _begin(self, redis_key: str) -> object:
+        token = self._pending[redis_key] = object()
+        return token
+
+    def _put(self, redis_key: str, token: object, value: Any) -> None:
+        if self._pending.get(redis_key) is not token:
+            return
+        del self._pending[redis_key]
+        if not self.live or not self.ttl:
+            return
+        self._entries[redis_key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(redis_key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *redis_keys: str) -> None:
+        for redis_key in redis_keys:
+            self._entries.pop(redis_key, None)
+            self._pending.pop(redis_key, None)
+
+    async def _announce(self, redis_key: str) -> None:
+        await self.redis.publish(CACHE_CHANNEL, f"{self.origin} {redis_key}")
+
+    async def evict(self, *redis_keys: str) -> None:
+        """Drop keys changed behind the storage's back from every replica's cache."""
+        self.invalidate(*redis_keys)
+        for redis_key in redis_keys:
+            await self._announce(redis_key)
+
+    # ------------------------------------------------------------ BaseStorage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        redis_key = self.key_builder.build(key, "state")
+        # Drop first: a concurrent reader must not see the old value after the write
+        self.invalidate(redis_key)
+        token = self._begin(redis_key)
+        await self.backend.set_state(key, state)
+        self._put(redis_key, token, state.state if isinstance(state, State) else state)
+        await self._announce(redis_key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        redis_key = self.key_builder.build(key, "state")
+        entry = self._get(redis_key, "state")
+        if entry is not None:
+            return entry[1]
+        token = self._begin(redis_key)
+        state = await self.backend.get_state(key)
+        self._put(redis_key, token, state)
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        redis_key = self.key_builder.build(key, "data")
+        self.invalidate(redis_key)
+        token = self._begin(redis_key)
+        await self.backend.set_data(key, data)
+        self._put(redis_key, token, orjson.dumps(data, option=_ORJSON_OPTIONS))
+        await self._announce(redis_key)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        redis_key = self.key_builder.build(key, "data")
+        entry = self._get(redis_key, "data")
+        if entry is not None:
+            return orjson.loads(entry[1])
+        token = self._begin(redis_key)
+        data = await self.backend.get_data(key)
+        self._put(redis_key, token, orjson.dumps(data, option=_ORJSON_OPTIONS))
+        return data
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    # ------------------------------------------------------------ coherence
+
+    async def listen(self) -> None:
+        """Background task: apply other replicas' invalidations.
+
+        The cache is only used while subscribed; on every (re)subscribe it
+        starts empty, since messages sent while disconnected are lost.
+        """
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CACHE_CHANNEL)
+                self._entries.clear()
+                self.live = True
+                logger.info("FSM cache invalidation subscribed")
+                async for message in pubsub.listen():
+                    origin, _, redis_key = message["data"].decode().partition(" ")
+                    if origin != self.origin:
+                        self.invalidate(redis_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"FSM cache invalidation lost ({e}), reading Redis directly")
+                await asyncio.sleep(1)
+            finally:
+                self.live = False
+                self._entries.clear()
+                await pubsub.aclose()
@@ -0,0 +1,273 @@
+"""
+supervisor.py - Sharded multi-core mode for MUGON HR Bot
+The supervisor ingests updates (polling or webhook) and routes each one by
+user id to one of K Redis streams. Every shard is consumed by its own worker
+process running a full Dispatcher, so one user's updates stay ordered while
+CPU-bound work (JSON, rendering, GPT bookkeeping) spreads across cores.
+
+Workers report a heartbeat after each update; the supervisor restarts any
+worker that exits or stops beating.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import os
+import time
+from aiohttp import web
+from aiogram import Bot
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from lifecycle import Lifecycle, SHUTDOWN_TIMEOUT
+from webhook import WebhookServer, update_user_id
+
+logger = logging.getLogger(__name__)
+
+STREAM_PREFIX    = "hr:updates:"
+GROUP            = "workers"
+STREAM_MAXLEN    = 100_000
+HEALTH_INTERVAL  = 5                                   # seconds between supervisor checks
+HEARTBEAT_TIMEOUT = int(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", "300"))
+MAX_RESTART_DELAY = 30
+
+
+def shard_stream(index: int) -> str:
+    return f"{STREAM_PREFIX}{index}"
+
+
+def shard_for(payload: dict, shards: int) -> int:
+    return hash(update_user_id(payload)) % shards
+
+
+# ---------------------------------------------------------------- worker side
+
+async def run_worker(index: int, heartbeat) -> None:
+    """Consume one shard stream and feed updates to a local Dispatcher."""
+    # Imported here: the worker is a fresh spawned interpreter
+    from aiogram.types import Update
+    from bot import build_dispatcher, recorded_keep_texts
+    from container import Container
+    from metrics import instrument_redis, start_metrics_server
+    from recorder import build_recorder
+    from storage import CachedStorage, CompactRedisStorage
+
+    # SIGTERM from the supervisor: finish the update in hand, then exit;
+    # unacked entries are replayed by the next incarnation
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
+
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"])
+    redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379")
+    r = instrument_redis(aioredis.from_url(redis_url))
+    storage = CachedStorage(CompactRedisStorage(redis=r))
+    deps = Container()
+    recorder = build_recorder(recorded_keep_texts())
+    dp = build_dispatcher(bot, storage, r, lifecycle, deps, recorder)
+    lifecycle.on_close(bot.session.close)
+    lifecycle.on_close(storage.close)
+    lifecycle.on_close(deps.close)
+    if recorder:
+        lifecycle.on_close(recorder.aclose)
+    # Each worker is its own process: metrics on METRICS_PORT + 1 + index
+    metrics_port = int(os.environ.get("METRICS_PORT", "9100"))
+    metrics_runner = await start_metrics_server(os.environ.get("METRICS_HOST", "0.0.0.0"),
+                                                metrics_port + 1 + index if metrics_port else 0)
+    if metrics_runner:
+        lifecycle.on_close(metrics_runner.cleanup)
+    lifecycle.spawn(storage.listen(), "fsm-cache")
+    lifecycle.spawn(deps.similarity.load(), "similarity-load")
+
+    stream = shard_stream(index)
+    consumer = f"worker-{index}"
+    try:
+        await r.xgroup_create(stream, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    # "0" first replays entries this consumer received but never acked
+    # (previous incarnation crashed mid-update), then ">" for new ones.
+    last_id = "0"
+    logger.info(f"Shard worker {index} started (pid {os.getpid()})")
+    try:
+        while not lifecycle.stopping.is_set():
+            heartbeat.value = time.time()
+            resp = await r.xreadgroup(GROUP, consumer, {stream: last_id},
+                                      count=50, block=1000)
+            entries = resp[0][1] if resp else []
+            if last_id == "0" and not entries:
+                last_id = ">"
+                continue
+            for entry_id, fields in entries:
+                if lifecycle.stopping.is_set():
+                    break
+                try:
+                    payload = json.loads(fields[b"u"])
+                    update = Update.model_validate(payload, context={"bot": bot})
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    logger.error(f"Shard {index}: update {entry_id} failed: {e}")
+                await r.xack(stream, GROUP, entry_id)
+                heartbeat.value = time.time()
+    finally:
+        await lifecycle.shutdown()
+
+
+def worker_main(index: int, heartbeat) -> None:
+    """Process entry point (must be importable for the spawn start method)."""
+    from logconfig import setup_logging
+
+    # Own log/trace files: K+1 processes rotating one file lose lines
+    setup_logging(f"shard{index}")
+    try:
+        asyncio.run(run_worker(index, heartbeat))
+    except KeyboardInterrupt:
+        pass
+
+
+# ------------------------------------------------------------ supervisor side
+
+class Supervisor:
+    """Starts K shard workers, routes updates to them and keeps them alive."""
+
+    def __init__(self, redis_url: str, shards: int):
+        self.redis = aioredis.from_url(redis_url)
+        self.shards = shards
+        self._ctx = mp.get_context("spawn")
+        self._procs: list = [None] * shards
+        self._heartbeats = [self._ctx.Value("d", 0.0) for _ in range(shards)]
+        self._restarts = [0] * shards
+        self._started_at = [0.0] * shards
+        self._next_start = [0.0] * shards
+
+    async def route(self, payload: dict) -> None:
+        stream = shard_stream(shard_for(payload, self.shards))
+        await self.redis.xadd(stream, {"u": json.dumps(payload)},
+                              maxlen=STREAM_MAXLEN, approximate=True)
+
+    def _start(self, index: int) -> None:
+        self._started_at[index] = self._heartbeats[index].value = time.time()
+        proc = self._ctx.Process(target=worker_main, args=(index, self._heartbeats[index]),
+                                 name=f"shard-{index}", daemon=True)
+        proc.start()
+        self._procs[index] = proc
+
+    async def _check(self, index: int) -> None:
+        proc = self._procs[index]
+        now = time.time()
+        if proc is not None and proc.is_alive():
+            stale = now - self._heartbeats[index].value
+            if stale < HEARTBEAT_TIMEOUT:
+                return
+            logger.error(f"Shard worker {index} unresponsive for {stale:.0f}s, restarting")
+            proc.kill()
+            # join() blocks: in a thread, so the loop keeps routing updates meanwhile
+            await asyncio.to_thread(proc.join, 5)
+        elif proc is not None:
+            logger.error(f"Shard worker {index} exited with code {proc.exitcode}")
+
+        if proc is not None and now < self._next_start[index]:
+            return
+        # Exponential backoff so a crash loop doesn't spin the CPU
+        if proc is not None:
+            ran_for = now - self._started_at[index]
+            self._restarts[index] = 0 if ran_for > 60 else self._restarts[index] + 1
+        delay = min(2 ** self._restarts[index], MAX_RESTART_DELAY)
+        self._next_start[index] = now + delay
+        self._start(index)
+
+    async def monitor(self) -> None:
+        while True:
+            for index in range(self.shards):
+                await self._check(index)
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def health(self) -> dict:
+        now = time.time()
+        return {
+            str(i): {
+                "alive":     bool(p and p.is_alive()),
+                "heartbeat": round(now - self._heartbeats[i].value, 1),
+                "restarts":  self._restarts[i],
+            }
+            for i, p in enumerate(self._procs)
+        }
+
+    async def stop(self) -> None:
+        procs = [proc for proc in self._procs if proc is not None and proc.is_alive()]
+        for proc in procs:
+            proc.terminate()
+        # Workers drain on SIGTERM; kill only the ones that overrun the deadline.
+        # Polled, not join()ed: the event loop stays free while they drain
+        deadline = time.time() + SHUTDOWN_TIMEOUT + 5
+        while any(proc.is_alive() for proc in procs) and time.time() < deadline:
+            await asyncio.sleep(0.2)
+        for proc in procs:
+            if proc.is_alive():
+                proc.kill()
+            await asyncio.to_thread(proc.join, 5)
+
+
+async def poll_into(bot: Bot, supervisor: Supervisor, allowed_updates: list[str]) -> None:
+    """Long-poll Telegram and route raw updates to shard streams.
+
+    The offset only advances after the batch is in Redis, so a supervisor
+    crash makes Telegram redeliver instead of losing updates.
+    """
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30,
+                                            allowed_updates=allowed_updates,
+                                            request_timeout=int(bot.session.timeout + 30))
+        except Exception as e:
+            logger.error(f"getUpdates failed: {e}")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await supervisor.route(update.model_dump(mode="json", by_alias=True,
+                                                     exclude_unset=True))
+            offset = update.update_id + 1
+
+
+async def run_sharded(bot: Bot, redis_url: str, allowed_updates: list[str]) -> None:
+    shards = int(os.environ.get("SHARD_WORKERS", str(os.cpu_count() or 2)))
+    supervisor = Supervisor(redis_url, shards)
+    monitor = asyncio.create_task(supervisor.monitor())
+
+    app = web.Application()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(supervisor.health())
+
+    app.router.add_get("/health", health)
+    ingest = os.environ.get("SHARD_INGEST", "polling")
+    if ingest == "webhook":
+        server = WebhookServer(bot, None, os.environ["WEBHOOK_SECRET"],
+                               path=os.environ.get("WEBHOOK_PATH", "/webhook"),
+                               sink=supervisor.route)
+        server.setup(app)
+        webhook_url = os.environ.get("WEBHOOK_URL")
+        if webhook_url:
+            await bot.set_webhook(webhook_url + server.path, secret_token=server.secret,
+                                  allowed_updates=allowed_updates,
+                                  drop_pending_updates=False)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = int(os.environ.get("WEBHOOK_PORT", "8080"))
+    await web.TCPSite(runner, os.environ.get("WEBHOOK_HOST", "0.0.0.0"), port).start()
+    logger.info(f"Supervisor started: {shards} shard workers, ingest={ingest}, port {port}")
+
+    try:
+        if ingest == "webhook":
+            await asyncio.Event().wait()
+        else:
+            await poll_into(bot, supervisor, allowed_updates)
+    finally:
+        monitor.cancel()
+        await supervisor.stop()
+        await runner.cleanup()
+        await supervisor.redis.aclose()
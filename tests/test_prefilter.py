@@ -0,0 +1,68 @@
+"""
+tests/test_prefilter.py - Verdicts of the low-effort answer filter
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prefilter import classify      # noqa: E402
+
+QUESTION = ("Расскажите о самом сложном проекте на Python, который вы делали. "
+            "Какая была архитектура и за что отвечали лично вы?")
+HISTORY = [
+    {"role": "assistant", "content": "Сколько лет вы пишете на Python?"},
+    {"role": "user", "content": "Пять лет, в основном бэкенд на FastAPI и asyncio."},
+    {"role": "assistant", "content": QUESTION},
+]
+
+
+@pytest.mark.parametrize("text", ["1000000", "Зарплата от 1000000 рублей", "Телефон 89000000000",
+                                  "2000000 событий в день обрабатывали без потерь"])
+def test_digit_runs_are_answers(text):
+    assert classify(text, HISTORY) is None
+
+
+@pytest.mark.parametrize("text", ["ааааааааа", "ну ооооооочень долго", "asdasdasdasdasd"])
+def test_letter_runs_are_garbage(text):
+    assert classify(text, HISTORY) == "garbage"
+
+
+@pytest.mark.parametrize("text", ["Go", "C#", "C++", "AI", "ML", "1С", "QA", "go.", "R"])
+def test_short_terms_are_answers(text):
+    assert classify(text, HISTORY) is None
+
+
+@pytest.mark.parametrize("text", ["ок", "Да", "+", "хз", "ну", "ab"])
+def test_acknowledgements_are_short(text):
+    assert classify(text, HISTORY) == "short"
+
+
+def test_pasted_question_is_echo():
+    assert classify(QUESTION, HISTORY) == "echo"
+    assert classify(QUESTION.lower().replace("?", ""), HISTORY) == "echo"
+
+
+@pytest.mark.parametrize("text", [
+    "Самый сложный проект на Python: архитектура на очередях, лично я отвечал за воркеры",
+    "Проект на Python, архитектура микросервисная",
+    QUESTION + " Делал CRM-интеграцию для сети клиник: FastAPI, очереди на Redis, "
+               "потом переписал воркеры на asyncio, задержка упала втрое.",
+])
+def test_answer_reusing_question_words_is_not_echo(text):
+    assert classify(text, HISTORY) is None
+
+
+def test_short_answer_inside_question_is_not_echo():
+    history = [{"role": "assistant", "content": "Какой у вас опыт работы с Python и Django?"}]
+    assert classify("Опыт работы с Python и Django большой", history) is None
+    assert classify("Какой у вас опыт работы с Python и Django?", history) == "echo"
+
+
+def test_repeated_answer():
+    assert classify(HISTORY[1]["content"], HISTORY) == "repeat"
@@ -0,0 +1,278 @@
+"""
+tracing.py - Per-update tracing for MUGON HR Bot
+A root span is opened for every Telegram update; child spans cover FSM
+storage reads/writes, OpenAI calls, AmoCRM requests and Bot API calls
+(send_message, answer, ...). The current span lives in a contextvar, so it
+follows the update through every await without being passed around, and its
+trace id is added to log lines.
+
+Sampling is tail-based: spans are only collected in memory and a finished
+trace is exported if it failed, won the TRACE_SAMPLE_RATE lottery, or was
+slow. Nearly every interview turn waits seconds for OpenAI, so "slow" is
+judged separately: TRACE_SLOW_MS against the time spent outside OpenAI
+calls, TRACE_SLOW_GPT_MS (the tail of GPT latency) against each OpenAI call.
+Export happens on a writer thread, appending OTLP/JSON lines to TRACE_FILE,
+rotated like the log (size or age, gzipped). The OpenTelemetry Collector can
+ingest that file offline (otlpjsonfile receiver) and forward it to
+Jaeger/Tempo.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Optional
+import aiohttp
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.methods import GetUpdates
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME  = "mugon-hr-bot"
+TRACE_FILE    = os.environ.get("TRACE_FILE", "logs/traces.jsonl")    # "" disables export
+SLOW_MS       = float(os.environ.get("TRACE_SLOW_MS", "1000"))        # outside OpenAI calls
+SLOW_GPT_MS   = float(os.environ.get("TRACE_SLOW_GPT_MS", "20000"))   # one OpenAI call
+SAMPLE_RATE   = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+MAX_MB        = float(os.environ.get("TRACE_MAX_MB", "100"))
+ROTATE_HOURS  = float(os.environ.get("TRACE_ROTATE_HOURS", "24"))
+BACKUPS       = int(os.environ.get("TRACE_BACKUPS", "7"))
+GPT_SPAN      = "openai.chat"
+MAX_SPANS     = 500        # per trace, guards against runaway loops
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """One timed operation; ``spans`` is shared by every span of a trace."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.spans: list[Span] = parent.spans if parent else []
+        self.attrs = attrs
+        self.error = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def fail(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(self)
+        if not self.parent_id:
+            _exporter.offer(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    span = _current.get()
+    return span.trace_id if span else ""
+
+
+def start_span(name: str, **attrs) -> Span:
+    """A child of the current span (or a new trace); caller must end() it."""
+    return Span(name, _current.get(), **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Open a span as the current one for the duration of the block."""
+    s = start_span(name, **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+# ---------------------------------------------------------------- export
+
+def _attr(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(spans: list[Span]) -> dict:
+    """One ExportTraceServiceRequest in OTLP/JSON encoding."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attr("service.name", SERVICE_NAME),
+                                    _attr("process.pid", os.getpid())]},
+        "scopeSpans": [{
+            "scope": {"name": "mugon.tracing"},
+            "spans": [{
+                "traceId":           s.trace_id,
+                "spanId":            s.span_id,
+                "parentSpanId":      s.parent_id,
+                "name":              s.name,
+                "kind":              1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano":   str(s.end_ns),
+                "attributes":        [_attr(k, v) for k, v in s.attrs.items() if v is not None],
+                "status":            {"code": 2, "message": s.error} if s.error else {"code": 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+class _Exporter:
+    """Tail sampler + background writer thread appending OTLP/JSON lines."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    def offer(self, root: Span) -> None:
+        if not self.path:
+            return
+        gpt_ms = [s.duration_ms for s in root.spans if s.name == GPT_SPAN]
+        keep = (root.duration_ms - sum(gpt_ms) >= SLOW_MS
+                or any(ms >= SLOW_GPT_MS for ms in gpt_ms)
+                or any(s.error for s in root.spans)
+                or random.random() < SAMPLE_RATE)
+        if not keep:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, name="trace-exporter",
+                                            daemon=True)
+            self._thread.start()
+        self._queue.put(list(root.spans))
+
+    def _write_loop(self) -> None:
+        # Imported here: logconfig imports this module
+        from logconfig import SizeTimeRotatingFileHandler
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        handler = SizeTimeRotatingFileHandler(self.path, int(MAX_MB * 1024 * 1024),
+                                              ROTATE_HOURS * 3600, BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        while True:
+            spans = self._queue.get()
+            # emit() rotates when due; write errors go to handleError, not the loop
+            handler.emit(logging.makeLogRecord(
+                {"msg": json.dumps(to_otlp(spans), ensure_ascii=False)}))
+
+
+_exporter = _Exporter(TRACE_FILE)
+
+
+def set_trace_file(path: str) -> None:
+    """Export to ``path`` instead of TRACE_FILE; call before the first trace ends."""
+    _exporter.path = path
+
+
+# ---------------------------------------------------------------- integrations
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer update middleware: root span per Telegram update."""
+
+    async def __call__(self, handler: Callable, event: TelegramObject, data: dict) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        with span("update", **{"update.id": event.update_id,
+                               "update.type": event.event_type,
+                               "user.id": user.id if user else None}):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: a span per Telegram Bot API call."""
+
+    async def __call__(self, make_request: Callable[..., Awaitable], bot, method):
+        if isinstance(method, GetUpdates):
+            # Long polls are slow by design and not part of any update
+            return await make_request(bot, method)
+        with span(f"telegram.{type(method).__name__}",
+                  **{"chat.id": getattr(method, "chat_id", None)}):
+            return await make_request(bot, method)
+
+
+class TracedStorage(BaseStorage):
+    """FSM storage wrapper: a span around every state/data read and write."""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        with span("fsm.set_state"):
+            await self.storage.set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        with span("fsm.get_state"):
+            return await self.storage.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        with span("fsm.set_data"):
+            await self.storage.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        with span("fsm.get_data"):
+            return await self.storage.get_data(key)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+def http_span_trace(prefix: str) -> aiohttp.TraceConfig:
+    """aiohttp trace config opening a span per request (AmoCRM)."""
+    trace = aiohttp.TraceConfig()
+
+    async def on_start(session, ctx, params):
+        ctx.span = start_span(f"{prefix} {params.method}",
+                              **{"http.method": params.method, "http.url": str(params.url)})
+
+    async def on_end(session, ctx, params):
+        ctx.span.set(**{"http.status_code": params.response.status})
+        ctx.span.end()
+
+    async def on_exception(session, ctx, params):
+        ctx.span.fail(params.exception)
+        ctx.span.end()
+
+    trace.on_request_start.append(on_start)
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_exception)
+    return trace
+
+
+AMO_SPANS = http_span_trace("amocrm")
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds ``trace_id`` to every record so log lines join up with traces."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        return True
@@ -0,0 +1,155 @@
+"""
+webhook.py - Webhook ingestion for MUGON HR Bot
+aiohttp server that verifies Telegram's secret token, acknowledges with 200
+immediately and hands the update to an in-process queue drained by workers.
+Acknowledged updates are never redelivered: on shutdown the queues get until
+the lifecycle deadline, and what is left after it is logged and dropped.
+
+Replicas are stateless (FSM lives in the shared RedisStorage), so throughput
+scales by running more processes behind a load balancer. Updates of one user
+always land in the same worker queue, which keeps their order inside a process.
+"""
+import asyncio
+import hmac
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Update fields that carry the acting user (used for per-user routing)
+USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def update_user_id(payload: dict) -> int:
+    """Extract the acting Telegram user id from a raw update (0 if none)."""
+    for field in USER_FIELDS:
+        event = payload.get(field)
+        if not event:
+            continue
+        user = event.get("from") or {}
+        if user.get("id"):
+            return int(user["id"])
+        chat = event.get("chat") or {}
+        if chat.get("id"):
+            return int(chat["id"])
+    return 0
+
+
+class WebhookServer:
+    """Telegram webhook endpoint with fast ack and per-user worker queues.
+
+    With ``sink`` set, payloads are handed to it instead of the local queues
+    (sharded mode forwards them to Redis streams).
+    """
+
+    def __init__(self, bot: Bot, dp: Optional[Dispatcher], secret: str,
+                 path: str = "/webhook", workers: int = 32, queue_size: int = 1000,
+                 sink: Optional[Callable[[dict], Awaitable[None]]] = None):
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.path = path
+        self.sink = sink
+        if sink is not None:
+            workers = 0
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.accepting = True
+        self.deadline: Optional[float] = None      # time.monotonic() bound for drain()
+        self._tasks: list[asyncio.Task] = []
+        self._handling: set = set()                # update ids being fed right now
+
+    def setup(self, app: web.Application) -> None:
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+
+    def stop_accepting(self, deadline: Optional[float] = None) -> None:
+        """Shutting down: new updates get 503 so Telegram redelivers them elsewhere.
+
+        ``deadline`` (time.monotonic()) bounds every later drain().
+        """
+        self.accepting = False
+        self.deadline = deadline
+
+    async def drain(self) -> bool:
+        """Wait until every acknowledged update has been handled, or the deadline.
+
+        Returns False if updates were still queued or in progress at the deadline.
+        """
+        joined = asyncio.gather(*(q.join() for q in self.queues))
+        timeout = None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+        try:
+            await asyncio.wait_for(joined, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not self.secret or not hmac.compare_digest(token, self.secret):
+            return web.Response(status=401)
+        if not self.accepting:
+            return web.Response(status=503)
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        if self.sink is not None:
+            try:
+                await self.sink(payload)
+            except Exception as e:
+                logger.error(f"Webhook sink failed for update {payload.get('update_id')}: {e}")
+                return web.Response(status=503)
+            return web.Response()
+
+        queue = self.queues[update_user_id(payload) % len(self.queues)]
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Non-2xx makes Telegram redeliver later instead of losing the update
+            logger.warning(f"Webhook queue full, rejecting update {payload.get('update_id')}")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            payload = await queue.get()
+            self._handling.add(payload.get("update_id"))
+            try:
+                update = Update.model_validate(payload, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Webhook update {payload.get('update_id')} failed: {e}")
+            finally:
+                self._handling.discard(payload.get("update_id"))
+                queue.task_done()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self.queues]
+        logger.info(f"Webhook workers started: {len(self._tasks)}")
+
+    async def _on_shutdown(self, app: web.Application) -> None:
+        # Finish what was already acknowledged, as far as the deadline allows
+        await self.drain()
+        lost = list(self._handling)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for queue in self.queues:
+            while not queue.empty():
+                lost.append(queue.get_nowait().get("update_id"))
+        if lost:
+            # Already acked with 200: Telegram will not send these again
+            logger.error(f"Shutdown deadline hit, {len(lost)} acknowledged webhook updates "
+                         f"dropped: {lost}")